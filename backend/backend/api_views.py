@@ -1,8 +1,37 @@
-from rest_framework import generics, permissions
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.models import User
+from marketplace.auth import revoke_token, revoke_user
 from .serializers import RegisterSerializer
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
-    permission_classes = [permissions.AllowAny]
\ No newline at end of file
+    permission_classes = [permissions.AllowAny]
+
+
+class LoginView(TokenObtainPairView):
+    throttle_scope = 'login'
+
+
+class LogoutView(APIView):
+    # Revokes the access token of the request and the refresh token from the body;
+    # with "all": true every token of the user.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('all'):
+            revoke_user(request.user.pk)
+        elif request.auth is not None:
+            revoke_token(request.auth)
+        if request.data.get('refresh'):
+            try:
+                revoke_token(RefreshToken(request.data['refresh']))
+            except TokenError:
+                raise ValidationError({'refresh': 'Недействительный токен'})
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -4,4 +4,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from marketplace.asgi import with_async_catalog  # noqa: E402
+
+# Catalog GETs are answered by the async views, everything else by Django as usual.
+application = with_async_catalog(django_application)
@@ -27,18 +27,29 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'marketplace.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'marketplace.routers.StickyPrimaryMiddleware',
+    'marketplace.throttling.RateLimitHeadersMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
 
+# Middleware of the async catalog reads under ASGI (marketplace.asgi). Each entry must
+# be async-capable: these requests should not leave the event loop for middleware.
+ASGI_CATALOG_MIDDLEWARE = [
+    'marketplace.middleware.RequestMetricsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'marketplace.throttling.RateLimitHeadersMiddleware',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -57,13 +68,53 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# Persistent connections, checked before reuse once a request is done with them.
+CONN_MAX_AGE = int(os.environ.get('MARKETPLACE_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas of the catalog (comma-separated SQLite files kept in sync outside
+# Django, e.g. by litestream). Tests mirror them to the primary.
+REPLICA_DATABASES = []
+for i, name in enumerate(filter(None, os.environ.get('MARKETPLACE_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{i}'] = {
+        **DATABASES['default'],
+        'NAME': name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{i}')
+
+DATABASE_ROUTERS = ['marketplace.routers.ReplicaRouter']
+
+# Opt-in SQLite tuning for small deployments (MARKETPLACE_SQLITE_PROFILE=tuned): WAL
+# lets readers run next to the writer, and write requests retry on lock errors.
+SQLITE_PROFILES = {
+    'default': {},
+    'tuned': {
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        'LOCK_RETRIES': 8,
+        'RETRY_BACKOFF': 0.005,
+    },
+}
+SQLITE_PROFILE = SQLITE_PROFILES[os.environ.get('MARKETPLACE_SQLITE_PROFILE', 'default')]
+
+# How long a user's reads stay on the primary after they wrote something.
+REPLICA_STICKY_SECONDS = 10
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -108,11 +159,152 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',    
+        'marketplace.auth.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
 ],
+
+    'DEFAULT_THROTTLE_CLASSES': [
+        'marketplace.throttling.ClientRateThrottle',
+        'marketplace.throttling.EndpointRateThrottle',
+    ],
+    # Reverse proxies in front of the app. Anonymous rate limits take the client IP from
+    # the X-Forwarded-For entry the last of them added; with 0 (no proxy) from
+    # REMOTE_ADDR, since any client can send the header itself.
+    'NUM_PROXIES': int(os.environ.get('MARKETPLACE_NUM_PROXIES', 0)),
+}
+
+# Token buckets per user (or IP for anonymous requests): "N/period" allows a burst of N
+# and refills N per period. user/anon cover every API request, the others their endpoint.
+RATE_LIMITS = {
+    'user': '1200/min',
+    'anon': '300/min',
+    'search': '60/min',
+    'checkout': '10/min',
+    'login': '10/min',
+    'export': '60/hour',
+}
+# local - buckets in process memory, limits hold per process; cache - in the marketplace
+# cache, shared by processes with its file or redis backend.
+RATE_LIMIT_BACKEND = os.environ.get('MARKETPLACE_RATE_LIMIT_BACKEND', 'local')
+RATE_LIMIT_MAX_KEYS = 100_000
+
+# ?search= results in rank order (no ?ordering=, no pagination) are the best this many.
+PRODUCT_SEARCH_MAX_RESULTS = 500
+
+PRODUCT_FEEDS_TTL = 300
+
+# Rows per query chunk of /api/products/export/; memory of an export is bounded by it.
+EXPORT_CHUNK_SIZE = 2000
+# Seconds an export stops short of now. updated_at is stamped before the writing
+# transaction commits, so a row stamped earlier but committed after the export read
+# would be missed by this export and, with ?since=, by the next one. Keep it above the
+# longest product write (an import_products chunk takes a few seconds).
+EXPORT_COMMIT_MARGIN = 60
+
+# Upper bounds of the price facet buckets (the last bucket is open-ended).
+PRODUCT_PRICE_FACETS = [500, 1000, 2500, 5000]
+
+PRODUCT_FACET_TAGS_LIMIT = 50
+
+# Facets of larger result sets are counted over the newest matches only
+# (the response then has facets_approximate: true).
+PRODUCT_FACET_SCAN_LIMIT = 100_000
+
+# Backend of the marketplace read cache (feeds, catalog generations, API responses):
+# lru - in-process, bounded by entries and bytes; file - shared by the processes of
+# one host; redis - shared by all hosts (needs the redis package).
+MARKETPLACE_CACHE = os.environ.get('MARKETPLACE_CACHE', 'lru')
+MARKETPLACE_CACHES = {
+    'lru': {
+        'BACKEND': 'marketplace.caching.LRUCache',
+        'LOCATION': 'marketplace',
+        'OPTIONS': {'MAX_ENTRIES': 10_000, 'MAX_BYTES': 64 * 1024 * 1024},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('MARKETPLACE_CACHE_DIR', os.path.join(BASE_DIR, '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {'default': MARKETPLACE_CACHES[MARKETPLACE_CACHE]}
+
+# Store of the catalog generations that key the read cache and the ETags. Every process
+# that writes products (workers, import_products, seed_data) has to move the same
+# generations, so it is shared even when the read cache is per process: file - the
+# processes of one host; redis - all hosts; local - in process memory, a single
+# process only (system check marketplace.W002).
+MARKETPLACE_GENERATIONS = os.environ.get(
+    'MARKETPLACE_GENERATIONS', 'redis' if MARKETPLACE_CACHE == 'redis' else 'file'
+)
+GENERATION_STORES = {
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('MARKETPLACE_GENERATIONS_DIR', os.path.join(BASE_DIR, '.generations')),
+        # A handful of keys: never cull them together with stale files.
+        'OPTIONS': {'MAX_ENTRIES': 10**9},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'KEY_PREFIX': 'generations',
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'generations',
+    },
+}
+CACHES['generations'] = GENERATION_STORES[MARKETPLACE_GENERATIONS]
+
+RESPONSE_CACHE_TTL = 60
+
+# Seconds between the per-process checks of the catalog against the database, which
+# catch writes that bypassed the model signals (see caching.reconcile); None turns them off.
+CATALOG_FINGERPRINT_INTERVAL = 1
+
+SINGLE_FLIGHT_TIMEOUT = 10
+
+# Cache-Control per viewset (by class name), overrides the viewset's cache_control,
+# e.g. {'ProductViewSet': {'public': True, 'max_age': 30}}.
+CACHE_CONTROL_POLICIES = {}
+
+BULK_MAX_ITEMS = 500
+
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+REQUEST_METRICS_SLOW_MS = 500
+REQUEST_METRICS_SLOW_QUERIES = 5
+
+# claims - request.user is built from the signed access token claims (id, username,
+# email, is_active) without a query; db - Simple JWT loads the user row per request.
+# Revoked tokens are refused in both modes (marketplace.auth).
+JWT_AUTH_MODE = os.environ.get('MARKETPLACE_JWT_AUTH', 'claims')
+# Seconds a checked token is trusted in-process before the denylist is asked again.
+JWT_USER_CACHE_TTL = 5
+JWT_USER_CACHE_SIZE = 10_000
+# Store of the token denylist, kept apart from the read cache so its churn cannot
+# evict a revocation: file - shared by the processes of one host; redis - shared by
+# all hosts, its own database (run it with maxmemory-policy noeviction). Claims mode
+# refuses an in-process store (system check marketplace.E001).
+JWT_REVOCATION_STORE = os.environ.get(
+    'MARKETPLACE_JWT_REVOCATIONS', 'redis' if MARKETPLACE_CACHE == 'redis' else 'file'
+)
+JWT_REVOCATION_STORES = {
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('MARKETPLACE_REVOCATIONS_DIR', os.path.join(BASE_DIR, '.revocations')),
+        # Culling would drop live revocations; expired ones are removed when read.
+        'OPTIONS': {'MAX_ENTRIES': 10**9},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('MARKETPLACE_REVOCATIONS_REDIS_URL', 'redis://127.0.0.1:6379/2'),
+    },
 }
+CACHES['revocations'] = JWT_REVOCATION_STORES[JWT_REVOCATION_STORE]
 
 DJOSER = {
     "USER_CREATE_PASSWORD_RETYPE": True,
@@ -155,8 +347,8 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=15),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=7),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "marketplace.auth.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "marketplace.auth.TokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
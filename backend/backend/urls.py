@@ -1,8 +1,9 @@
 
 from django.contrib import admin
 from django.urls import path, include, re_path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
-from .api_views import RegisterView
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
+from .api_views import LoginView, LogoutView, RegisterView
+from marketplace.metrics import metrics_view
 
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -24,13 +25,15 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('marketplace.urls')),
     path("api/register/", RegisterView.as_view(), name="register"),
-    path("api/login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("api/login/", LoginView.as_view(), name="token_obtain_pair"),
+    path("api/logout/", LogoutView.as_view(), name="logout"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path('auth/', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', LoginView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
+    path('metrics', metrics_view, name='metrics'),
     
     path('swagger.<format>/', sv.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', sv.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
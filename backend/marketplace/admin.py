@@ -1,29 +1,63 @@
+from django import forms
 from django.contrib import admin
-from .models import Category, Style, Product, Favorite, CartItem, Order, OrderItem
+from .models import Category, Style, Tag, Product, Favorite, CartItem, Order, OrderItem
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'created_at']
+    list_display = ['name', 'slug', 'products_count', 'created_at']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
 
 
 @admin.register(Style)
 class StyleAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug']
+    list_display = ['name', 'slug', 'products_count']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
 
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+
+
+class ProductAdminForm(forms.ModelForm):
+    # Tags go through Product.set_tags, which also updates search and the caches.
+    tag_list = forms.CharField(label='Теги', required=False, help_text='Через запятую, в порядке показа')
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['tag_list'].initial = ', '.join(self.instance.tag_names)
+
+    def clean_tag_list(self):
+        names = [n.strip() for n in self.cleaned_data['tag_list'].split(',') if n.strip()]
+        max_length = Tag._meta.get_field('name').max_length
+        if any(len(n) > max_length for n in names):
+            raise forms.ValidationError(f'Тег длиннее {max_length} символов')
+        return names
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
     list_display = ['name', 'category', 'style', 'price', 'rating', 'downloads', 'is_featured', 'created_at']
     list_filter = ['category', 'style', 'is_featured', 'created_at']
     search_fields = ['name', 'author', 'description']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['price', 'is_featured']
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if not change or 'tag_list' in form.changed_data:
+            form.instance.set_tags(form.cleaned_data['tag_list'])
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+
+URLCONF = 'marketplace.async_urls'
+
+
+class CatalogASGIHandler(ASGIHandler):
+    # Catalog reads of marketplace.async_urls behind ASGI_CATALOG_MIDDLEWARE only.
+    # The full MIDDLEWARE would cost a thread hop per MiddlewareMixin class.
+    def load_middleware(self, is_async=True):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+        handler = convert_exception_to_response(self._get_response_async)
+        for path in reversed(settings.ASGI_CATALOG_MIDDLEWARE):
+            handler = convert_exception_to_response(import_string(path)(handler))
+        self._middleware_chain = handler
+
+    def create_request(self, scope, body_file):
+        request, error = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = URLCONF
+        return request, error
+
+    def handles(self, scope):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return False
+        try:
+            resolve(scope['path'], urlconf=URLCONF)
+        except Resolver404:
+            return False
+        return True
+
+
+def with_async_catalog(application):
+    catalog = CatalogASGIHandler()
+
+    async def dispatch(scope, receive, send):
+        await (catalog if catalog.handles(scope) else application)(scope, receive, send)
+    return dispatch
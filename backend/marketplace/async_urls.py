@@ -0,0 +1,14 @@
+from django.urls import path
+from .async_views import (
+    CategoryListView, ProductDetailView, ProductFeaturedView, ProductListView, ProductPopularView, StyleListView,
+)
+
+# Served by marketplace.asgi in front of backend.urls under ASGI.
+urlpatterns = [
+    path('api/categories/', CategoryListView.as_view(), name='async-category-list'),
+    path('api/styles/', StyleListView.as_view(), name='async-style-list'),
+    path('api/products/', ProductListView.as_view(), name='async-product-list'),
+    path('api/products/featured/', ProductFeaturedView.as_view(), name='async-product-featured'),
+    path('api/products/popular/', ProductPopularView.as_view(), name='async-product-popular'),
+    path('api/products/<int:pk>/', ProductDetailView.as_view(), name='async-product-detail'),
+]
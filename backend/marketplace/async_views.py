@@ -0,0 +1,261 @@
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponse
+from django.utils.cache import cc_delim_re, get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views import View
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import auth, caching, fastjson, feeds, throttling
+from .conditional import validators
+from .models import Product
+from .routers import _read_db, choose_replica
+from .views import CategoryViewSet, ProductViewSet, StyleViewSet
+
+
+# Catalog reads of the ASGI deployment (see marketplace.asgi). A JSON GET with a Bearer
+# token, or anonymous, runs on the event loop: claims auth, rate limits, validators and
+# the response cache need no query, and a miss reads through the async ORM. Shared
+# stores (file, redis) are read in worker threads. Everything else (other
+# formats, session auth, search, facets, with_count, errors) is handed to the DRF
+# viewset, which answers it as it does under WSGI.
+
+PRODUCT_PARAMS = frozenset({
+    'category__slug', 'style__slug', 'is_featured', 'category', 'style', 'min_price', 'max_price',
+    'tags', 'tags_match', 'ordering', 'page_size', 'cursor', 'format',
+})
+
+
+def with_length(response):
+    # What CommonMiddleware adds under backend.urls; without it the body goes out chunked.
+    if not response.streaming and not response.has_header('Content-Length'):
+        response['Content-Length'] = str(len(response.content))
+    return response
+
+
+def json_response(body):
+    return HttpResponse(body, content_type='application/json')
+
+
+class AsyncCatalogView(View):
+    viewset = None
+    action = None
+    # Query params the async path understands; other requests go to the viewset.
+    params = frozenset({'format'})
+    http_method_names = ['get', 'head']
+
+    async def get(self, request, **kwargs):
+        user = await self.authenticate(request) if self.is_fast(request) else None
+        if user is None:
+            return await self.fallback(request, **kwargs)
+        view = self.make_viewset(request, user, kwargs)
+        try:
+            view.check_permissions(view.request)
+        except APIException:
+            if user.is_authenticated:
+                return await self.fallback(request, **kwargs)
+            # The viewset has authenticators, so DRF refuses anonymous requests this way.
+            return self.finalize(view, self.denied(view, NotAuthenticated()))
+        wait = await self.throttle(request, user, view)
+        if wait is not None:
+            return self.finalize(view, self.throttled(wait))
+        token = _read_db.set(choose_replica(user))
+        try:
+            response = await self.respond(request, view, kwargs)
+        except (APIException, DjangoValidationError):
+            response = None
+        finally:
+            _read_db.reset(token)
+        if response is None:
+            return await self.fallback(request, **kwargs)
+        return self.finalize(view, response)
+
+    def is_fast(self, request):
+        accept = request.headers.get('Accept', '*/*')
+        return (
+            ('*/*' in accept or 'application/json' in accept) and 'text/html' not in accept
+            and request.GET.get('format', 'json') == 'json'
+            and set(request.GET) <= self.params
+        )
+
+    async def authenticate(self, request):
+        # Anonymous, or a token whose claims are the whole user; the rest (other
+        # schemes, a session cookie, tokens to look up) needs the viewset.
+        backend = auth.ClaimsJWTAuthentication()
+        try:
+            header = backend.get_header(request)
+            if not header:
+                return None if settings.SESSION_COOKIE_NAME in request.COOKIES else AnonymousUser()
+            raw = backend.get_raw_token(header)
+            if not raw:
+                return None
+            token = backend.get_validated_token(raw)
+            if auth.mode() != 'claims' or not auth.has_claims(token):
+                return None
+            return await backend.aget_user(token)
+        except APIException:
+            return None
+
+    def make_viewset(self, request, user, kwargs):
+        view = self.viewset(action=self.action, format_kwarg=None, args=(), kwargs=kwargs)
+        # What ViewSetMixin.as_view binds, for the Allow header.
+        view.get = view.head = getattr(view, self.action)
+        view.request = Request(request)
+        view.request.user = user
+        return view
+
+    def finalize(self, view, response):
+        # The Allow and Vary headers APIView.finalize_response adds.
+        headers = view.default_response_headers
+        vary = headers.pop('Vary', None)
+        for key, value in headers.items():
+            response[key] = value
+        if vary is not None:
+            patch_vary_headers(response, cc_delim_re.split(vary))
+        return with_length(response)
+
+    async def throttle(self, request, user, view):
+        # ClientRateThrottle and EndpointRateThrottle: per user, or per client IP.
+        client = throttling.ClientRateThrottle()
+        ident = f'u{user.pk}' if user.is_authenticated else client.get_ident(view.request)
+        scopes = [client.get_scope(view.request, view), throttling.EndpointRateThrottle().get_scope(view.request, view)]
+        waits = [w for w in [await throttling.aconsume(request, s, ident) for s in scopes] if w is not None]
+        return max(waits) if waits else None
+
+    def throttled(self, wait):
+        response = json_response(fastjson.dumps({'detail': str(Throttled(wait).detail)}))
+        response.status_code = 429
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    def denied(self, view, exc):
+        # APIView.handle_exception of NotAuthenticated.
+        response = json_response(fastjson.dumps({'detail': str(exc.detail)}))
+        header = view.get_authenticate_header(view.request)
+        if header:
+            response['WWW-Authenticate'] = header
+        response.status_code = exc.status_code if header else 403
+        return response
+
+    async def respond(self, request, view, kwargs):
+        # ConditionalMixin and CachedReadMixin of the viewset, with the same keys.
+        if caching.fingerprints_due(view.generations):
+            # The database check needs the thread of the request's connection.
+            etag, last_modified, key = await sync_to_async(self.keys)(request, view)
+        elif caching.blocks(caching.generations_store()):
+            etag, last_modified, key = await sync_to_async(self.keys, thread_sensitive=False)(request, view)
+        else:
+            etag, last_modified, key = self.keys(request, view)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await self.cached(request, view, kwargs, key)
+            if response is None:
+                return None
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, **view.get_cache_control())
+        return response
+
+    def keys(self, request, view):
+        # Everything that reads the generations, in one thread when their store blocks.
+        caching.reconcile(view.generations)
+        etag, last_modified = validators(view.generations, 'json', request.get_full_path())
+        return etag, last_modified, caching.response_key(request, view.generations)
+
+    async def cached(self, request, view, kwargs, key):
+        value = await caching.acall(caching.cache, 'get', key)
+        caching.requests_total.inc(self.viewset.__name__, 'miss' if value is None else 'hit')
+        if value is not None:
+            content_type, content = value
+            return HttpResponse(content, content_type=content_type)
+        response = await self.build(request, view, kwargs)
+        if response is not None and response.status_code == 200:
+            ttl = getattr(settings, 'RESPONSE_CACHE_TTL', 60)
+            await caching.acall(caching.cache, 'set', key, (response['Content-Type'], response.content), ttl)
+        return response
+
+    async def build(self, request, view, kwargs):
+        raise NotImplementedError
+
+    async def rows(self, view, queryset, paginate=True):
+        # FastListMixin.fast_response without list extras.
+        rs = view.row_serializer
+        values = rs.values(queryset)
+        page = view.paginator.page_queryset(values, view.request, view) if paginate and view.paginator else None
+        if page is None:
+            return json_response(rs.render(*await rs.arows(values)))
+        rows, related = await rs.arows(page)
+        body = view.paginator.get_paginated_data(rs.to_representation(view.paginator.page_rows(rows), related))
+        return json_response(fastjson.dumps(body))
+
+    async def fallback(self, request, **kwargs):
+        view = self.viewset.as_view({'get': self.action})
+
+        def run():
+            response = view(request, **kwargs)
+            return response.render() if hasattr(response, 'render') else response
+        return with_length(await sync_to_async(run)())
+
+
+class CategoryListView(AsyncCatalogView):
+    viewset = CategoryViewSet
+    action = 'list'
+
+    async def build(self, request, view, kwargs):
+        return await self.rows(view, view.filter_queryset(view.get_queryset()))
+
+
+class StyleListView(CategoryListView):
+    viewset = StyleViewSet
+
+
+class ProductListView(AsyncCatalogView):
+    viewset = ProductViewSet
+    action = 'list'
+    params = PRODUCT_PARAMS
+
+    async def build(self, request, view, kwargs):
+        return await self.rows(view, view.filter_queryset(view.get_queryset()))
+
+
+class ProductFeaturedView(AsyncCatalogView):
+    viewset = ProductViewSet
+    action = 'featured'
+    params = PRODUCT_PARAMS
+
+    async def build(self, request, view, kwargs):
+        if not request.GET:
+            return json_response(await feeds.apeek('featured') or await sync_to_async(feeds.get)('featured'))
+        return await self.rows(view, view.get_queryset().filter(is_featured=True))
+
+
+class ProductPopularView(AsyncCatalogView):
+    viewset = ProductViewSet
+    action = 'popular'
+    params = PRODUCT_PARAMS
+
+    async def build(self, request, view, kwargs):
+        if not request.GET:
+            return json_response(await feeds.apeek('popular') or await sync_to_async(feeds.get)('popular'))
+        items = view.get_queryset().order_by('-downloads', '-id')[:feeds.POPULAR_SIZE]
+        return await self.rows(view, items, paginate=False)
+
+
+class ProductDetailView(AsyncCatalogView):
+    viewset = ProductViewSet
+    action = 'retrieve'
+
+    async def build(self, request, view, kwargs):
+        try:
+            product = await view.filter_queryset(view.get_queryset()).aget(pk=kwargs['pk'])
+        except Product.DoesNotExist:
+            return None
+        return json_response(JSONRenderer().render(view.get_serializer(product).data))
@@ -0,0 +1,202 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .caching import acall
+
+
+# Signed into every token next to the user id. The order follows the User fields,
+# as Model.from_db expects.
+CLAIMS = ('username', 'email', 'is_active')
+
+# jti -> (monotonic deadline, (id, *CLAIMS)) of recently checked access tokens.
+_users = {}
+
+
+def mode():
+    return getattr(settings, 'JWT_AUTH_MODE', 'db')
+
+
+def store():
+    return caches['revocations']
+
+
+def _token_key(jti):
+    return f'marketplace:jwt:denied:{jti}'
+
+
+def _user_key(user_id):
+    return f'marketplace:jwt:revoked:{user_id}'
+
+
+def _forget(user_id):
+    for jti, (_, values) in list(_users.items()):
+        if str(values[0]) == str(user_id):
+            _users.pop(jti, None)
+
+
+def revoke_token(token):
+    # Kept only until the token expires anyway, so the denylist stays small.
+    ttl = int(token['exp'] - time.time()) + 1
+    if ttl > 0:
+        store().set(_token_key(token[api_settings.JTI_CLAIM]), 1, ttl)
+    _users.pop(token[api_settings.JTI_CLAIM], None)
+
+
+def revoke_user(user_id):
+    # One timestamp instead of a key per token: everything issued before this second is
+    # refused. iat has whole seconds, so a token issued in the same second, like a login
+    # right after a password change, stays valid.
+    ttl = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    store().set(_user_key(user_id), int(time.time()), ttl)
+    _forget(user_id)
+
+
+def _revocation_keys(token):
+    return [_token_key(token.get(api_settings.JTI_CLAIM)), _user_key(token.get(api_settings.USER_ID_CLAIM))]
+
+
+def _revoked(token, found):
+    token_key, user_key = _revocation_keys(token)
+    return token_key in found or token.get('iat', 0) < found.get(user_key, -1)
+
+
+def is_revoked(token):
+    return _revoked(token, store().get_many(_revocation_keys(token)))
+
+
+async def ais_revoked(token):
+    return _revoked(token, await acall(store(), 'get_many', _revocation_keys(token)))
+
+
+def has_claims(token):
+    return all(c in token for c in CLAIMS)
+
+
+def stamp(token, user):
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+class ClaimsRefreshToken(RefreshToken):
+    # The access token copies the claims from its refresh token.
+    @classmethod
+    def for_user(cls, user):
+        return stamp(super().for_user(user), user)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    # JWT_AUTH_MODE = 'claims' builds request.user from the token claims without a
+    # query. Other User fields stay deferred and load on first access, and save()
+    # writes only the loaded ones. Checked tokens are trusted in-process for
+    # JWT_USER_CACHE_TTL seconds before the denylist is asked again.
+    def get_user(self, validated_token):
+        if mode() != 'claims':
+            if is_revoked(validated_token):
+                raise AuthenticationFailed('Токен отозван', code='token_revoked')
+            return super().get_user(validated_token)
+
+        user = self.remembered(validated_token)
+        if user is None:
+            if is_revoked(validated_token):
+                raise AuthenticationFailed('Токен отозван', code='token_revoked')
+            user = self.remember(validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        # get_user of the async catalog views, for tokens with claims only.
+        user = self.remembered(validated_token)
+        if user is None:
+            if await ais_revoked(validated_token):
+                raise AuthenticationFailed('Токен отозван', code='token_revoked')
+            user = self.remember(validated_token)
+        return user
+
+    def remembered(self, validated_token):
+        hit = _users.get(validated_token.get(api_settings.JTI_CLAIM))
+        return self.user_from(hit[1]) if hit is not None and hit[0] >= time.monotonic() else None
+
+    def remember(self, validated_token):
+        if has_claims(validated_token):
+            values = (validated_token[api_settings.USER_ID_CLAIM], *(validated_token[c] for c in CLAIMS))
+        else:
+            # Issued before the claims were added: one lookup per TTL.
+            user = super().get_user(validated_token)
+            values = (user.pk, *(getattr(user, c) for c in CLAIMS))
+        if not values[-1]:
+            raise AuthenticationFailed('Пользователь неактивен', code='user_inactive')
+        if len(_users) >= getattr(settings, 'JWT_USER_CACHE_SIZE', 10_000):
+            _users.clear()
+        ttl = getattr(settings, 'JWT_USER_CACHE_TTL', 5)
+        _users[validated_token.get(api_settings.JTI_CLAIM)] = (time.monotonic() + ttl, values)
+        return self.user_from(values)
+
+    def user_from(self, values):
+        model = get_user_model()
+        return model.from_db(DEFAULT_DB_ALIAS, ('id', *CLAIMS), (model._meta.pk.to_python(values[0]), *values[1:]))
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    # Refuses revoked refresh tokens and signs the current claims of the user into
+    # the new access token. The denylist stands in for the blacklist app on rotation.
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_revoked(refresh):
+            raise InvalidToken('Токен отозван')
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        stamp(refresh, user)
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                revoke_token(refresh)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+
+@checks.register(checks.Tags.security)
+def check_revocation_store(app_configs, **kwargs):
+    # A revocation in process memory reaches one worker only, and claims mode has no
+    # user query to notice a deactivation or a password change.
+    if mode() == 'claims' and isinstance(store(), (LocMemCache, DummyCache)):
+        return [checks.Error(
+            'JWT_AUTH_MODE = "claims" требует общего хранилища отзывов токенов',
+            hint='Задайте MARKETPLACE_JWT_REVOCATIONS=file или redis (CACHES["revocations"])',
+            id='marketplace.E001',
+        )]
+    return []
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def revoke_on_credentials_change(sender, instance, created, raw=False, **kwargs):
+    # set_password() leaves _password set until save() returns.
+    if created or raw:
+        return
+    if not instance.is_active or getattr(instance, '_password', None) is not None:
+        revoke_user(instance.pk)
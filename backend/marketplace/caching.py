@@ -0,0 +1,285 @@
+import hashlib
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+from .metrics import Counter
+
+
+GENERATIONS = ('products', 'taxonomies')
+
+requests_total = Counter(
+    'marketplace_response_cache_total', 'Запросы к кешу ответов API', ['view', 'result']
+)
+
+_sizes = {}
+
+
+class LRUCache(LocMemCache):
+    # LocMemCache is already LRU by entry count; this also bounds the total size of
+    # the pickled values with OPTIONS['MAX_BYTES'].
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_bytes = int(params.get('OPTIONS', {}).get('MAX_BYTES', 64 * 1024 * 1024))
+        self._size = _sizes.setdefault(name, [0])
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        if len(value) > self._max_bytes:
+            return
+        while self._cache and (
+            len(self._cache) >= self._max_entries or self._size[0] + len(value) > self._max_bytes
+        ):
+            self._delete(next(reversed(self._cache)))
+        self._cache[key] = value
+        self._cache.move_to_end(key, last=False)
+        self._expire_info[key] = self.get_backend_timeout(timeout)
+        self._size[0] += len(value)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if self._has_expired(key):
+                self._delete(key)
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(self._cache[key]) + delta
+            expires = self._expire_info[key]
+            self._set(key, pickle.dumps(value, self.pickle_protocol))
+            self._expire_info[key] = expires
+        return value
+
+    def _delete(self, key):
+        value = self._cache.get(key)
+        if not super()._delete(key):
+            return False
+        self._size[0] -= len(value)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._size[0] = 0
+
+
+# Generations are nanosecond timestamps moved forward on every change. Keys embed
+# them, so invalidation never has to find old entries, and a lost generation key
+# just starts a new one instead of reviving stale data. They live in
+# CACHES['generations'], shared by all the processes that write.
+
+def generations_store():
+    return caches['generations']
+
+
+def _generation_key(name):
+    return f'marketplace:generation:{name}'
+
+
+def generation(name):
+    return generations_store().get_or_set(_generation_key(name), time.time_ns, None)
+
+
+def invalidate(*names, using=None):
+    # After the commit of the write: a read between the bump and the commit would store
+    # the old rows under the new generation. Outside a transaction it runs at once.
+    transaction.on_commit(lambda: _bump(names or GENERATIONS), using=using)
+
+
+def _bump(names):
+    store = generations_store()
+    for name in names:
+        old = store.get(_generation_key(name)) or 0
+        store.set(_generation_key(name), max(time.time_ns(), old + 1), None)
+
+
+# Writes that never reach the signals (raw SQL, another application on the database, a
+# process killed between its commit and the bump) are caught by a cheap aggregate per
+# generation, taken at most every CATALOG_FINGERPRINT_INTERVAL seconds per process: when
+# it differs from the one stored next to the generation, the generation moves.
+FINGERPRINTS = {}
+_fingerprinted = {}
+
+
+def fingerprint(name):
+    def register(func):
+        FINGERPRINTS[name] = func
+        return func
+    return register
+
+
+def fingerprints_due(names):
+    interval = getattr(settings, 'CATALOG_FINGERPRINT_INTERVAL', 1)
+    if interval is None:
+        return []
+    now = time.monotonic()
+    return [n for n in names if n in FINGERPRINTS and now - _fingerprinted.get(n, -interval) >= interval]
+
+
+def reconcile(names):
+    store = generations_store()
+    for name in fingerprints_due(names):
+        _fingerprinted[name] = time.monotonic()
+        value = FINGERPRINTS[name]()
+        key = f'marketplace:fingerprint:{name}'
+        if store.get(key) != value:
+            store.set(key, value, None)
+            _bump([name])
+
+
+@checks.register(checks.Tags.caches)
+def check_generations_store(app_configs, **kwargs):
+    if isinstance(generations_store(), (LocMemCache, DummyCache)):
+        return [checks.Warning(
+            'Поколения каталога хранятся в памяти процесса: записи других процессов '
+            '(воркеры, import_products) не сбросят кеш ответов и ETag этого процесса',
+            hint='Для нескольких процессов задайте MARKETPLACE_GENERATIONS=file или redis',
+            id='marketplace.W002',
+        )]
+    return []
+
+
+def blocks(store):
+    # Everything but process memory does I/O, which must stay off the event loop.
+    return not isinstance(store, (LocMemCache, DummyCache))
+
+
+async def acall(store, method, *args):
+    # store.<method>(*args) from async code: in a worker thread for stores that block, a
+    # direct call for the in-process ones. Not thread-sensitive like BaseCache.aget():
+    # cache reads need no DB connection, and would queue on one thread.
+    func = getattr(store, method)
+    return await sync_to_async(func, thread_sensitive=False)(*args) if blocks(store) else func(*args)
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+@contextmanager
+def _local_flight(key):
+    with _flights_lock:
+        flight = _flights.setdefault(key, [threading.Lock(), 0])
+        flight[1] += 1
+    try:
+        with flight[0]:
+            yield
+    finally:
+        with _flights_lock:
+            flight[1] -= 1
+            if not flight[1]:
+                del _flights[key]
+
+
+# Cache-aside get where only one caller recomputes a missing value: threads of this
+# process queue on a local lock, other processes poll behind a cache.add() lock
+# (taken over after SINGLE_FLIGHT_TIMEOUT). compute() returns (value, cacheable).
+def single_flight(key, compute, timeout):
+    value = cache.get(key)
+    if value is not None:
+        return value, True
+    wait = getattr(settings, 'SINGLE_FLIGHT_TIMEOUT', 10)
+    with _local_flight(key):
+        value = cache.get(key)
+        if value is not None:
+            return value, True
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + wait
+        owner = cache.add(lock, 1, wait)
+        while not owner and time.monotonic() < deadline:
+            time.sleep(0.01)
+            value = cache.get(key)
+            if value is not None:
+                return value, True
+            owner = cache.add(lock, 1, wait)
+        try:
+            value, cacheable = compute()
+            if cacheable:
+                cache.set(key, value, timeout)
+        finally:
+            if owner:
+                cache.delete(lock)
+        return value, False
+
+
+# Blank or not, these switch the pagination of a list on (see pagination), so their
+# presence stays in the key.
+PRESENCE_PARAMS = ('page_size', 'cursor', 'with_count')
+
+
+def normalize_params(params, ignore=()):
+    items = []
+    for k in sorted(params):
+        if k in ignore:
+            continue
+        values = sorted(v.strip() for v in params.getlist(k) if v.strip())
+        if k == 'search':
+            values = [' '.join(v.lower().split()) for v in values]
+        if values or k in PRESENCE_PARAMS:
+            items.append((k, values))
+    return items
+
+
+def response_key(request, generations):
+    parts = [
+        request.build_absolute_uri(request.path),
+        *(str(generation(name)) for name in generations),
+        repr(normalize_params(request.GET)),
+    ]
+    return 'marketplace:response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def cached(method):
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.accepted_renderer.format != 'json':
+            return method(self, request, *args, **kwargs)
+
+        key = response_key(request, self.generations)
+        holder = {}
+
+        def compute():
+            response = method(self, request, *args, **kwargs)
+            holder['response'] = response
+            if response.status_code != 200 or response.streaming:
+                return None, False
+            if isinstance(response, Response):
+                # What finalize_response would do, so the body can be stored now.
+                response.accepted_renderer = request.accepted_renderer
+                response.accepted_media_type = request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+            return (response['Content-Type'], response.content), True
+
+        value, hit = single_flight(key, compute, getattr(settings, 'RESPONSE_CACHE_TTL', 60))
+        requests_total.inc(type(self).__name__, 'hit' if hit else 'miss')
+        if 'response' in holder:
+            return holder['response']
+        content_type, content = value
+        return HttpResponse(content, content_type=content_type)
+    return wrapper
+
+
+class CachedReadMixin:
+    # JSON GET responses are cached under the generations they depend on.
+    generations = GENERATIONS
+
+    @cached
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
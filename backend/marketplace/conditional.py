@@ -0,0 +1,59 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .caching import GENERATIONS, generation, reconcile
+
+
+def validators(generations, format, full_path):
+    versions = [generation(name) for name in generations]
+    key = ':'.join([*map(str, versions), format, full_path])
+    # Last-Modified has whole seconds: a second change within the current second would
+    # keep the date and answer If-Modified-Since with a stale 304. Until the second is
+    # over only the ETag validates.
+    seconds = max(versions) // 1_000_000_000
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"', seconds if seconds < int(time.time()) else None
+
+
+def conditional(method):
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, **self.get_cache_control())
+        return response
+    return wrapper
+
+
+class ConditionalMixin:
+    # ETag/Last-Modified from the catalog generations (nanosecond timestamps, see
+    # caching) the payload depends on; a match returns 304 before any query or
+    # serialization; writes the signals missed are found by caching.reconcile.
+    generations = GENERATIONS
+    cache_control = {'private': True, 'no_cache': True}
+
+    def get_validators(self, request):
+        reconcile(self.generations)
+        return validators(self.generations, request.accepted_renderer.format, request.get_full_path())
+
+    def get_cache_control(self):
+        policies = getattr(settings, 'CACHE_CONTROL_POLICIES', {})
+        return policies.get(type(self).__name__, self.cache_control)
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
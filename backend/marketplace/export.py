@@ -0,0 +1,113 @@
+import csv
+import io
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer
+
+from .fastjson import PRODUCT_EXPORT, dumps
+
+
+# Streaming catalog export: .values() rows in chunks of EXPORT_CHUNK_SIZE, tags loaded
+# per chunk, so memory does not grow with the catalog. Rows come in (updated_at, id)
+# order; ?since= with the X-Export-Next-Since of the previous export gives the rows
+# changed in between.
+
+class NDJSONRenderer(BaseRenderer):
+    # Rows are streamed by export_response(); renderers only pick the format and
+    # render error bodies.
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return dumps(data) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        keys = list(rows[0]) if rows else []
+        return csv_rows([keys]) + csv_rows([cell(row.get(k)) for k in keys] for row in rows)
+
+
+def cell(value):
+    if isinstance(value, list):
+        return ','.join(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else value
+
+
+def csv_rows(rows):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerows(rows)
+    return buf.getvalue().encode()
+
+
+def parse_since(value):
+    if not value:
+        return None
+    try:
+        # An unescaped "+00:00" arrives as " 00:00".
+        since = parse_datetime(value) or parse_datetime(value.replace(' ', '+'))
+    except ValueError:
+        since = None
+    if since is None:
+        raise ValidationError({'since': 'Ожидается дата и время в ISO 8601, например 2024-01-31T12:00:00Z'})
+    return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def ndjson_lines(items):
+    return b''.join(dumps(item) + b'\n' for item in items)
+
+
+def csv_lines(items):
+    keys = PRODUCT_EXPORT.keys
+    return csv_rows([cell(item[k]) for k in keys] for item in items)
+
+
+def stream(queryset, format, chunk_size):
+    rs = PRODUCT_EXPORT
+    lines = csv_lines if format == 'csv' else ndjson_lines
+    if format == 'csv':
+        yield csv_rows([rs.keys])
+    rows = rs.values(queryset).iterator(chunk_size=chunk_size)
+    for chunk in chunks(rows, chunk_size):
+        yield lines(rs.to_representation(chunk, rs.load_related(chunk, queryset.db)))
+
+
+def export_response(queryset, format, since=None):
+    # "until" is fixed before the first row: rows saved during the export go to the next
+    # one. It lags by EXPORT_COMMIT_MARGIN, so rows of transactions still open now are
+    # committed before an export covers their updated_at.
+    until = timezone.now() - timedelta(seconds=getattr(settings, 'EXPORT_COMMIT_MARGIN', 60))
+    queryset = queryset.filter(updated_at__lt=until)
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since)
+    # The body is read after the view returns: pin the database chosen for this request.
+    # Prefetches do nothing for .values() rows, and iterator() would run them per chunk.
+    queryset = queryset.using(queryset.db).prefetch_related(None).order_by('updated_at', 'id')
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    renderer = CSVRenderer if format == 'csv' else NDJSONRenderer
+    response = StreamingHttpResponse(
+        stream(queryset, format, chunk_size),
+        content_type=renderer.media_type + ('; charset=utf-8' if format == 'csv' else ''),
+    )
+    response['Content-Disposition'] = f'attachment; filename="products.{renderer.format}"'
+    response['X-Export-Next-Since'] = until.isoformat().replace('+00:00', 'Z')
+    return response
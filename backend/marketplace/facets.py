@@ -0,0 +1,119 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+
+from . import caching
+from .models import Category, Product, ProductTag, Style
+
+
+# Params that page or order the list without changing which products match.
+IGNORED_PARAMS = {'ordering', 'cursor', 'page_size', 'with_count', 'facets', 'format'}
+
+
+def parse(value):
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if not name or name in names:
+            continue
+        if name not in FACETS:
+            raise ValidationError({'facets': f'Неизвестный фасет «{name}», доступны: {", ".join(FACETS)}'})
+        names.append(name)
+    return names
+
+
+def _taxonomy_items(rows):
+    items = [{'id': pk, 'slug': slug, 'name': name, 'count': n} for pk, slug, name, n in rows]
+    return sorted(items, key=lambda i: (-i['count'], i['name']))
+
+
+def _taxonomy(field):
+    def count(queryset):
+        return _taxonomy_items(
+            queryset.order_by().filter(**{f'{field}__isnull': False})
+            .values_list(f'{field}_id', f'{field}__slug', f'{field}__name').annotate(n=Count('pk'))
+        )
+    return count
+
+
+def _stored_taxonomy(model):
+    def count():
+        return _taxonomy_items(
+            model.objects.filter(products_count__gt=0).values_list('pk', 'slug', 'name', 'products_count')
+        )
+    return count
+
+
+def price(queryset):
+    edges = getattr(settings, 'PRODUCT_PRICE_FACETS', [500, 1000, 2500, 5000])
+    bounds = list(zip([0, *edges], [*edges, None]))
+    counts = queryset.order_by().aggregate(**{
+        f'b{i}': Count('pk', filter=Q(price__gte=lo) & (Q(price__lt=hi) if hi is not None else Q()))
+        for i, (lo, hi) in enumerate(bounds)
+    })
+    return [{'min': lo, 'max': hi, 'count': counts[f'b{i}']} for i, (lo, hi) in enumerate(bounds)]
+
+
+def _featured_items(yes, no):
+    return [{'value': v, 'count': n} for v, n in ((True, yes), (False, no)) if n]
+
+
+def featured(queryset):
+    rows = dict(queryset.order_by().values_list('is_featured').annotate(n=Count('pk')))
+    return _featured_items(rows.get(True, 0), rows.get(False, 0))
+
+
+def stored_featured():
+    # The partial featured index answers this without a table scan.
+    total = sum(Category.objects.values_list('products_count', flat=True))
+    yes = Product.objects.filter(is_featured=True).count()
+    return _featured_items(yes, total - yes)
+
+
+def tags(queryset):
+    limit = getattr(settings, 'PRODUCT_FACET_TAGS_LIMIT', 50)
+    rows = (
+        ProductTag.objects.using(queryset.db).filter(product_id__in=queryset.order_by().values('pk'))
+        .values_list('tag__name').annotate(n=Count('pk')).order_by('-n', 'tag__name')[:limit]
+    )
+    return [{'value': v, 'count': n} for v, n in rows]
+
+
+FACETS = {
+    'category': _taxonomy('category'),
+    'style': _taxonomy('style'),
+    'price': price,
+    'tags': tags,
+    'featured': featured,
+}
+# Exact whole-catalog counts kept by the products_count counters.
+STORED = {
+    'category': _stored_taxonomy(Category),
+    'style': _stored_taxonomy(Style),
+    'featured': stored_featured,
+}
+
+
+def compute(queryset, names):
+    unfiltered = not queryset.query.where.children
+    scanned = [n for n in names if not (unfiltered and n in STORED)]
+    # Bound the scan: past PRODUCT_FACET_SCAN_LIMIT matches, count the newest ones only.
+    limit = getattr(settings, 'PRODUCT_FACET_SCAN_LIMIT', 100_000)
+    approximate = bool(scanned and limit and queryset.order_by()[:limit + 1].count() > limit)
+    scope = queryset
+    if approximate:
+        scope = Product.objects.filter(pk__in=queryset.order_by('-pk').values('pk')[:limit])
+    result = {n: STORED[n]() if n not in scanned else FACETS[n](scope) for n in names}
+    return {'facets': result, 'facets_approximate': approximate}
+
+
+def counts(queryset, names, params):
+    # Cached per filter set, so ordering and cursor pages share one computation.
+    key = [repr(caching.normalize_params(params, IGNORED_PARAMS)), ','.join(names)]
+    key += [str(caching.generation(g)) for g in caching.GENERATIONS]
+    key = 'marketplace:facets:' + hashlib.md5('|'.join(key).encode()).hexdigest()
+    ttl = getattr(settings, 'RESPONSE_CACHE_TTL', 60)
+    value, _ = caching.single_flight(key, lambda: (compute(queryset, names), True), ttl)
+    return value
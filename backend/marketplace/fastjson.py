@@ -0,0 +1,179 @@
+import json
+from decimal import Decimal
+
+from django.db import connections, models, router
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from .metrics import timed
+from .models import Category, Product, ProductTag, Style
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Read path for hot list endpoints: .values() rows are turned into plain dicts and
+# encoded in one call, skipping per-field DRF objects. The bytes are the same as
+# ModelSerializer + JSONRenderer produce (see FastJSONTests).
+
+@timed
+def dumps(data):
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    # Same escaping as JSONRenderer, these break inline <script> tags.
+    return body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def _decimal(field):
+    q = Decimal(1).scaleb(-field.decimal_places)
+    if not api_settings.COERCE_DECIMAL_TO_STRING:
+        return lambda v: None if v is None else float(v.quantize(q))
+    return lambda v: None if v is None else '{:f}'.format(v.quantize(q))
+
+
+def _datetime(field):
+    tz = timezone.get_current_timezone()
+
+    def convert(v):
+        if v is None:
+            return None
+        if v.tzinfo is not None:
+            v = v.astimezone(tz)
+        v = v.isoformat()
+        return v[:-6] + 'Z' if v.endswith('+00:00') else v
+    return convert
+
+
+CONVERTERS = {
+    models.DecimalField: _decimal,
+    models.DateTimeField: _datetime,
+}
+
+
+class Related:
+    # A to-many value loaded for the whole page in one extra query, like prefetch_related.
+    # aload is the same through the async ORM.
+    def __init__(self, load, aload):
+        self.load = load
+        self.aload = aload
+
+
+def _tag_names(ids, using):
+    tags = {}
+    step = connections[using].features.max_query_params or len(ids)
+    for i in range(0, len(ids), step):
+        rows = ProductTag.objects.using(using).filter(product_id__in=ids[i:i + step]).order_by('product_id', 'position')
+        for pk, name in rows.values_list('product_id', 'tag__name'):
+            tags.setdefault(pk, []).append(name)
+    return tags
+
+
+async def _atag_names(ids, using):
+    tags = {}
+    step = connections[using].features.max_query_params or len(ids)
+    for i in range(0, len(ids), step):
+        rows = ProductTag.objects.using(using).filter(product_id__in=ids[i:i + step]).order_by('product_id', 'position')
+        # values(), not values_list(): Django 4.2 runs the values_list() query before
+        # aiterator() leaves the event loop.
+        async for row in rows.values('product_id', 'tag__name').aiterator():
+            tags.setdefault(row['product_id'], []).append(row['tag__name'])
+    return tags
+
+
+class RowSerializer:
+    def __init__(self, model, fields, omit_empty_relations=True):
+        self.keys = [k for k, _ in fields]
+        self.related = [(k, lookup) for k, lookup in fields if isinstance(lookup, Related)]
+        # Related keys hold the row id until the page's values are loaded.
+        fields = [(k, 'id' if isinstance(lookup, Related) else lookup) for k, lookup in fields]
+        self.lookups = [lookup for _, lookup in fields]
+        self.converters = []
+        # DRF leaves out a source='fk.attr' field when the relation is empty. A NULL in
+        # a NOT NULL column across a join can only mean that.
+        self.optional = []
+        for key, lookup in fields:
+            field = self.resolve(model, lookup)
+            if omit_empty_relations and '__' in lookup and not field.null:
+                self.optional.append(key)
+            make = next((f for cls, f in CONVERTERS.items() if isinstance(field, cls)), None)
+            if make:
+                self.converters.append((key, make, field))
+
+    @staticmethod
+    def resolve(model, lookup):
+        *path, name = lookup.split('__')
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(name)
+
+    def values(self, queryset):
+        return queryset.values(*self.lookups)
+
+    async def arows(self, queryset):
+        # Runs a .values() queryset and loads its related values through the async
+        # ORM, for to_representation(rows, related). Prefetches have nothing to do on
+        # .values() rows, but aiterator() refuses them.
+        rows = [row async for row in queryset.prefetch_related(None).aiterator()]
+        ids = [r['id'] for r in rows]
+        related = [(k, await lookup.aload(ids, queryset.db) if ids else {}) for k, lookup in self.related]
+        return rows, related
+
+    def load_related(self, rows, using):
+        ids = [r['id'] for r in rows]
+        return [(k, lookup.load(ids, using) if ids else {}) for k, lookup in self.related]
+
+    @timed
+    def to_representation(self, rows, related=None):
+        keys, lookups, optional = self.keys, self.lookups, self.optional
+        # Built per call: they capture the active time zone and settings.
+        converters = [(k, make(field)) for k, make, field in self.converters]
+        if related is None:
+            related = []
+            if self.related:
+                using = getattr(rows, 'db', None) or router.db_for_read(ProductTag)
+                rows = list(rows)
+                related = self.load_related(rows, using)
+        data = []
+        for row in rows:
+            item = {k: row[l] for k, l in zip(keys, lookups)}
+            for k, convert in converters:
+                item[k] = convert(item[k])
+            for k, values in related:
+                item[k] = values.get(item[k], [])
+            for k in optional:
+                if item[k] is None:
+                    del item[k]
+            data.append(item)
+        return data
+
+    def render(self, rows, related=None):
+        return dumps(self.to_representation(rows, related))
+
+
+TAXONOMY_FIELDS = [
+    ('id', 'id'), ('name', 'name'), ('slug', 'slug'), ('description', 'description'),
+    ('products_count', 'products_count'),
+]
+CATEGORY_LIST = RowSerializer(Category, TAXONOMY_FIELDS)
+STYLE_LIST = RowSerializer(Style, TAXONOMY_FIELDS)
+PRODUCT_LIST = RowSerializer(Product, [
+    ('id', 'id'), ('name', 'name'), ('slug', 'slug'), ('description', 'description'),
+    ('category', 'category_id'), ('category_name', 'category__name'),
+    ('style', 'style_id'), ('style_name', 'style__name'),
+    ('price', 'price'), ('image', 'image'), ('author', 'author'), ('rating', 'rating'),
+    ('reviews_count', 'reviews_count'), ('downloads', 'downloads'), ('tags', Related(_tag_names, _atag_names)),
+    ('is_featured', 'is_featured'), ('created_at', 'created_at'),
+])
+# Partner export (see marketplace.export): taxonomies by slug, as import_products reads
+# them, and the same keys on every row.
+PRODUCT_EXPORT = RowSerializer(Product, [
+    ('id', 'id'), ('name', 'name'), ('slug', 'slug'), ('description', 'description'),
+    ('category', 'category__slug'), ('style', 'style__slug'),
+    ('price', 'price'), ('image', 'image'), ('author', 'author'), ('rating', 'rating'),
+    ('reviews_count', 'reviews_count'), ('downloads', 'downloads'), ('tags', Related(_tag_names, _atag_names)),
+    ('is_featured', 'is_featured'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+], omit_empty_relations=False)
@@ -0,0 +1,70 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import caching
+from .fastjson import PRODUCT_LIST
+from .metrics import Counter
+from .models import Product
+
+
+POPULAR_SIZE = 12
+
+requests_total = Counter(
+    'marketplace_feed_requests_total', 'Запросы к кешированным лентам продуктов', ['feed', 'result']
+)
+
+
+def build_popular():
+    rows = list(PRODUCT_LIST.values(Product.objects.order_by('-downloads', '-id'))[:POPULAR_SIZE])
+    return rows, {r['id'] for r in rows}
+
+
+def build_featured():
+    rows = list(PRODUCT_LIST.values(Product.objects.filter(is_featured=True).order_by('-created_at', '-id')))
+    return rows, None
+
+
+FEEDS = {
+    'popular': build_popular,
+    'featured': build_featured,
+}
+
+
+def _key(name):
+    return f'marketplace:feed:{name}:{caching.generation(f"feed:{name}")}'
+
+
+async def apeek(name):
+    # The cached body or None, without building it.
+    if caching.blocks(caching.generations_store()):
+        key = await sync_to_async(_key, thread_sensitive=False)(name)
+    else:
+        key = _key(name)
+    body = await caching.acall(cache, 'get', key)
+    if body is not None:
+        requests_total.inc(name, 'hit')
+    return body
+
+
+def get(name):
+    key = _key(name)
+    ttl = getattr(settings, 'PRODUCT_FEEDS_TTL', 300)
+
+    def build():
+        items, ids = FEEDS[name]()
+        if ids is not None:
+            cache.set(f'marketplace:feed:{name}:ids', ids, ttl)
+        return PRODUCT_LIST.render(items), True
+
+    body, hit = caching.single_flight(key, build, ttl)
+    requests_total.inc(name, 'hit' if hit else 'miss')
+    return body
+
+
+def member_ids(name):
+    return cache.get(f'marketplace:feed:{name}:ids') or set()
+
+
+def invalidate(*names, using=None):
+    caching.invalidate(*(f'feed:{name}' for name in names or FEEDS), using=using)
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db.models import Case, IntegerField, When
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+from .search import get_backend
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        terms = ' '.join(self.get_search_terms(request))
+        if not terms:
+            return queryset
+
+        backend = get_backend(queryset.db)
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        if not self.ranked(request, view):
+            matches = backend.matches(terms)
+            return queryset if matches is None else queryset.filter(pk__in=matches)
+
+        # The best PRODUCT_SEARCH_MAX_RESULTS matches in rank order.
+        ids = backend.search(terms, getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 500))
+        if ids is None:
+            return queryset
+        queryset = queryset.filter(pk__in=ids)
+        if ids:
+            rank = Case(*[When(pk=pk, then=i) for i, pk in enumerate(ids)], output_field=IntegerField())
+            queryset = queryset.order_by(rank)
+        return queryset
+
+    def ranked(self, request, view):
+        # ?ordering= and the keyset pagination sort by a field, which would replace the rank;
+        # the export streams every match in (updated_at, id) order, past the results cap.
+        if getattr(view, 'action', None) == 'export':
+            return False
+        params = request.query_params
+        paginator = getattr(view, 'paginator', None)
+        paged = [getattr(paginator, 'cursor_query_param', None), getattr(paginator, 'page_size_query_param', None)]
+        return not params.get(api_settings.ORDERING_PARAM) and not any(p in params for p in paged if p)
@@ -0,0 +1,69 @@
+import logging
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from marketplace.auth import ClaimsRefreshToken
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк аутентифицированных запросов с JWT: пользователь из базы против пользователя из claims токена'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на режим')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--path', default='/api/cart/total/')
+        parser.add_argument('--modes', default='db,claims', help='Значения JWT_AUTH_MODE по порядку')
+
+    def handle(self, *args, **options):
+        logging.getLogger('marketplace.slow_requests').setLevel(logging.ERROR)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            users = [User.objects.create_user(f'bench-auth-{i}') for i in range(options['users'])]
+            clients = []
+            for user in users:
+                api = APIClient()
+                api.credentials(HTTP_AUTHORIZATION=f'Bearer {ClaimsRefreshToken.for_user(user).access_token}')
+                clients.append(api)
+            results = {}
+            for mode in options['modes'].split(','):
+                with override_settings(JWT_AUTH_MODE=mode):
+                    results[mode] = self.run_mode(clients, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'\n{"режим":<8} {"запр/с":>8} {"p50":>9} {"p99":>9} {"SQL/запрос":>11}')
+        for mode, r in results.items():
+            self.stdout.write(f'{mode:<8} {r["rps"]:>8.0f} {r["p50"]:>7.2f}ms {r["p99"]:>7.2f}ms {r["queries"]:>11}')
+
+    def run_mode(self, clients, options):
+        path = options['path']
+        for api in clients:
+            api.get(path)
+        # The query log is a bounded deque, full by now when DEBUG is on.
+        reset_queries()
+        with CaptureQueriesContext(connection) as ctx:
+            clients[0].get(path)
+        timings = []
+        start = time.perf_counter()
+        for n in range(options['requests']):
+            t = time.perf_counter()
+            r = clients[n % len(clients)].get(path)
+            timings.append((time.perf_counter() - t) * 1000)
+            if r.status_code != 200:
+                raise RuntimeError(f'{path}: {r.status_code}')
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        return {
+            'rps': len(timings) / elapsed,
+            'p50': statistics.median(timings),
+            'p99': timings[int(len(timings) * 0.99)],
+            'queries': len(ctx),
+        }
@@ -0,0 +1,116 @@
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+from rest_framework.test import APIClient
+from marketplace.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк параллельных записей в корзину через CartItemViewSet: SQLite как есть против профиля tuned'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5.0, help='Секунд на прогон')
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--profiles', default='default,tuned', help='Профили из SQLITE_PROFILES по порядку')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Slow-request warnings would flood the output under contention.
+        logging.getLogger('marketplace.slow_requests').setLevel(logging.ERROR)
+        results = {}
+        for name in options['profiles'].split(','):
+            with override_settings(SQLITE_PROFILE=settings.SQLITE_PROFILES[name]):
+                results[name] = self.run_profile(options)
+
+        self.stdout.write(f'\n{"профиль":<10} {"запросов":>9} {"ошибок":>7} {"запр/с":>8} {"p50":>9} {"p99":>9}')
+        for name, r in results.items():
+            self.stdout.write(
+                f'{name:<10} {r["ok"]:>9} {r["errors"]:>7} {r["rps"]:>8.0f} {r["p50"]:>7.1f}ms {r["p99"]:>7.1f}ms'
+            )
+
+    def run_profile(self, options):
+        # A file database, WAL and locking need one; every run starts from a fresh file.
+        connection = connections['default']
+        path = os.path.join(tempfile.mkdtemp(), 'bench_cart.sqlite3')
+        connection.settings_dict['TEST']['NAME'] = path
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+            Product.objects.bulk_create([
+                Product(name=f'P{i}', slug=f'p{i}', description='', category=ui, price=100 + i,
+                        image='https://example.com/p.png', author='A')
+                for i in range(options['products'])
+            ])
+            ids = list(Product.objects.values_list('pk', flat=True))
+            users = [User.objects.create_user(f'writer-{i}') for i in range(options['writers'])]
+            connection.close()
+            return self.hammer(users, ids, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.settings_dict['TEST']['NAME'] = None
+
+    def hammer(self, users, ids, options):
+        start = threading.Barrier(len(users))
+        deadline = []
+        timings, errors = [], []
+        lock = threading.Lock()
+
+        def write(user, seed):
+            rnd = random.Random(seed)
+            api = APIClient()
+            api.force_authenticate(user)
+            mine, errs = [], 0
+            start.wait()
+            try:
+                n = 0
+                while time.monotonic() < deadline[0]:
+                    n += 1
+                    t = time.perf_counter()
+                    try:
+                        if n % 10 == 0:
+                            r = api.delete('/api/cart/clear/')
+                        elif n % 5 == 0:
+                            r = api.post('/api/cart/bulk/', [{'product_id': rnd.choice(ids)}], format='json')
+                        else:
+                            r = api.post('/api/cart/', {'product_id': rnd.choice(ids), 'quantity': 1}, format='json')
+                        ok = r.status_code < 500
+                    except Exception:
+                        ok = False
+                    if ok:
+                        mine.append((time.perf_counter() - t) * 1000)
+                    else:
+                        errs += 1
+            finally:
+                connections.close_all()
+                with lock:
+                    timings.extend(mine)
+                    errors.append(errs)
+
+        threads = [threading.Thread(target=write, args=(u, options['seed'] + i)) for i, u in enumerate(users)]
+        deadline.append(time.monotonic() + options['duration'])
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        timings.sort()
+        return {
+            'ok': len(timings),
+            'errors': sum(errors),
+            'rps': len(timings) / options['duration'],
+            'p50': statistics.median(timings) if timings else 0.0,
+            'p99': timings[int(len(timings) * 0.99)] if timings else 0.0,
+        }
@@ -0,0 +1,128 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections, models, transaction
+from django.utils import timezone
+from marketplace.models import Category, Product, Style
+
+
+FILTERS = {
+    'all': {},
+    'category__slug': {'category__slug': 'cat-3'},
+    'style__slug': {'style__slug': 'style-2'},
+    'is_featured': {'is_featured': True},
+    'price': {'price__gte': 1000, 'price__lte': 3000},
+    'category__name': {'category__name': 'Category 5'},
+    'style__name': {'style__name': 'Style 4'},
+}
+ORDERINGS = ['-created_at', '-downloads', 'rating', 'price']
+# Single-column foreign key indexes the table had before Product.Meta.indexes.
+BASELINE_INDEXES = [
+    models.Index(fields=['category'], name='bench_product_category_idx'),
+    models.Index(fields=['style'], name='bench_product_style_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк запросов каталога с индексами и без (во временной базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--page-size', type=int, default=24)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--plans', action='store_true', help='Печатать планы запросов')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(connection, options['products'])
+            self.set_indexes(connection, False)
+            before = self.run_suite(connection, options, indexed=False)
+            self.set_indexes(connection, True)
+            after = self.run_suite(connection, options, indexed=True)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write('')
+        self.stdout.write(f'{"filter":<16} {"ordering":<12} {"p50 before":>11} {"p99 before":>11} {"p50 after":>10} {"p99 after":>10}')
+        for key in before:
+            b, a = before[key], after[key]
+            self.stdout.write(
+                f'{key[0]:<16} {key[1]:<12} {b[0]:>9.2f}ms {b[1]:>9.2f}ms {a[0]:>8.2f}ms {a[1]:>8.2f}ms'
+            )
+
+    def seed(self, connection, n):
+        rnd = random.Random(42)
+        cats = Category.objects.using(connection.alias).bulk_create(
+            [Category(name=f'Category {i}', slug=f'cat-{i}') for i in range(20)]
+        )
+        sts = Style.objects.using(connection.alias).bulk_create(
+            [Style(name=f'Style {i}', slug=f'style-{i}') for i in range(10)]
+        )
+        table = Product._meta.db_table
+        cols = [
+            'name', 'slug', 'description', 'category_id', 'style_id', 'price', 'image', 'author',
+            'rating', 'reviews_count', 'downloads', 'is_featured', 'created_at', 'updated_at',
+        ]
+        sql = f'INSERT INTO {table} ({", ".join(cols)}) VALUES ({", ".join(["%s"] * len(cols))})'
+        now = timezone.now()
+        t = time.perf_counter()
+        chunk = 10_000
+        for start in range(0, n, chunk):
+            rows = []
+            for i in range(start, min(start + chunk, n)):
+                created = now - timedelta(seconds=rnd.randrange(3 * 365 * 86400))
+                rows.append((
+                    f'Product {i}', f'product-{i}', 'Синтетический продукт',
+                    rnd.choice(cats).pk, rnd.choice(sts).pk, rnd.randrange(0, 10_000),
+                    'https://example.com/p.png', f'Author {i % 500}', round(rnd.uniform(0, 5), 2),
+                    rnd.randrange(500), int(rnd.paretovariate(1.2) * 10),
+                    rnd.random() < 0.05, created, created,
+                ))
+            with transaction.atomic(using=connection.alias), connection.cursor() as c:
+                c.executemany(sql, rows)
+            self.stdout.write(f'\rСоздано {min(start + chunk, n)}/{n}', ending='')
+        self.stdout.write(f'\nЗагрузка: {n / (time.perf_counter() - t):.0f} строк/с')
+
+    def set_indexes(self, connection, indexed):
+        add, remove = Product._meta.indexes, BASELINE_INDEXES
+        if not indexed:
+            add, remove = remove, add
+        with connection.schema_editor() as editor:
+            for index in remove:
+                editor.remove_index(Product, index)
+            for index in add:
+                editor.add_index(Product, index)
+        with connection.cursor() as c:
+            c.execute('ANALYZE')
+
+    def run_suite(self, connection, options, indexed):
+        label = 'с индексами' if indexed else 'без индексов'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {label}'))
+        results = {}
+        for fname, flt in FILTERS.items():
+            for ordering in ORDERINGS:
+                tiebreak = ('-' if ordering.startswith('-') else '') + 'id'
+                qs = (
+                    Product.objects.using(connection.alias)
+                    .select_related('category', 'style')
+                    .filter(**flt)
+                    .order_by(ordering, tiebreak)[:options['page_size']]
+                )
+                if options['plans']:
+                    self.stdout.write(f'-- {fname} / {ordering}\n{qs.explain()}')
+                timings = []
+                for _ in range(options['repeat']):
+                    t = time.perf_counter()
+                    list(qs.all())
+                    timings.append((time.perf_counter() - t) * 1000)
+                timings.sort()
+                p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+                results[(fname, ordering)] = (statistics.median(timings), p99)
+                self.stdout.write(f'{fname:<16} {ordering:<12} p50={results[(fname, ordering)][0]:.2f}ms p99={p99:.2f}ms')
+        return results
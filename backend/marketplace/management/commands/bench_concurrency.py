@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import random
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import connection
+from django.test import override_settings
+from marketplace.auth import ClaimsRefreshToken
+from marketplace.models import Product
+
+from .loadtest import QuietRequestHandler, percentile
+
+
+PATHS = [
+    '/api/products/?page_size=24',
+    '/api/products/?page_size=24&ordering=-downloads',
+    '/api/products/featured/',
+    '/api/products/popular/',
+    '/api/categories/',
+]
+
+
+class PooledWSGIServer(ThreadedWSGIServer):
+    # A fixed number of worker threads, like gunicorn --threads: a keep-alive
+    # connection holds its thread until the client closes it.
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Level:
+    def __init__(self):
+        self.timings = []
+        self.errors = 0
+        self.served = set()
+
+
+# Anonymous clients send no token; without a public catalog (DEFAULT_PERMISSION_CLASSES)
+# their answer is a 401, which the async views give on the event loop as well.
+EXPECTED = {'user': {200}, 'anon': {200, 401}}
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+class Command(BaseCommand):
+    help = (
+        'Сколько одновременных keep-alive соединений держит backend.wsgi (пул потоков) '
+        'и backend.asgi (uvicorn) на чтениях каталога'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', default='25,100,400,1000', help='Числа одновременных соединений')
+        parser.add_argument('--duration', type=float, default=10, help='Секунд на уровень')
+        parser.add_argument('--think', type=float, default=0.5, help='Средняя пауза клиента между запросами, c')
+        parser.add_argument('--timeout', type=float, default=5, help='Ответ дольше этого считается ошибкой, c')
+        parser.add_argument('--threads', type=int, default=32, help='Потоков WSGI-сервера')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--servers', default='wsgi,asgi', help='Серверы по порядку')
+        parser.add_argument('--anonymous', type=float, default=0.25, help='Доля анонимных клиентов, 0..1')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        servers = options['servers'].split(',')
+        if 'asgi' in servers:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('Для ASGI нужен uvicorn: pip install uvicorn')
+        levels = [int(n) for n in options['levels'].split(',')]
+        if not 0 <= options['anonymous'] <= 1:
+            raise CommandError('--anonymous — доля от 0 до 1')
+        logging.getLogger('marketplace.slow_requests').setLevel(logging.ERROR)
+        # The anonymous 401s would be logged one by one.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            call_command('seed_data', products=options['products'], seed=options['seed'], stdout=self.stdout)
+            tokens = [
+                str(ClaimsRefreshToken.for_user(User.objects.create_user(f'bench-conn-{i}')).access_token)
+                for i in range(20)
+            ]
+            ids = list(Product.objects.values_list('id', flat=True)[:200])
+            paths = PATHS + [f'/api/products/{pk}/' for pk in ids]
+            results = {}
+            with override_settings(RATE_LIMITS={}):
+                for name in servers:
+                    with getattr(self, f'serve_{name}')(options) as port:
+                        for n in levels:
+                            for kind, level in asyncio.run(self.run_level(port, n, paths, tokens, options)).items():
+                                results[name, n, kind] = level
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(
+            f'\n{"сервер":<7} {"соедин.":>8} {"клиенты":>8} {"обслужено":>10} {"ошибок":>7} {"запр/с":>8} '
+            f'{"p50":>9} {"p99":>9}'
+        )
+        for (name, n, kind), r in results.items():
+            timings = sorted(r.timings) or [0]
+            self.stdout.write(
+                f'{name:<7} {n:>8} {kind:>8} {len(r.served):>10} {r.errors:>7} {len(r.timings) / options["duration"]:>8.0f} '
+                f'{statistics.median(timings):>7.1f}ms {percentile(timings, 0.99):>7.1f}ms'
+            )
+
+    def serve_wsgi(self, options):
+        from backend.wsgi import application
+        server = PooledWSGIServer(('127.0.0.1', 0), QuietRequestHandler, threads=options['threads'])
+        server.set_app(application)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return Serving(server.server_port, lambda: (server.shutdown(), server.server_close()))
+
+    def serve_asgi(self, options):
+        import uvicorn
+        from backend.asgi import application
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(
+            application, lifespan='off', log_level='warning', access_log=False, backlog=4096,
+        ))
+        thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+            sock.close()
+        return Serving(sock.getsockname()[1], stop)
+
+    async def run_level(self, port, n, paths, tokens, options):
+        # Every client is anonymous with the probability --anonymous, the same at each level.
+        kinds = ['anon' if random.Random(options['seed'] + i).random() < options['anonymous'] else 'user' for i in range(n)]
+        levels = {kind: Level() for kind in sorted(set(kinds), reverse=True)}
+        deadline = time.perf_counter() + options['duration']
+        await asyncio.gather(*(
+            self.client(i, port, paths, tokens[i % len(tokens)] if kind == 'user' else None, deadline, levels[kind], options)
+            for i, kind in enumerate(kinds)
+        ))
+        return levels
+
+    async def client(self, i, port, paths, token, deadline, level, options):
+        # One keep-alive connection per virtual user, reopened after an error.
+        rnd = random.Random(options['seed'] + i)
+        auth = f'Authorization: Bearer {token}\r\n' if token else ''
+        expected = EXPECTED['user' if token else 'anon']
+        writer = None
+        while time.perf_counter() < deadline:
+            request = (
+                f'GET {rnd.choice(paths)} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: application/json\r\n{auth}\r\n'
+            ).encode()
+            t = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), options['timeout'])
+                writer.write(request)
+                status, keep_alive = await asyncio.wait_for(read_response(reader), options['timeout'])
+                if status not in expected:
+                    raise ValueError(status)
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                level.errors += 1
+                writer = self.close(writer)
+            else:
+                level.timings.append((time.perf_counter() - t) * 1000)
+                level.served.add(i)
+                if not keep_alive:
+                    writer = self.close(writer)
+            await asyncio.sleep(rnd.uniform(0, 2 * options['think']))
+        self.close(writer)
+
+    def close(self, writer):
+        if writer is not None:
+            writer.close()
+        return None
+
+
+class Serving:
+    def __init__(self, port, stop):
+        self.port = port
+        self.stop = stop
+
+    def __enter__(self):
+        return self.port
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+from marketplace import fastjson
+from marketplace.models import Product
+from marketplace.serializers import ProductListSerializer
+
+from .bench_catalog_queries import Command as CatalogBenchCommand
+
+
+class Command(CatalogBenchCommand):
+    help = 'Микробенчмарк: ProductListSerializer + JSONRenderer против fastjson (во временной базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Строк в одном ответе')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(connection, options['rows'])
+            results = self.run_bench(connection, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        per = 1000 / options['rows']
+        self.stdout.write(f'\n{"":<24} {"p50 / 1k строк":>15} {"с SQL":>12}')
+        for label, (render_only, total) in results.items():
+            self.stdout.write(f'{label:<24} {render_only * per:>13.2f}ms {total * per:>10.2f}ms')
+        old, new = results['serializer'], results['fastjson']
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение: {old[0] / new[0]:.1f}x сериализация, {old[1] / new[1]:.1f}x с SQL'
+            f'{"" if fastjson.orjson else " (orjson не установлен, stdlib json)"}'
+        ))
+
+    def run_bench(self, connection, options):
+        qs = Product.objects.using(connection.alias).select_related('category', 'style').with_tags()
+        qs = qs.order_by('-created_at', '-id')
+        qs = qs[:options['rows']]
+        rows = fastjson.PRODUCT_LIST.values(qs)
+
+        def old_render(items):
+            return JSONRenderer().render(ProductListSerializer(items, many=True).data)
+
+        def new_render(items):
+            return fastjson.PRODUCT_LIST.render(items)
+
+        paths = {
+            'serializer': (old_render, lambda: list(qs.all())),
+            'fastjson': (new_render, lambda: list(rows.all())),
+        }
+        assert old_render(paths['serializer'][1]()) == new_render(paths['fastjson'][1]())
+
+        results = {}
+        for label, (render, fetch) in paths.items():
+            items = fetch()
+            render_only = self.median(options['repeat'], lambda: render(items))
+            total = self.median(options['repeat'], lambda: render(fetch()))
+            results[label] = (render_only, total)
+        return results
+
+    def median(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - t) * 1000)
+        return statistics.median(timings)
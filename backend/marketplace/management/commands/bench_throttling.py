@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from marketplace import throttling
+from marketplace.views import ProductViewSet
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк накладных расходов лимитов запросов: проверка всех throttle-классов запроса, мкс'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50_000, help='Проверок на бэкенд')
+        parser.add_argument('--clients', type=int, default=10_000, help='Разных IP')
+        parser.add_argument('--backends', default='local,cache', help='Значения RATE_LIMIT_BACKEND по порядку')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = ProductViewSet(action_map={'get': 'list'})
+        view.format_kwarg = None
+        requests = []
+        for i in range(min(options['clients'], options['requests'])):
+            request = view.initialize_request(
+                factory.get('/api/products/', {'search': 'mockup'}, REMOTE_ADDR=f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}')
+            )
+            request.user = AnonymousUser()
+            requests.append(request)
+
+        # Generous rates: every check takes a token, none is refused.
+        limits = {scope: '1000000/s' for scope in settings.RATE_LIMITS}
+        results = {}
+        for backend in options['backends'].split(','):
+            with override_settings(RATE_LIMITS=limits, RATE_LIMIT_BACKEND=backend):
+                throttling.buckets().clear()
+                results[backend] = self.run_backend(view, requests, options['requests'])
+
+        self.stdout.write(f'\n{"бэкенд":<8} {"среднее":>10} {"p50":>9} {"p99":>9}')
+        for backend, r in results.items():
+            self.stdout.write(f'{backend:<8} {r["mean"]:>8.2f}us {r["p50"]:>7.2f}us {r["p99"]:>7.2f}us')
+
+    def run_backend(self, view, requests, n):
+        timings = []
+        for i in range(n):
+            request = requests[i % len(requests)]
+            view.request = request
+            t = time.perf_counter()
+            view.check_throttles(request)
+            timings.append((time.perf_counter() - t) * 1_000_000)
+        timings.sort()
+        return {
+            'mean': statistics.fmean(timings),
+            'p50': statistics.median(timings),
+            'p99': timings[int(len(timings) * 0.99)],
+        }
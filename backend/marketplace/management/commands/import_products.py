@@ -0,0 +1,425 @@
+import csv
+import json
+import os
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import islice
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import MaxValueValidator, MinValueValidator, URLValidator
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.utils import timezone
+from django.utils.functional import cached_property
+from marketplace.models import (
+    Category, Product, ProductTag, Style, Tag, defer_products_count, products_bulk_changed, recount_products,
+)
+from marketplace.search import get_backend
+
+
+# Upserts by slug; created_at of existing products is kept.
+INSERT_FIELDS = [
+    'slug', 'name', 'description', 'category', 'style', 'price', 'image', 'author', 'rating',
+    'reviews_count', 'downloads', 'is_featured',
+]
+UPDATE_FIELDS = INSERT_FIELDS[1:] + ['updated_at']
+# validate_slug's pattern, compiled here: the lazy validator costs more than the match.
+SLUG_RE = re.compile(r'^[-a-zA-Z0-9_]+\Z')
+TRUE = {'1', 'true', 'yes', 'да'}
+FALSE = {'', '0', 'false', 'no', 'нет'}
+
+
+class RowError(Exception):
+    pass
+
+
+def bounds(field):
+    lo = next((v.limit_value for v in field.validators if isinstance(v, MinValueValidator)), None)
+    hi = next((v.limit_value for v in field.validators if isinstance(v, MaxValueValidator)), None)
+    if isinstance(field, models.IntegerField):
+        # SQLite reports no range and fails the whole executemany past 64 bits; the
+        # portable range of the column type is what PostgreSQL enforces.
+        db_lo, db_hi = BaseDatabaseOperations.integer_field_ranges[field.get_internal_type()]
+        lo, hi = db_lo if lo is None else lo, db_hi if hi is None else hi
+    return lo, hi
+
+
+class Validator:
+    # Per-field converters built once from the Product fields, so the limits stay those
+    # of the model. A converter returns the clean value or raises RowError.
+    def __init__(self, categories, styles):
+        self.categories = categories
+        self.styles = styles
+        meta = Product._meta
+        converters = {
+            'name': self.text(meta.get_field('name')),
+            'slug': self.slug(meta.get_field('slug')),
+            'description': self.text(meta.get_field('description')),
+            'category_id': self.taxonomy('category', categories, required=True),
+            'style_id': self.taxonomy('style', styles, required=False),
+            'price': self.decimal(meta.get_field('price')),
+            'image': self.url(meta.get_field('image')),
+            'author': self.text(meta.get_field('author')),
+            'rating': self.decimal(meta.get_field('rating'), default=0),
+            'reviews_count': self.integer(meta.get_field('reviews_count'), default=0),
+            'downloads': self.integer(meta.get_field('downloads'), default=0),
+            'is_featured': self.boolean,
+        }
+        # (attribute, column of the file, converter)
+        self.converters = [(name, name.removesuffix('_id'), convert) for name, convert in converters.items()]
+
+    def __call__(self, row):
+        values, errors = {}, {}
+        for name, key, convert in self.converters:
+            try:
+                values[name] = convert(row.get(key))
+            except RowError as e:
+                errors[key] = str(e)
+        try:
+            tags = self.tags(row.get('tags'))
+        except RowError as e:
+            errors['tags'] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return values, tags
+
+    @staticmethod
+    def text(field):
+        def convert(v):
+            v = '' if v is None else str(v).strip()
+            if not v and not field.blank:
+                raise RowError('Обязательное поле')
+            if field.max_length and len(v) > field.max_length:
+                raise RowError(f'Длиннее {field.max_length} символов')
+            return v
+        return convert
+
+    def slug(self, field):
+        text = self.text(field)
+
+        def convert(v):
+            v = text(v)
+            if not SLUG_RE.match(v):
+                raise RowError('Допустимы латиница, цифры, "-" и "_"')
+            return v
+        return convert
+
+    def url(self, field):
+        text = self.text(field)
+        validate = URLValidator()
+
+        # Placeholder and CDN images repeat across rows.
+        @lru_cache(maxsize=10_000)
+        def valid(v):
+            try:
+                validate(v)
+            except ValidationError:
+                return False
+            return True
+
+        def convert(v):
+            v = text(v)
+            if not valid(v):
+                raise RowError('Неверный URL')
+            return v
+        return convert
+
+    @staticmethod
+    def decimal(field, default=None):
+        q = Decimal(1).scaleb(-field.decimal_places)
+        limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+        lo, hi = bounds(field)
+
+        def convert(v):
+            if v in (None, '') and default is not None:
+                return Decimal(default)
+            try:
+                d = Decimal(str(v).strip().replace(',', '.'))
+            except InvalidOperation:
+                raise RowError('Ожидается число')
+            if not d.is_finite() or d != d.quantize(q) or abs(d) >= limit:
+                raise RowError(f'Ожидается число до {field.max_digits} цифр, {field.decimal_places} после запятой')
+            if (lo is not None and d < lo) or (hi is not None and d > hi):
+                raise RowError(f'Допустимо от {lo} до {hi}' if hi is not None else f'Не меньше {lo}')
+            return d
+        return convert
+
+    @staticmethod
+    def integer(field, default):
+        lo, hi = bounds(field)
+
+        def convert(v):
+            if v in (None, ''):
+                return default
+            # NDJSON numbers: 3.0 is 3, 1.9 is not silently truncated.
+            if isinstance(v, float) and v.is_integer():
+                v = int(v)
+            if isinstance(v, bool) or not isinstance(v, (int, str)):
+                raise RowError('Ожидается целое число')
+            try:
+                n = int(v)
+            except ValueError:
+                raise RowError('Ожидается целое число')
+            if not lo <= n <= hi:
+                raise RowError(f'Допустимо от {lo} до {hi}')
+            return n
+        return convert
+
+    @staticmethod
+    def boolean(v):
+        if isinstance(v, bool):
+            return v
+        v = '' if v is None else str(v).strip().lower()
+        if v in TRUE:
+            return True
+        if v in FALSE:
+            return False
+        raise RowError('Ожидается true или false')
+
+    @staticmethod
+    def taxonomy(name, ids, required):
+        def convert(v):
+            v = '' if v is None else str(v).strip()
+            if not v:
+                if required:
+                    raise RowError('Обязательное поле')
+                return None
+            try:
+                return ids[v]
+            except KeyError:
+                raise RowError(f'Неизвестный слаг «{v}»')
+        return convert
+
+    @staticmethod
+    def tags(v):
+        if v in (None, ''):
+            return []
+        if isinstance(v, str):
+            v = v.split(',')
+        if not isinstance(v, list) or not all(isinstance(t, str) for t in v):
+            raise RowError('Ожидается список строк или строка через запятую')
+        names = list(dict.fromkeys(t.strip() for t in v if t.strip()))
+        if any(len(t) > Tag._meta.get_field('name').max_length for t in names):
+            raise RowError('Слишком длинный тег')
+        return names
+
+
+class Source:
+    # Rows of a CSV or NDJSON file with the byte offset of the end of the last row read,
+    # which the checkpoint stores. Quoted CSV values may span lines.
+    def __init__(self, path, format, offset=0):
+        self.file = open(path, 'rb')
+        self.format = format
+        self.offset = 0
+        self.header = None
+        if format == 'csv':
+            self.header = next(csv.reader(self.lines()), None)
+            if self.header is None:
+                raise CommandError(f'{path}: пустой файл')
+            self.header = [h.strip().lstrip('\ufeff') for h in self.header]
+        if offset > self.offset:
+            self.file.seek(offset)
+            self.offset = offset
+
+    def lines(self):
+        for raw in self.file:
+            self.offset += len(raw)
+            yield raw.decode('utf-8')
+
+    def rows(self):
+        if self.format == 'csv':
+            for values in csv.reader(self.lines()):
+                if values:
+                    yield dict(zip(self.header, values))
+            return
+        for line in self.lines():
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {'_raw': line.rstrip('\n')}
+
+    def close(self):
+        self.file.close()
+
+
+class Command(BaseCommand):
+    help = 'Импорт продуктов из CSV/NDJSON (формат /api/products/export/) с upsert по slug'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы .csv или .ndjson/.jsonl')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='По умолчанию по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Строк на проверку и транзакцию')
+        parser.add_argument('--rejects', help='Файл отклоненных строк (NDJSON), по умолчанию <файл>.rejects.ndjson')
+        parser.add_argument('--restart', action='store_true', help='Начать заново, не продолжая с контрольной точки')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить строки, без записи в базу')
+
+    def handle(self, *args, **options):
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.styles = dict(Style.objects.values_list('slug', 'pk'))
+        self.validator = Validator(self.categories, self.styles)
+        self.tag_ids = {}
+        self.search = None if options['dry_run'] else get_backend()
+
+        total = {'rows': 0, 'imported': 0, 'rejected': 0}
+        t = time.perf_counter()
+        with defer_products_count():
+            for path in options['paths']:
+                for key, n in self.import_file(path, options).items():
+                    total[key] += n
+        if not options['dry_run']:
+            recount_products(Category)
+            recount_products(Style)
+
+        elapsed = time.perf_counter() - t
+        verb = 'проверено' if options['dry_run'] else 'импортировано'
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего: {total["rows"]} строк, {verb} {total["imported"]}, отклонено {total["rejected"]} '
+            f'за {elapsed:.1f} c ({total["rows"] / max(elapsed, 1e-9):.0f} строк/с)'
+        ))
+
+    def import_file(self, path, options):
+        if not os.path.isfile(path):
+            raise CommandError(f'Файл не найден: {path}')
+        format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        checkpoint_path = path + '.checkpoint.json'
+        rejects_path = options['rejects'] or path + '.rejects.ndjson'
+        state = {'offset': 0, 'rows': 0, 'imported': 0, 'rejected': 0}
+        size = os.path.getsize(path)
+
+        if not options['restart'] and not options['dry_run'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('size') != size:
+                raise CommandError(f'{path} изменился после контрольной точки: запустите с --restart')
+            state = {k: saved[k] for k in state}
+            self.stdout.write(f'{path}: продолжение со строки {state["rows"] + 1}')
+
+        source = Source(path, format, state['offset'])
+        start = dict(state)
+        t = time.perf_counter()
+        try:
+            with open(rejects_path, 'a' if state['rows'] else 'w', encoding='utf-8') as rejects:
+                rows = source.rows()
+                while chunk := list(islice(rows, options['chunk_size'])):
+                    first = state['rows'] + 1
+                    valid, rejected = self.validate_chunk(chunk, first)
+                    if not options['dry_run']:
+                        with transaction.atomic():
+                            self.upsert(valid)
+                    for line in rejected:
+                        rejects.write(json.dumps(line, ensure_ascii=False, default=str) + '\n')
+                    rejects.flush()
+                    state['offset'] = source.offset
+                    state['rows'] += len(chunk)
+                    state['imported'] += len(valid)
+                    state['rejected'] += len(rejected)
+                    if not options['dry_run']:
+                        self.save_checkpoint(checkpoint_path, {**state, 'size': size})
+                    rate = (state['rows'] - start['rows']) / max(time.perf_counter() - t, 1e-9)
+                    self.stdout.write(f'\r{path}: {state["rows"]} строк ({rate:.0f} строк/с)', ending='')
+                    self.stdout.flush()
+        finally:
+            source.close()
+        self.stdout.write('')
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if not state['rejected'] and os.path.exists(rejects_path) and not os.path.getsize(rejects_path):
+            os.remove(rejects_path)
+        self.stdout.write(
+            f'{path}: строк {state["rows"]}, ок {state["imported"]}, отклонено {state["rejected"]}'
+            + (f' ({rejects_path})' if state['rejected'] else '')
+        )
+        return {k: state[k] - start[k] for k in ('rows', 'imported', 'rejected')}
+
+    def validate_chunk(self, chunk, first):
+        # A slug repeated within a chunk keeps its last row: one upsert statement cannot
+        # touch a row twice.
+        valid, rejected = {}, []
+        for n, row in enumerate(chunk, first):
+            if '_raw' in row:
+                rejected.append({'row': n, 'errors': {'row': 'Ожидается JSON-объект'}, 'data': row['_raw']})
+                continue
+            try:
+                values, tags = self.validator(row)
+            except ValidationError as e:
+                rejected.append({'row': n, 'errors': e.message_dict, 'data': row})
+                continue
+            valid.pop(values['slug'], None)
+            valid[values['slug']] = (values, tags)
+        return list(valid.values()), rejected
+
+    def upsert(self, valid):
+        if not valid:
+            return
+        connection = connections[DEFAULT_DB_ALIAS]
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        adapters = self.adapters(connection)
+        with connection.cursor() as c:
+            c.executemany(self.upsert_sql(connection), [
+                (*[adapt(values[name]) for name, adapt in adapters], now, now) for values, _ in valid
+            ])
+        ids = dict(Product.objects.filter(slug__in=[v['slug'] for v, _ in valid]).values_list('slug', 'pk'))
+
+        names = {t for _, tags in valid for t in tags} - self.tag_ids.keys()
+        if names:
+            Tag.objects.bulk_create([Tag(name=n) for n in names], ignore_conflicts=True)
+            self.tag_ids.update(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        ProductTag.objects.filter(product_id__in=ids.values()).delete()
+        with connection.cursor() as c:
+            c.executemany(self.tags_sql(connection), [
+                (ids[values['slug']], self.tag_ids[t], i) for values, tags in valid for i, t in enumerate(tags)
+            ])
+
+        if self.search:
+            self.search.update([
+                SimpleNamespace(pk=ids[values['slug']], tags=tags, **values) for values, tags in valid
+            ])
+        products_bulk_changed.send(sender=Product, using=DEFAULT_DB_ALIAS)
+
+    # The statements bulk_create(update_conflicts=True, unique_fields=['slug']) and
+    # ProductTag bulk_create build, run with executemany: under the SQLite parameter
+    # limit bulk_create sends about 60 rows per statement, and most of its time goes
+    # to compiling each value.
+
+    @cached_property
+    def fields(self):
+        return [Product._meta.get_field(name) for name in INSERT_FIELDS]
+
+    def adapters(self, connection):
+        ops = connection.ops
+        return [
+            (f.attname, lambda v, f=f: ops.adapt_decimalfield_value(v, f.max_digits, f.decimal_places))
+            if isinstance(f, models.DecimalField) else (f.attname, lambda v: v)
+            for f in self.fields
+        ]
+
+    def upsert_sql(self, connection):
+        qn = connection.ops.quote_name
+        columns = [f.column for f in self.fields] + ['updated_at', 'created_at']
+        updates = [Product._meta.get_field(name).column for name in UPDATE_FIELDS]
+        return (
+            f'INSERT INTO {qn(Product._meta.db_table)} ({", ".join(map(qn, columns))}) '
+            f'VALUES ({", ".join(["%s"] * len(columns))}) '
+            f'ON CONFLICT ({qn("slug")}) DO UPDATE SET {", ".join(f"{qn(c)} = excluded.{qn(c)}" for c in updates)}'
+        )
+
+    def tags_sql(self, connection):
+        qn = connection.ops.quote_name
+        return (
+            f'INSERT INTO {qn(ProductTag._meta.db_table)} ({qn("product_id")}, {qn("tag_id")}, {qn("position")}) '
+            'VALUES (%s, %s, %s)'
+        )
+
+    def save_checkpoint(self, path, state):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
@@ -0,0 +1,281 @@
+import http.client
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.test import override_settings
+
+
+# Relative weights of the steps of a user journey; checkout first fills an empty cart.
+MIX = {'browse': 6, 'search': 3, 'detail': 4, 'cart': 2, 'checkout': 1}
+ORDERINGS = ['-created_at', '-downloads', '-rating', 'price']
+PASSWORD = 'Load-test-pass-1'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in MIX:
+            raise CommandError(f'Неизвестный шаг «{name}», доступны: {", ".join(MIX)}')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f'Неверный вес для «{name}»: {weight}')
+    if not any(mix.values()):
+        raise CommandError('Все веса нулевые')
+    return mix
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, label, ms, ok):
+        with self.lock:
+            self.timings[label].append(ms)
+            if not ok:
+                self.errors[label] += 1
+
+    def report(self, elapsed):
+        rows = {}
+        for label, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            rows[label] = {
+                'requests': len(timings),
+                'errors': self.errors[label],
+                'rps': round(len(timings) / elapsed, 2),
+                'p50': round(statistics.median(timings), 2),
+                'p90': round(percentile(timings, 0.90), 2),
+                'p99': round(percentile(timings, 0.99), 2),
+                'max': round(timings[-1], 2),
+            }
+        return rows
+
+
+class VirtualUser:
+    def __init__(self, n, url, stats, mix, rnd, catalog):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self.username = f'load-user-{n}'
+        self.stats = stats
+        self.steps, self.weights = zip(*mix.items())
+        self.rnd = rnd
+        self.catalog = catalog
+        self.token = None
+        self.product_ids = []
+        self.cart = 0
+
+    def request(self, label, method, path, body=None, expected=()):
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        t = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            r = self.conn.getresponse()
+            status, data = r.status, r.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            status, data = 0, b''
+        self.stats.add(label, (time.perf_counter() - t) * 1000, 200 <= status < 300 or status in expected)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    def login(self):
+        creds = {'username': self.username, 'password': PASSWORD}
+        status, data = self.request('login', 'POST', '/api/login/', creds, expected=(401,))
+        if status == 401:
+            self.request('register', 'POST', '/api/register/', {
+                **creds, 'email': f'{self.username}@example.com', 'password2': PASSWORD,
+            })
+            status, data = self.request('login', 'POST', '/api/login/', creds)
+        if status != 200:
+            return False
+        self.token = data['access']
+        return True
+
+    def remember(self, data):
+        rows = data['results'] if isinstance(data, dict) else data
+        if isinstance(rows, list) and rows:
+            self.product_ids = [p['id'] for p in rows]
+
+    def browse(self):
+        params = {'page_size': 24, 'ordering': self.rnd.choice(ORDERINGS)}
+        kind = self.rnd.choice(('category__slug', 'style__slug', None))
+        if kind and self.catalog[kind]:
+            params[kind] = self.rnd.choice(self.catalog[kind])
+        status, data = self.request('products', 'GET', '/api/products/?' + urlencode(params))
+        if status == 200:
+            self.remember(data)
+
+    def search(self):
+        params = {'search': self.rnd.choice(self.catalog['terms']), 'page_size': 24}
+        status, data = self.request('products?search', 'GET', '/api/products/?' + urlencode(params))
+        if status == 200:
+            self.remember(data)
+
+    def detail(self):
+        if not self.product_ids:
+            return self.browse()
+        self.request('product', 'GET', f'/api/products/{self.rnd.choice(self.product_ids)}/')
+
+    def add_to_cart(self):
+        if not self.product_ids:
+            self.browse()
+        if self.product_ids:
+            body = {'product_id': self.rnd.choice(self.product_ids), 'quantity': self.rnd.randint(1, 2)}
+            if self.request('cart', 'POST', '/api/cart/', body)[0] == 201:
+                self.cart += 1
+
+    def checkout(self):
+        if not self.cart:
+            self.add_to_cart()
+        if self.cart and self.request('checkout', 'POST', '/api/orders/', {})[0] == 201:
+            self.cart = 0
+
+    def step(self):
+        name = self.rnd.choices(self.steps, self.weights)[0]
+        {
+            'browse': self.browse,
+            'search': self.search,
+            'detail': self.detail,
+            'cart': self.add_to_cart,
+            'checkout': self.checkout,
+        }[name]()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест API: вход, каталог, поиск, карточка, корзина и оформление заказа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес запущенного сервера')
+        parser.add_argument(
+            '--serve', action='store_true',
+            help='Поднять backend.wsgi в этом процессе на свободном порту вместо --url',
+        )
+        parser.add_argument('--users', type=int, default=10, help='Одновременных виртуальных пользователей')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность, секунд')
+        parser.add_argument('--iterations', type=int, default=0, help='Шагов на пользователя (вместо --duration)')
+        parser.add_argument('--mix', type=parse_mix, default=MIX, help='Веса шагов: browse=6,search=3,...')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='json_path', help='Сохранить отчет в JSON')
+        parser.add_argument(
+            '--rate-limits', action='store_true',
+            help='С --serve оставить RATE_LIMITS: все виртуальные пользователи входят с одного IP',
+        )
+
+    def handle(self, *args, **options):
+        server = None
+        url = options['url']
+        if options['serve']:
+            from backend.wsgi import application
+            # The server shares this terminal: keep the report readable.
+            logging.getLogger('marketplace.slow_requests').setLevel(logging.ERROR)
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+            server.set_app(application)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            limits = settings.RATE_LIMITS if options['rate_limits'] or not server else {}
+            with override_settings(RATE_LIMITS=limits):
+                report = self.run(url, options)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(
+            f'\n{"endpoint":<18} {"req":>7} {"err":>5} {"rps":>8} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}'
+        )
+        for label, r in report['endpoints'].items():
+            self.stdout.write(
+                f'{label:<18} {r["requests"]:>7} {r["errors"]:>5} {r["rps"]:>8.1f} '
+                f'{r["p50"]:>7.1f}ms {r["p90"]:>7.1f}ms {r["p99"]:>7.1f}ms {r["max"]:>7.1f}ms'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего: {report["requests"]} запросов за {report["elapsed"]:.1f} c, '
+            f'{report["rps"]:.1f} запр/с, ошибок {report["errors"]}'
+        ))
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def catalog(self, url):
+        probe = VirtualUser('probe', url, Stats(), MIX, random.Random(0), None)
+        if not probe.login():
+            raise CommandError(f'Не удалось войти на {url}')
+        status, data = probe.request('products', 'GET', '/api/products/?page_size=100')
+        rows = data.get('results') if status == 200 else None
+        if not rows:
+            raise CommandError('Каталог пуст: сначала выполните seed_data --products N')
+        terms = sorted({w for p in rows for w in p['name'].split() if len(w) > 3 and not w.isdigit()})
+        return {
+            'category__slug': [c['slug'] for c in probe.request('categories', 'GET', '/api/categories/')[1] or []],
+            'style__slug': [s['slug'] for s in probe.request('styles', 'GET', '/api/styles/')[1] or []],
+            'terms': terms or ['product'],
+        }
+
+    def run(self, url, options):
+        catalog = self.catalog(url)
+        stats = Stats()
+        deadline = None if options['iterations'] else time.perf_counter() + options['duration']
+        start = threading.Barrier(options['users'] + 1)
+
+        def worker(n):
+            vu = VirtualUser(n, url, stats, options['mix'], random.Random(options['seed'] + n), catalog)
+            start.wait()
+            if not vu.login():
+                return
+            i = 0
+            while (deadline is None and i < options['iterations']) or (deadline and time.perf_counter() < deadline):
+                vu.step()
+                i += 1
+            vu.conn.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['users'])]
+        for th in threads:
+            th.start()
+        t = time.perf_counter()
+        start.wait()
+        for th in threads:
+            th.join()
+        elapsed = time.perf_counter() - t
+
+        endpoints = stats.report(elapsed)
+        total = sum(r['requests'] for r in endpoints.values())
+        return {
+            'url': url,
+            'users': options['users'],
+            'mix': options['mix'],
+            'elapsed': round(elapsed, 3),
+            'requests': total,
+            'errors': sum(r['errors'] for r in endpoints.values()),
+            'rps': round(total / elapsed, 2),
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.models import Product
+from marketplace.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестроение поискового индекса продуктов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['database'])
+        if backend is None:
+            raise CommandError('Поисковый индекс не поддерживается для этой базы данных')
+
+        t = time.perf_counter()
+        backend.create()
+        n = backend.rebuild(Product.objects.using(options['database']).all(), options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано {n} продуктов за {time.perf_counter() - t:.2f} c'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from marketplace.models import Category, Product, Style, recount_products
+
+
+class Command(BaseCommand):
+    help = 'Пересчет количества продуктов в категориях и стилях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        db = options['database']
+        for model in (Category, Style):
+            field = model._meta.model_name
+            actual = dict(
+                Product.objects.using(db).order_by().values_list(field).annotate(n=Count('pk'))
+            )
+            drift = [
+                (name, stored, actual.get(pk, 0))
+                for pk, name, stored in model.objects.using(db).values_list('pk', 'name', 'products_count')
+                if stored != actual.get(pk, 0)
+            ]
+            for name, stored, real in drift:
+                self.stdout.write(f'{model._meta.verbose_name} «{name}»: {stored} -> {real}')
+
+            if not options['dry_run'] and drift:
+                with transaction.atomic(using=db):
+                    recount_products(model, using=db)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: расхождений {len(drift)}'
+            ))
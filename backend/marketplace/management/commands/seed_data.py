@@ -1,13 +1,174 @@
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from marketplace.models import Category, Style, Product
+from django.db import transaction
+from django.db.models import Max
+from marketplace.models import (
+    CartItem, Category, Favorite, Order, OrderItem, Product, ProductTag, Style, Tag, defer_products_count,
+    recount_products,
+)
+from marketplace.search import get_backend
+from decimal import Decimal
 import random
+import time
+
+
+class Generator:
+    prefix = 'gen'
+
+    def __init__(self, cmd, chunk_size, seed):
+        self.cmd = cmd
+        self.chunk_size = chunk_size
+        self.rnd = random.Random(seed)
+
+    def chunks(self, label, total, make):
+        t = time.perf_counter()
+        done = 0
+        for start in range(0, total, self.chunk_size):
+            batch = make(start, min(start + self.chunk_size, total))
+            with transaction.atomic():
+                batch()
+            done = min(start + self.chunk_size, total)
+            rate = done / max(time.perf_counter() - t, 1e-9)
+            self.cmd.stdout.write(f'\r{label}: {done}/{total} ({rate:.0f} строк/с)', ending='')
+            self.cmd.stdout.flush()
+        elapsed = time.perf_counter() - t
+        self.cmd.stdout.write('')
+        self.cmd.stdout.write(self.cmd.style.SUCCESS(
+            f'{label}: {total} строк за {elapsed:.1f} c, {total / max(elapsed, 1e-9):.0f} строк/с'
+        ))
+
+    def products(self, n, cat_ids, style_ids):
+        rnd = self.rnd
+        tags = ['Figma', 'Sketch', 'PSD', 'AI', 'SVG', 'PNG', 'HTML', 'React', 'Tailwind', '3D']
+        words = ['Modern', 'Minimal', 'Pro', 'UI', 'Kit', 'Mockup', 'Icons', 'Bundle', 'Template', 'Pack']
+
+        Tag.objects.bulk_create([Tag(name=t) for t in tags], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=tags).values_list('name', 'pk'))
+
+        def make(a, b):
+            picked = {f'{self.prefix}-product-{i}': rnd.sample(tags, rnd.randrange(1, 4)) for i in range(a, b)}
+            objs = [
+                Product(
+                    name=f'{rnd.choice(words)} {rnd.choice(words)} {i}',
+                    slug=f'{self.prefix}-product-{i}',
+                    description='Синтетический продукт для нагрузочного тестирования',
+                    category_id=rnd.choice(cat_ids),
+                    style_id=rnd.choice(style_ids),
+                    price=rnd.randrange(0, 10000),
+                    image='https://images.unsplash.com/photo-1561070791-2526d30994b5?w=800&h=600&fit=crop',
+                    author=f'Author {rnd.randrange(1000)}',
+                    rating=Decimal(rnd.randrange(0, 501)) / 100,
+                    reviews_count=rnd.randrange(1000),
+                    downloads=int(rnd.paretovariate(1.2) * 10),
+                    is_featured=rnd.random() < 0.02,
+                )
+                for i in range(a, b)
+            ]
+
+            def run():
+                Product.objects.bulk_create(objs, ignore_conflicts=True)
+                ids = Product.objects.filter(slug__in=picked).values_list('slug', 'pk')
+                ProductTag.objects.bulk_create([
+                    ProductTag(product_id=pk, tag_id=tag_ids[t], position=j)
+                    for slug, pk in ids for j, t in enumerate(picked[slug])
+                ], ignore_conflicts=True)
+            return run
+
+        self.chunks('Продукты', n, make)
+
+    def users(self, n):
+        password = make_password('testpass123')
+
+        def make(a, b):
+            objs = [
+                User(username=f'{self.prefix}-user-{i}', email=f'{self.prefix}-user-{i}@example.com', password=password)
+                for i in range(a, b)
+            ]
+            return lambda: User.objects.bulk_create(objs, ignore_conflicts=True)
+
+        self.chunks('Пользователи', n, make)
+
+    def carts_and_favorites(self):
+        rnd = self.rnd
+        user_ids = list(
+            User.objects.filter(username__startswith=f'{self.prefix}-user-').order_by('pk').values_list('pk', flat=True)
+        )
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        if not user_ids or not product_ids:
+            return
+
+        def make_carts(a, b):
+            objs = [
+                CartItem(user_id=u, product_id=p, quantity=rnd.randrange(1, 4))
+                for u in user_ids[a:b]
+                for p in rnd.sample(product_ids, min(len(product_ids), rnd.randrange(0, 5)))
+            ]
+            return lambda: CartItem.objects.bulk_create(objs, ignore_conflicts=True)
+
+        def make_favorites(a, b):
+            objs = [
+                Favorite(user_id=u, product_id=p)
+                for u in user_ids[a:b]
+                for p in rnd.sample(product_ids, min(len(product_ids), rnd.randrange(0, 10)))
+            ]
+            return lambda: Favorite.objects.bulk_create(objs, ignore_conflicts=True)
+
+        self.chunks('Корзины (пользователи)', len(user_ids), make_carts)
+        self.chunks('Избранное (пользователи)', len(user_ids), make_favorites)
+
+    def orders(self, n):
+        rnd = self.rnd
+        domain = f'@{self.prefix}-order.example.com'
+        have = Order.objects.filter(email__endswith=domain).count()
+        if have >= n:
+            self.cmd.stdout.write(f'Заказы: уже есть {have}')
+            return
+        users = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        top = Product.objects.aggregate(m=Max('pk'))['m'] or 0
+        statuses = [s for s, _ in Order.STATUS_CHOICES]
+
+        def make(a, b):
+            def run():
+                lines = [
+                    [(rnd.randrange(1, top + 1), rnd.randrange(1, 3)) for _ in range(rnd.randrange(1, 5))]
+                    for _ in range(a, b)
+                ]
+                prices = dict(
+                    Product.objects.filter(pk__in={p for ls in lines for p, _ in ls}).values_list('pk', 'price')
+                )
+                orders, items = [], []
+                for i, ls in zip(range(a, b), lines):
+                    ls = [(p, q) for p, q in dict(ls).items() if p in prices]
+                    orders.append(Order(
+                        user_id=rnd.choice(users),
+                        status=rnd.choice(statuses),
+                        total_price=sum((prices[p] * q for p, q in ls), Decimal(0)),
+                        email=f'order-{i}{domain}',
+                    ))
+                    items.append(ls)
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create([
+                    OrderItem(order_id=o.pk, product_id=p, quantity=q, price=prices[p])
+                    for o, ls in zip(orders, items)
+                    for p, q in ls
+                ])
+            return run
+
+        self.chunks('Заказы', n - have, lambda a, b: make(a + have, b + have))
 
 
 class Command(BaseCommand):
     help = 'Загрузка тестовых данных'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=0, help='Синтетических продуктов')
+        parser.add_argument('--users', type=int, default=0, help='Синтетических пользователей с корзинами и избранным')
+        parser.add_argument('--orders', type=int, default=0, help='Синтетических заказов')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
         self.stdout.write('Загрузка тестовых данных...')
 
         if not User.objects.filter(username='testuser').exists():
@@ -26,12 +187,7 @@ class Command(BaseCommand):
             {'name': 'Графика', 'slug': 'graphics', 'description': 'Графические элементы'},
         ]
 
-        for c in categories_data:
-            Category.objects.get_or_create(
-                slug=c['slug'],
-                defaults={'name': c['name'], 'description': c['description']}
-            )
-        
+        Category.objects.bulk_create([Category(**c) for c in categories_data], ignore_conflicts=True)
         self.stdout.write(self.style.SUCCESS(f'Создано {len(categories_data)} категорий'))
 
         styles_data = [
@@ -44,16 +200,11 @@ class Command(BaseCommand):
             {'name': 'Modern', 'slug': 'modern', 'description': 'Современный стиль'},
         ]
 
-        for s in styles_data:
-            Style.objects.get_or_create(
-                slug=s['slug'],
-                defaults={'name': s['name'], 'description': s['description']}
-            )
-        
+        Style.objects.bulk_create([Style(**s) for s in styles_data], ignore_conflicts=True)
         self.stdout.write(self.style.SUCCESS(f'Создано {len(styles_data)} стилей'))
 
-        cats = list(Category.objects.all())
-        sts = list(Style.objects.all())
+        cats = dict(Category.objects.values_list('slug', 'pk'))
+        sts = dict(Style.objects.values_list('slug', 'pk'))
 
         products_data = [
             {
@@ -358,31 +509,36 @@ class Command(BaseCommand):
             },
         ]
 
-        cnt = 0
-        for p in products_data:
-            cat = Category.objects.get(slug=p['category'])
-            st = Style.objects.get(slug=p['style'])
-            
-            prod, cr = Product.objects.get_or_create(
-                slug=p['slug'],
-                defaults={
-                    'name': p['name'],
-                    'description': p['description'],
-                    'category': cat,
-                    'style': st,
-                    'price': p['price'],
-                    'image': p['image'],
-                    'author': p['author'],
-                    'rating': p['rating'],
-                    'reviews_count': p['reviews_count'],
-                    'downloads': p['downloads'],
-                    'tags': p['tags'],
-                    'is_featured': p['is_featured'],
-                }
+        existing = set(Product.objects.filter(slug__in=[p['slug'] for p in products_data]).values_list('slug', flat=True))
+        new = [
+            Product(
+                category_id=cats[p['category']], style_id=sts[p['style']],
+                **{k: v for k, v in p.items() if k not in ('category', 'style', 'tags')}
             )
-            
-            if cr:
-                cnt += 1
+            for p in products_data if p['slug'] not in existing
+        ]
+        Product.objects.bulk_create(new)
+        tags = {p['slug']: p['tags'] for p in products_data}
+        for p in Product.objects.filter(slug__in=[p.slug for p in new]):
+            p.set_tags(tags[p.slug])
+        self.stdout.write(self.style.SUCCESS(f'Создано {len(new)} продуктов'))
+
+        gen = Generator(self, options['chunk_size'], options['seed'])
+        with defer_products_count():
+            if options['products']:
+                gen.products(options['products'], list(cats.values()), list(sts.values()))
+            if options['users']:
+                gen.users(options['users'])
+            if options['users'] and (options['products'] or Product.objects.exists()):
+                gen.carts_and_favorites()
+            if options['orders']:
+                gen.orders(options['orders'])
+        recount_products(Category)
+        recount_products(Style)
+
+        backend = get_backend()
+        if backend and (new or options['products']):
+            n = backend.rebuild(Product.objects.all())
+            self.stdout.write(f'Поисковый индекс: {n} продуктов')
 
-        self.stdout.write(self.style.SUCCESS(f'Создано {cnt} продуктов'))
-        self.stdout.write(self.style.SUCCESS('Загрузка данных завершена!'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Загрузка данных завершена!'))
@@ -0,0 +1,140 @@
+import bisect
+import heapq
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+REGISTRY = []
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, v in sorted(self._values.items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {v}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            v[0][i] += 1
+            v[1] += value
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for labels, (counts, total) in items:
+            acc = 0
+            for le, n in zip(self.buckets + (float('inf'),), counts):
+                acc += n
+                le = '+Inf' if le == float('inf') else repr(le)
+                yield f'{self.name}_bucket{format_labels(self.labelnames + ("le",), labels + (le,))} {acc}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {acc}'
+
+
+# Stats of the request being handled, set by RequestMetricsMiddleware.
+request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'serialization_time', 'slowest', 'keep', 'depth')
+
+    def __init__(self, keep):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.slowest = []
+        self.keep = keep
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        t = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            d = time.perf_counter() - t
+            self.queries += 1
+            self.db_time += d
+            if self.keep:
+                item = (d, self.queries, sql)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, item)
+                elif d > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, item)
+
+
+def timed(fget):
+    def wrapper(*args):
+        stats = request_stats.get()
+        if stats is None or stats.depth:
+            return fget(*args)
+        stats.depth += 1
+        db = stats.db_time
+        t = time.perf_counter()
+        try:
+            return fget(*args)
+        finally:
+            stats.depth -= 1
+            stats.serialization_time += time.perf_counter() - t - (stats.db_time - db)
+    wrapper.__wrapped__ = fget
+    return wrapper
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for n, v in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,120 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .metrics import Histogram, RequestStats, request_stats, timed
+
+
+logger = logging.getLogger('marketplace.slow_requests')
+
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+request_seconds = Histogram('marketplace_request_seconds', 'Полное время запроса', ['view'])
+db_seconds = Histogram('marketplace_request_db_seconds', 'Время SQL-запросов за запрос', ['view'])
+serialization_seconds = Histogram(
+    'marketplace_request_serialization_seconds', 'Время сериализации и рендеринга без SQL', ['view']
+)
+queries = Histogram('marketplace_request_queries', 'Количество SQL-запросов за запрос', ['view'], QUERY_BUCKETS)
+
+
+def instrument_rest_framework():
+    # Serializer.data and Response.rendered_content are where DRF spends its
+    # serialization time; wrap them once so it can be attributed per request.
+    for cls, name in ((serializers.BaseSerializer, 'data'), (Response, 'rendered_content')):
+        prop = cls.__dict__[name]
+        if not hasattr(prop.fget, '__wrapped__'):
+            setattr(cls, name, property(timed(prop.fget)))
+
+
+def view_name(view_func):
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    return cls.__name__
+
+
+def resolved_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    name = view_name(match.func)
+    if hasattr(match.func, 'cls'):
+        actions = getattr(match.func, 'actions', None) or {}
+        name = f'{name}.{actions.get(request.method.lower(), request.method.lower())}'
+    return name
+
+
+def record_query(execute, sql, params, many, context):
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Per connection rather than per request: under ASGI the ORM runs on other
+    # threads' connections, and only the request context follows it there.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        instrument_rest_framework()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, t = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        self.finish(request, response, stats, t)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, t = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        self.finish(request, response, stats, t)
+        return response
+
+    def start(self):
+        stats = RequestStats(getattr(settings, 'REQUEST_METRICS_SLOW_QUERIES', 5))
+        return stats, request_stats.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, t):
+        total = time.perf_counter() - t
+        view = resolved_view_name(request)
+        request_seconds.observe(total, view)
+        db_seconds.observe(stats.db_time, view)
+        serialization_seconds.observe(max(stats.serialization_time, 0.0), view)
+        queries.observe(stats.queries, view)
+
+        if total * 1000 >= getattr(settings, 'REQUEST_METRICS_SLOW_MS', 500):
+            logger.warning(
+                'Медленный запрос %s %s -> %s (%s): %.1f ms, SQL: %d запросов / %.1f ms, сериализация %.1f ms%s',
+                request.method, request.get_full_path(), response.status_code, view, total * 1000,
+                stats.queries, stats.db_time * 1000, stats.serialization_time * 1000,
+                ''.join(
+                    f'\n  #{n} {d * 1000:.1f} ms: {sql}'
+                    for d, n, sql in sorted(stats.slowest, reverse=True)
+                ),
+            )
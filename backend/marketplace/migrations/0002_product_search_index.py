@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from marketplace.search import get_backend
+
+
+def create_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.alias)
+    if backend is None:
+        return
+    backend.create()
+    backend.rebuild(apps.get_model('marketplace', 'Product').objects.all())
+
+
+def drop_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.alias)
+    if backend is not None:
+        backend.drop()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_products_count(apps, schema_editor):
+    Product = apps.get_model('marketplace', 'Product')
+    db = schema_editor.connection.alias
+    for name in ('Category', 'Style'):
+        model = apps.get_model('marketplace', name)
+        field = name.lower()
+        n = (
+            Product.objects.using(db)
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(n=Count('pk'))
+            .values('n')
+        )
+        model.objects.using(db).update(products_count=Coalesce(Subquery(n), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество продуктов'),
+        ),
+        migrations.AddField(
+            model_name='style',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество продуктов'),
+        ),
+        migrations.RunPython(fill_products_count, migrations.RunPython.noop),
+    ]
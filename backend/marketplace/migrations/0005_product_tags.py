@@ -0,0 +1,95 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CHUNK = 2000
+
+
+def copy_tags(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Product = apps.get_model('marketplace', 'Product')
+    Tag = apps.get_model('marketplace', 'Tag')
+    ProductTag = apps.get_model('marketplace', 'ProductTag')
+
+    def lists():
+        for pk, tags in Product.objects.using(db).order_by('pk').values_list('pk', 'tags').iterator(CHUNK):
+            if isinstance(tags, list):
+                yield pk, list(dict.fromkeys(t.strip() for t in tags if isinstance(t, str) and t.strip()))
+
+    names = {n for _, ts in lists() for n in ts}
+    Tag.objects.using(db).bulk_create([Tag(name=n) for n in sorted(names)], batch_size=CHUNK, ignore_conflicts=True)
+    ids = dict(Tag.objects.using(db).values_list('name', 'pk'))
+    batch = []
+    for pk, ts in lists():
+        batch += [ProductTag(product_id=pk, tag_id=ids[n], position=i) for i, n in enumerate(ts)]
+        if len(batch) >= CHUNK:
+            ProductTag.objects.using(db).bulk_create(batch)
+            batch = []
+    ProductTag.objects.using(db).bulk_create(batch)
+
+
+def restore_tags(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Product = apps.get_model('marketplace', 'Product')
+    ProductTag = apps.get_model('marketplace', 'ProductTag')
+    tags = {}
+    for pk, name in ProductTag.objects.using(db).order_by('product_id', 'position').values_list('product_id', 'tag__name'):
+        tags.setdefault(pk, []).append(name)
+    batch = [Product(pk=pk, tags=ts) for pk, ts in tags.items()]
+    Product.objects.using(db).bulk_update(batch, ['tags'], batch_size=CHUNK)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_product_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Тег',
+                'verbose_name_plural': 'Теги',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='marketplace.product')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='product_links', to='marketplace.tag')),
+            ],
+            options={
+                'verbose_name': 'Тег продукта',
+                'verbose_name_plural': 'Теги продуктов',
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='producttag',
+            index=models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='producttag',
+            constraint=models.UniqueConstraint(fields=('product', 'tag'), name='product_tag_unique'),
+        ),
+        migrations.RunPython(copy_tags, restore_tags),
+        migrations.RemoveField(
+            model_name='product',
+            name='tags',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tags',
+            field=models.ManyToManyField(related_name='products', through='marketplace.ProductTag', to='marketplace.tag', verbose_name='Теги'),
+        ),
+    ]
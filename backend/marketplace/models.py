@@ -1,5 +1,12 @@
-from django.db import models
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -7,6 +14,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name='Название')
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True, verbose_name='Описание')
+    products_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество продуктов')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -22,6 +30,7 @@ class Style(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name='Название')
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True, verbose_name='Описание')
+    products_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество продуктов')
 
     class Meta:
         verbose_name = 'Стиль'
@@ -32,31 +41,229 @@ class Style(models.Model):
         return self.name
 
 
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name='Название')
+
+    class Meta:
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+# Sent after ProductQuerySet bulk writes, which bypass post_save/post_delete.
+products_bulk_changed = Signal()
+# Sent by Product.set_tags(), which writes the links in bulk.
+product_tags_changed = Signal()
+
+_counts_deferred = ContextVar('products_count_deferred', default=False)
+
+
+@contextmanager
+def defer_products_count():
+    token = _counts_deferred.set(True)
+    try:
+        yield
+    finally:
+        _counts_deferred.reset(token)
+
+
+def products_count_deferred():
+    return _counts_deferred.get()
+
+
+def shift_products_count(model, pk, delta, using='default'):
+    if pk is None:
+        return
+    q = model.objects.using(using).filter(pk=pk)
+    if delta < 0:
+        q = q.filter(products_count__gte=-delta)
+    q.update(products_count=F('products_count') + delta)
+
+
+def recount_products(model, ids=None, using='default'):
+    n = (
+        Product.objects.using(using)
+        .filter(**{model._meta.model_name: OuterRef('pk')})
+        .order_by()
+        .values(model._meta.model_name)
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    q = model.objects.using(using)
+    if ids is not None:
+        ids = {i for i in ids if i is not None}
+        if not ids:
+            return 0
+        q = q.filter(pk__in=ids)
+    return q.update(products_count=Coalesce(Subquery(n), Value(0)))
+
+
+def tags_prefetch(prefix=''):
+    return models.Prefetch(f'{prefix}tag_links', ProductTag.objects.select_related('tag'))
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_tags(self):
+        return self.prefetch_related(tags_prefetch())
+
+    def tagged(self, names, match_all=True):
+        # Walks the (tag, product) index; match_all keeps products linked to every name.
+        links = ProductTag.objects.using(self.db).filter(tag__name__in=names).order_by()
+        if match_all:
+            links = links.values('product_id').annotate(n=Count('tag_id')).filter(n=len(set(names)))
+        return self.filter(pk__in=links.values('product_id'))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if not products_count_deferred():
+                recount_products(Category, {o.category_id for o in objs}, self.db)
+                recount_products(Style, {o.style_id for o in objs}, self.db)
+        products_bulk_changed.send(sender=self.model, using=self.db)
+        return objs
+
+    def update(self, **kwargs):
+        # auto_now is not applied by update(); the export's ?since= relies on updated_at.
+        kwargs.setdefault('updated_at', timezone.now())
+        touched = [f for f in ('category', 'style') if f in kwargs or f + '_id' in kwargs]
+        if not touched:
+            n = super().update(**kwargs)
+            products_bulk_changed.send(sender=self.model, using=self.db)
+            return n
+
+        with transaction.atomic(using=self.db):
+            ids = {f: set(self.order_by().values_list(f + '_id', flat=True).distinct()) for f in touched}
+            n = super().update(**kwargs)
+            for f in touched:
+                model = Category if f == 'category' else Style
+                new = kwargs.get(f, kwargs.get(f + '_id'))
+                if isinstance(new, models.Model):
+                    new = new.pk
+                if new is None or isinstance(new, int):
+                    recount_products(model, ids[f] | {new}, self.db)
+                else:
+                    recount_products(model, using=self.db)
+        products_bulk_changed.send(sender=self.model, using=self.db)
+        return n
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            cats = set(self.order_by().values_list('category_id', flat=True).distinct())
+            sts = set(self.order_by().values_list('style_id', flat=True).distinct())
+            with defer_products_count():
+                res = super().delete()
+            recount_products(Category, cats, self.db)
+            recount_products(Style, sts, self.db)
+        products_bulk_changed.send(sender=self.model, using=self.db)
+        return res
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255, verbose_name='Название')
     slug = models.SlugField(unique=True)
     description = models.TextField(verbose_name='Описание')
-    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', verbose_name='Категория')
-    style = models.ForeignKey(Style, on_delete=models.SET_NULL, null=True, related_name='products', verbose_name='Стиль')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', db_index=False, verbose_name='Категория')
+    style = models.ForeignKey(Style, on_delete=models.SET_NULL, null=True, related_name='products', db_index=False, verbose_name='Стиль')
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name='Цена')
     image = models.URLField(max_length=500, verbose_name='Изображение')
     author = models.CharField(max_length=255, verbose_name='Автор')
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(5)], verbose_name='Рейтинг')
     reviews_count = models.IntegerField(default=0, verbose_name='Количество отзывов')
     downloads = models.IntegerField(default=0, verbose_name='Скачиваний')
-    tags = models.JSONField(default=list, verbose_name='Теги')
+    tags = models.ManyToManyField(Tag, through='ProductTag', related_name='products', verbose_name='Теги')
     is_featured = models.BooleanField(default=False, verbose_name='Избранное')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    # Loaded values compared in post_save to find what a save actually changed.
+    tracked_fields = ('category_id', 'style_id', 'downloads', 'is_featured')
+
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['-downloads', '-id'], name='product_downloads_idx'),
+            models.Index(fields=['-rating', '-id'], name='product_rating_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_cat_created_idx'),
+            models.Index(fields=['category', '-downloads', '-id'], name='product_cat_downloads_idx'),
+            models.Index(fields=['category', '-rating', '-id'], name='product_cat_rating_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['style', '-created_at', '-id'], name='product_style_created_idx'),
+            models.Index(fields=['style', '-downloads', '-id'], name='product_style_downloads_idx'),
+            models.Index(fields=['style', '-rating', '-id'], name='product_style_rating_idx'),
+            models.Index(fields=['style', 'price', 'id'], name='product_style_price_idx'),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_featured=True),
+                name='product_featured_idx',
+            ),
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        d = instance.__dict__
+        instance._loaded = {f: d[f] for f in cls.tracked_fields if f in d}
+        return instance
+
+    @property
+    def tag_names(self):
+        links = self.tag_links.all()
+        if 'tag_links' not in getattr(self, '_prefetched_objects_cache', {}):
+            links = links.select_related('tag')
+        return [l.tag.name for l in links]
+
+    def set_tags(self, names):
+        db = self._state.db or 'default'
+        names = list(dict.fromkeys(n.strip() for n in names if isinstance(n, str) and n.strip()))
+        with transaction.atomic(using=db):
+            Tag.objects.using(db).bulk_create([Tag(name=n) for n in names], ignore_conflicts=True)
+            tags = dict(Tag.objects.using(db).filter(name__in=names).values_list('name', 'pk'))
+            ProductTag.objects.using(db).filter(product=self).delete()
+            ProductTag.objects.using(db).bulk_create([
+                ProductTag(product=self, tag_id=tags[n], position=i) for i, n in enumerate(names)
+            ])
+            # Tags are part of the exported row; the plain update skips products_bulk_changed.
+            self.updated_at = timezone.now()
+            models.QuerySet.update(Product.objects.using(db).filter(pk=self.pk), updated_at=self.updated_at)
+        getattr(self, '_prefetched_objects_cache', {}).pop('tag_links', None)
+        product_tags_changed.send(sender=Product, instance=self, using=db)
+
+
+class ProductTag(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='tag_links', db_index=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='product_links', db_index=False)
+    # Keeps the order the tags were given in, which the API returns.
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Тег продукта'
+        verbose_name_plural = 'Теги продуктов'
+        ordering = ['position']
+        # Product -> tags via the unique index, tag -> products via the reverse one.
+        constraints = [models.UniqueConstraint(fields=['product', 'tag'], name='product_tag_unique')]
+        indexes = [models.Index(fields=['tag', 'product'], name='product_tag_tag_idx')]
+
+    def __str__(self):
+        return f'{self.product_id} - {self.tag_id}'
+
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites')
@@ -73,12 +280,72 @@ class Favorite(models.Model):
         return f'{self.user.username} - {self.product.name}'
 
 
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+
+class CartItemManager(models.Manager):
+    def _upsert_sql(self, connection, rows, select=False):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        cols = ', '.join(qn(c) for c in ('user_id', 'product_id', 'quantity', 'created_at'))
+        if select:
+            source = f'SELECT %s, {qn("id")}, %s, %s FROM {qn(Product._meta.db_table)} WHERE {qn("id")} = %s'
+        else:
+            source = 'VALUES ' + ', '.join(['(%s, %s, %s, %s)'] * rows)
+        return (
+            f'INSERT INTO {table} ({cols}) {source} '
+            f'ON CONFLICT ({qn("user_id")}, {qn("product_id")}) '
+            f'DO UPDATE SET {qn("quantity")} = {table}.{qn("quantity")} + excluded.{qn("quantity")} '
+            f'RETURNING {qn("id")}'
+        )
+
+    def _created_at(self, connection):
+        return self.model._meta.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+
+    def add_quantity(self, user, product_id, quantity=1):
+        connection = connections[self.db]
+        if connection.vendor not in UPSERT_VENDORS:
+            if not Product.objects.using(self.db).filter(pk=product_id).exists():
+                return None
+            ci, created = self.get_or_create(user=user, product_id=product_id, defaults={'quantity': quantity})
+            if not created:
+                self.filter(pk=ci.pk).update(quantity=F('quantity') + quantity)
+            return ci.pk
+
+        # INSERT ... SELECT FROM product doubles as the existence check: no row, no insert.
+        with connection.cursor() as c:
+            c.execute(
+                self._upsert_sql(connection, 1, select=True),
+                [user.pk, quantity, self._created_at(connection), product_id],
+            )
+            row = c.fetchone()
+        return row[0] if row else None
+
+    def add_quantities(self, user, quantities):
+        connection = connections[self.db]
+        if not quantities:
+            return
+        if connection.vendor not in UPSERT_VENDORS:
+            for pid, qty in quantities.items():
+                self.add_quantity(user, pid, qty)
+            return
+
+        created_at = self._created_at(connection)
+        params = []
+        for pid, qty in quantities.items():
+            params.extend([user.pk, pid, qty, created_at])
+        with connection.cursor() as c:
+            c.execute(self._upsert_sql(connection, len(quantities)), params)
+
+
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1, validators=[MinValueValidator(1)])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemManager()
+
     class Meta:
         verbose_name = 'Товар в корзине'
         verbose_name_plural = 'Товары в корзине'
@@ -0,0 +1,188 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Category, Style
+
+
+# Seek pagination over ?ordering= with the primary key as a tiebreaker. It is only
+# enabled by ?page_size= or ?cursor=, so plain list requests still return an array.
+class KeysetPagination(BasePagination):
+    page_size = 24
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    tiebreaker = 'pk'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.page_queryset(queryset, request, view)
+        if page is None:
+            return None
+        rows = self.page_rows(list(page))
+        self.count = None
+        if self.with_count:
+            self.count = self.get_count_estimate(self.filtered.order_by(), request, view)
+        return rows
+
+    def page_queryset(self, queryset, request, view=None):
+        # The sliced page query, not run yet: page_rows() takes its rows.
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, view)
+        self.field = self.ordering.lstrip('-')
+        cursor = self.decode_cursor(request, queryset.model._meta.get_field(self.field))
+        self.reverse = bool(cursor and cursor['r'])
+        self.has_cursor = cursor is not None
+        desc = self.ordering.startswith('-') != self.reverse
+
+        sign = '-' if desc else ''
+        queryset = queryset.order_by(sign + self.field, sign + self.tiebreaker)
+        # What the count estimates: the whole result, not what is left after the cursor.
+        self.filtered = queryset
+        if cursor:
+            op = 'lt' if desc else 'gt'
+            v = cursor['v']
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{op}e': v})
+                & (Q(**{f'{self.field}__{op}': v}) | Q(**{f'{self.tiebreaker}__{op}': cursor['id']}))
+            )
+        self.with_count = params.get(self.count_query_param) in ('1', 'true')
+        self.count = None
+        return queryset[:self.limit + 1]
+
+    def page_rows(self, rows):
+        more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.reverse:
+            rows.reverse()
+
+        has_next = True if self.reverse else more
+        has_prev = more if self.reverse else self.has_cursor
+        self.next = self.encode_cursor(rows[-1], self.field, False) if rows and has_next else None
+        self.previous = self.encode_cursor(rows[0], self.field, True) if rows and has_prev else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            n = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(n, self.max_page_size))
+
+    def get_ordering(self, request, view):
+        fields = getattr(view, 'ordering_fields', None) or []
+        for term in request.query_params.get(api_settings.ORDERING_PARAM, '').split(','):
+            term = term.strip()
+            if term.lstrip('-') in fields:
+                return term
+        return (getattr(view, 'ordering', None) or ['-' + self.tiebreaker])[0]
+
+    def decode_cursor(self, request, field):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode() + b'=' * (-len(token) % 4)))
+            if data['o'] != self.ordering:
+                raise ValueError
+            # Ordering fields are not nullable: a null value only comes from a crafted cursor.
+            if data['v'] is None or data['r'] not in (0, 1):
+                raise ValueError
+            data['v'] = field.to_python(data['v'])
+            data['id'] = int(data['id'])
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return data
+
+    def encode_cursor(self, obj, field, reverse):
+        # Rows are model instances, or .values() dicts on the fast JSON path.
+        if isinstance(obj, dict):
+            v, pk = obj[field], obj['id']
+        else:
+            v, pk = getattr(obj, field), obj.pk
+        if isinstance(v, Decimal):
+            v = str(v)
+        elif hasattr(v, 'isoformat'):
+            v = v.isoformat()
+        data = {'o': self.ordering, 'v': v, 'id': pk, 'r': int(reverse)}
+        token = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def get_count_estimate(self, queryset, request, view):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as c:
+            c.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = c.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_paginated_data(self, data):
+        body = {'next': self.next, 'previous': self.previous, 'results': data}
+        if self.with_count:
+            body = {'count': self.count, **body}
+        return body
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductKeysetPagination(KeysetPagination):
+    taxonomy_params = {
+        'category__slug': (Category, 'slug'),
+        'category': (Category, 'name'),
+        'style__slug': (Style, 'slug'),
+        'style': (Style, 'name'),
+    }
+    ignored_params = {
+        KeysetPagination.page_size_query_param,
+        KeysetPagination.cursor_query_param,
+        KeysetPagination.count_query_param,
+        api_settings.ORDERING_PARAM,
+        'format',
+    }
+
+    def get_count_estimate(self, queryset, request, view):
+        params = {k: v for k, v in request.query_params.items() if k not in self.ignored_params and v}
+        if getattr(view, 'action', None) == 'featured' or not set(params) <= set(self.taxonomy_params):
+            return super().get_count_estimate(queryset, request, view)
+
+        counts = []
+        for key, value in params.items():
+            model, lookup = self.taxonomy_params[key]
+            row = model.objects.using(queryset.db).filter(**{lookup: value}).values_list('products_count', flat=True)
+            counts.append(next(iter(row), 0))
+        if not counts:
+            counts.append(sum(Category.objects.using(queryset.db).values_list('products_count', flat=True)))
+        return min(counts)
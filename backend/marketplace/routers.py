@@ -0,0 +1,78 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+
+_read_db = ContextVar('read_db', default=None)
+
+
+def replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def _sticky_key(user):
+    return f'marketplace:db:sticky:{user.pk}'
+
+
+def stick_to_primary(user):
+    # Replicas may lag behind the write the user is about to read back.
+    cache.set(_sticky_key(user), 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 10))
+
+
+def is_sticky(user):
+    return bool(user and user.is_authenticated and cache.get(_sticky_key(user)))
+
+
+def choose_replica(user):
+    dbs = replicas()
+    return random.choice(dbs) if dbs and not is_sticky(user) else None
+
+
+class ReplicaRouter:
+    # Reads go to a replica only inside ReplicaReadMixin views; everything else,
+    # and every write, uses the primary.
+    def db_for_read(self, model, **hints):
+        return _read_db.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        dbs = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    # Set after authentication, so the user lookup itself stays on the primary.
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        db = choose_replica(request.user) if request.method in SAFE_METHODS else None
+        if db:
+            self._read_db_token = _read_db.set(db)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_read_db_token', None)
+        if token is not None:
+            _read_db.reset(token)
+            self._read_db_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class StickyPrimaryMiddleware:
+    # DRF authenticates in the view and sets request.user, so it is known here.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas():
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                stick_to_primary(user)
+        return response
@@ -0,0 +1,229 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import tags_prefetch
+
+
+TABLE = 'marketplace_product_search'
+COLUMNS = ('name', 'description', 'author', 'tags')
+WEIGHTS = (10.0, 1.0, 3.0, 5.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile('[а-я]')
+
+_RU_REFLEXIVE = ('ся', 'сь')
+_RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь', 'ете', 'ите',
+    'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ть', 'ет', 'ут', 'ют', 'ит', 'ат',
+    'ят', 'ла', 'ло', 'ли', 'ия', 'ию', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+_EN_ENDINGS = sorted((
+    'ational', 'ations', 'ation', 'ness', 'ment', 'ings', 'ing', 'edly', 'ed',
+    'ies', 'es', 'ly', 's',
+), key=len, reverse=True)
+
+MIN_STEM = 3
+
+
+def _strip(word, endings):
+    for e in endings:
+        if word.endswith(e) and len(word) - len(e) >= MIN_STEM:
+            return word[:-len(e)]
+    return word
+
+
+# Catalog text reuses a small vocabulary: bulk indexing stems the same words over and over.
+@lru_cache(maxsize=100_000)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if len(word) <= MIN_STEM or word.isdigit():
+        return word
+    if _CYRILLIC_RE.search(word):
+        word = _strip(word, _RU_REFLEXIVE)
+        word = _strip(word, _RU_ENDINGS)
+        return _strip(word, ('ь', 'и'))
+    word = _strip(word, _EN_ENDINGS)
+    if word.endswith('e') and len(word) > MIN_STEM:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [stem(t) for t in _TOKEN_RE.findall(text or '')]
+
+
+def document(product):
+    # Historical models before migration 0005 still carry the JSON list.
+    tags = product.tags if isinstance(product.tags, list) else product.tag_names
+    return (
+        ' '.join(tokenize(product.name)),
+        ' '.join(tokenize(product.description)),
+        ' '.join(tokenize(product.author)),
+        ' '.join(tokenize(' '.join(str(t) for t in tags))),
+    )
+
+
+class BaseSearchBackend:
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+
+    def create(self):
+        raise NotImplementedError
+
+    def drop(self):
+        raise NotImplementedError
+
+    def clear(self):
+        with self.connection.cursor() as c:
+            c.execute(f'DELETE FROM {TABLE}')
+
+    def update(self, products, replace=True):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def match(self, terms):
+        # (sql, params) of a query selecting the ids of the matching products.
+        raise NotImplementedError
+
+    def query(self, terms, limit):
+        raise NotImplementedError
+
+    def matches(self, text):
+        # All matches as a subquery, for results ordered by something else than rank.
+        terms = tokenize(text)
+        return RawSQL(*self.match(terms)) if terms else None
+
+    def search(self, text, limit=None):
+        terms = tokenize(text)
+        if not terms:
+            return None
+        if limit is None:
+            limit = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 500)
+        return self.query(terms, limit)
+
+    def rebuild(self, queryset, chunk_size=2000):
+        n = 0
+        batch = []
+        qs = queryset.using(self.connection.alias).order_by()
+        if queryset.model._meta.get_field('tags').many_to_many:
+            qs = qs.only('id', *(c for c in COLUMNS if c != 'tags')).prefetch_related(tags_prefetch())
+        else:
+            qs = qs.only('id', *COLUMNS)
+        with transaction.atomic(using=self.connection.alias):
+            self.clear()
+            for p in qs.iterator(chunk_size=chunk_size):
+                batch.append(p)
+                if len(batch) >= chunk_size:
+                    self.update(batch, replace=False)
+                    n += len(batch)
+                    batch = []
+            if batch:
+                self.update(batch, replace=False)
+                n += len(batch)
+        return n
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    def create(self):
+        with self.connection.cursor() as c:
+            c.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} "
+                f"USING fts5({', '.join(COLUMNS)}, tokenize='unicode61 remove_diacritics 0')"
+            )
+
+    def drop(self):
+        with self.connection.cursor() as c:
+            c.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def update(self, products, replace=True):
+        rows = [(p.pk, *document(p)) for p in products]
+        if not rows:
+            return
+        with self.connection.cursor() as c:
+            if replace:
+                c.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(r[0],) for r in rows])
+            c.executemany(
+                f'INSERT INTO {TABLE} (rowid, {", ".join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def delete(self, ids):
+        with self.connection.cursor() as c:
+            c.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(i,) for i in ids])
+
+    def match(self, terms):
+        return f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [' '.join(f'"{t}"*' for t in terms)]
+
+    def query(self, terms, limit):
+        sql, params = self.match(terms)
+        weights = ', '.join(str(w) for w in WEIGHTS)
+        with self.connection.cursor() as c:
+            c.execute(f'{sql} ORDER BY bm25({TABLE}, {weights}) LIMIT %s', [*params, limit])
+            return [r[0] for r in c.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    LABELS = ('A', 'D', 'C', 'B')
+
+    def create(self):
+        with self.connection.cursor() as c:
+            c.execute(
+                f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+                f'product_id bigint PRIMARY KEY REFERENCES marketplace_product (id) '
+                f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            c.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document_gin ON {TABLE} USING gin (document)')
+
+    def drop(self):
+        with self.connection.cursor() as c:
+            c.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def update(self, products, replace=True):
+        rows = [(p.pk, *document(p)) for p in products]
+        if not rows:
+            return
+        vector = ' || '.join(f"setweight(to_tsvector('simple', %s), '{l}')" for l in self.LABELS)
+        with self.connection.cursor() as c:
+            c.executemany(
+                f'INSERT INTO {TABLE} (product_id, document) VALUES (%s, {vector}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def delete(self, ids):
+        with self.connection.cursor() as c:
+            c.execute(f'DELETE FROM {TABLE} WHERE product_id = ANY(%s)', [list(ids)])
+
+    def match(self, terms):
+        tsquery = ' & '.join(f'{t}:*' for t in terms)
+        return f"SELECT product_id FROM {TABLE} WHERE document @@ to_tsquery('simple', %s)", [tsquery]
+
+    def query(self, terms, limit):
+        tsquery = ' & '.join(f'{t}:*' for t in terms)
+        with self.connection.cursor() as c:
+            c.execute(
+                f"SELECT product_id FROM {TABLE}, to_tsquery('simple', %s) q "
+                f"WHERE document @@ q ORDER BY ts_rank(document, q) DESC LIMIT %s",
+                [tsquery, limit],
+            )
+            return [r[0] for r in c.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(using='default'):
+    cls = BACKENDS.get(connections[using].vendor)
+    return cls(using) if cls else None
@@ -1,32 +1,24 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Category, Style, Product, Favorite, CartItem, Order, OrderItem
+from .models import Category, Style, Product, Favorite, CartItem, Order, OrderItem, tags_prefetch
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    products_count = serializers.SerializerMethodField()
-
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'products_count']
 
-    def get_products_count(self, obj):
-        return obj.products.count()
-
 
 class StyleSerializer(serializers.ModelSerializer):
-    products_count = serializers.SerializerMethodField()
-
     class Meta:
         model = Style
         fields = ['id', 'name', 'slug', 'description', 'products_count']
 
-    def get_products_count(self, obj):
-        return obj.products.count()
-
 
 class ProductListSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     style_name = serializers.CharField(source='style.name', read_only=True)
+    tags = serializers.ListField(source='tag_names', child=serializers.CharField(), read_only=True)
 
     class Meta:
         model = Product
@@ -40,6 +32,7 @@ class ProductListSerializer(serializers.ModelSerializer):
 class ProductDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     style = StyleSerializer(read_only=True)
+    tags = serializers.ListField(source='tag_names', child=serializers.CharField(), read_only=True)
 
     class Meta:
         model = Product
@@ -67,7 +60,10 @@ class FavoriteSerializer(serializers.ModelSerializer):
             product_id=pid
         )
         
-        return f
+        return (
+            Favorite.objects.select_related('product__category', 'product__style')
+            .prefetch_related(tags_prefetch('product__')).get(pk=f.pk)
+        )
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -80,24 +76,28 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_id', 'quantity', 'total_price', 'created_at']
 
     def get_total_price(self, obj):
+        if hasattr(obj, 'total_price'):
+            return obj.total_price
         return obj.get_total_price()
 
     def create(self, validated_data):
         u = self.context['request'].user
         pid = validated_data['product_id']
         qty = validated_data.get('quantity', 1)
-        
-        ci, cr = CartItem.objects.get_or_create(
-            user=u,
-            product_id=pid,
-            defaults={'quantity': qty}
+
+        pk = CartItem.objects.add_quantity(u, pid, qty)
+        if pk is None:
+            raise serializers.ValidationError({'product_id': 'Продукт не найден'})
+
+        return (
+            CartItem.objects.select_related('product__category', 'product__style')
+            .prefetch_related(tags_prefetch('product__')).get(pk=pk)
         )
-        
-        if not cr:
-            ci.quantity += qty
-            ci.save()
-        
-        return ci
+
+
+class BulkItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -124,27 +124,37 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         u = self.context['request'].user
-        cis = CartItem.objects.filter(user=u)
-        
-        if not cis.exists():
-            raise serializers.ValidationError('Корзина пуста')
-        
-        tp = sum(i.get_total_price() for i in cis)
-        
-        o = Order.objects.create(
-            user=u,
-            total_price=tp,
-            email=validated_data.get('email', u.email)
-        )
-        
-        for ci in cis:
-            OrderItem.objects.create(
-                order=o,
-                product=ci.product,
-                quantity=ci.quantity,
-                price=ci.product.price
+
+        with transaction.atomic():
+            cis = list(
+                CartItem.objects.select_for_update(of=('self',))
+                .filter(user=u)
+                .select_related('product__category', 'product__style')
+                .prefetch_related(tags_prefetch('product__'))
+                .order_by('pk')
             )
-        
-        cis.delete()
-        
-        return o
\ No newline at end of file
+            if not cis:
+                raise serializers.ValidationError('Корзина пуста')
+
+            ids = [ci.pk for ci in cis]
+            # From the prices the items are written with: a second read could see a newer price.
+            tp = sum(ci.quantity * ci.product.price for ci in cis)
+
+            o = Order.objects.create(
+                user=u,
+                total_price=tp,
+                email=validated_data.get('email', u.email)
+            )
+
+            items = OrderItem.objects.bulk_create([
+                OrderItem(order=o, product=ci.product, quantity=ci.quantity, price=ci.product.price)
+                for ci in cis
+            ])
+
+            # Another checkout consumed these rows first: roll back instead of ordering twice.
+            n, _ = CartItem.objects.filter(pk__in=ids).delete()
+            if n != len(ids):
+                raise serializers.ValidationError('Корзина изменилась, повторите оформление заказа')
+
+        o._prefetched_objects_cache = {'items': items}
+        return o
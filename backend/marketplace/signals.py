@@ -0,0 +1,131 @@
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import caching, feeds
+from .models import (
+    Category, Product, Style, Tag, product_tags_changed, products_bulk_changed, products_count_deferred,
+    shift_products_count,
+)
+from .search import get_backend
+
+
+@receiver(post_save, sender=Product)
+@receiver(product_tags_changed, sender=Product)
+def index_product(sender, instance, using, raw=False, **kwargs):
+    if raw:
+        return
+    backend = get_backend(using)
+    if backend:
+        backend.update([instance])
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.product_links.values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reindex_tagged_products(sender, instance, using, created=False, raw=False, **kwargs):
+    backend = get_backend(using)
+    if raw or created or not backend:
+        return
+    ids = getattr(instance, '_product_ids', None)
+    if ids is None:
+        ids = instance.product_links.values('product_id')
+    backend.update(Product.objects.using(using).filter(pk__in=ids).with_tags())
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    backend = get_backend(using)
+    if backend:
+        backend.delete([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, using, raw=False, **kwargs):
+    if raw or products_count_deferred():
+        return
+    loaded = getattr(instance, '_loaded', {})
+    for model, field in ((Category, 'category_id'), (Style, 'style_id')):
+        now = getattr(instance, field)
+        was = None if created else loaded.get(field, now)
+        if was != now:
+            shift_products_count(model, was, -1, using)
+            shift_products_count(model, now, 1, using)
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, using, **kwargs):
+    if products_count_deferred():
+        return
+    shift_products_count(Category, instance.category_id, -1, using)
+    shift_products_count(Style, instance.style_id, -1, using)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_saved_product_feeds(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded', {})
+    stale = []
+    if created or loaded.get('downloads') != instance.downloads or instance.pk in feeds.member_ids('popular'):
+        stale.append('popular')
+    if instance.is_featured or loaded.get('is_featured'):
+        stale.append('featured')
+    if stale:
+        feeds.invalidate(*stale, using=using)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product_feeds(sender, instance, using, **kwargs):
+    feeds.invalidate(using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Style)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(products_bulk_changed, sender=Product)
+@receiver(product_tags_changed, sender=Product)
+def invalidate_all_feeds(sender, using=None, **kwargs):
+    feeds.invalidate(using=using)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_saved_product_generations(sender, instance, created, using, **kwargs):
+    loaded = getattr(instance, '_loaded', {})
+    moved = any(loaded.get(f) != getattr(instance, f) for f in ('category_id', 'style_id'))
+    # products_count is part of the taxonomy payloads.
+    caching.invalidate(*(('products', 'taxonomies') if created or moved else ('products',)), using=using)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Style)
+@receiver(post_delete, sender=Style)
+@receiver(products_bulk_changed, sender=Product)
+def invalidate_catalog_generations(sender, using=None, **kwargs):
+    caching.invalidate(using=using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(product_tags_changed, sender=Product)
+def invalidate_tag_generations(sender, using=None, **kwargs):
+    caching.invalidate('products', using=using)
+
+
+@receiver(post_save, sender=Product)
+def remember_loaded_values(sender, instance, **kwargs):
+    instance._loaded = {f: getattr(instance, f) for f in Product.tracked_fields}
+
+
+@caching.fingerprint('products')
+def products_fingerprint():
+    # Raw writes skip the receivers above, but still move updated_at or the row count.
+    row = Product.objects.order_by().aggregate(last=Max('updated_at'), n=Count('id'))
+    return row['last'], row['n']
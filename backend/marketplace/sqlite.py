@@ -0,0 +1,73 @@
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+
+def profile():
+    return getattr(settings, 'SQLITE_PROFILE', {})
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    pragmas = profile().get('PRAGMAS')
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as c:
+        for name, value in pragmas.items():
+            c.execute(f'PRAGMA {name} = {value}')
+
+
+def is_lock_error(exc):
+    # SQLITE_BUSY ("database is locked") and, with a shared cache, SQLITE_LOCKED.
+    return isinstance(exc, OperationalError) and 'locked' in str(exc)
+
+
+@contextmanager
+def immediate(using=None):
+    # Django 4.2 opens SQLite transactions with a deferred BEGIN. A write after a read
+    # then fails at once if another writer committed in between, and busy_timeout
+    # does not help. BEGIN IMMEDIATE takes the write lock first, waiting for it.
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    if conn.vendor != 'sqlite' or conn.in_atomic_block:
+        yield
+        return
+    conn._start_transaction_under_autocommit = lambda: conn.cursor().execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    finally:
+        del conn._start_transaction_under_autocommit
+
+
+def retry_on_lock(func, using=None):
+    # Runs func in its own write transaction and reruns it after a lock error,
+    # with jittered exponential backoff.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = profile().get('LOCK_RETRIES', 0)
+        delay = profile().get('RETRY_BACKOFF', 0.01)
+        for attempt in range(retries + 1):
+            try:
+                with immediate(using), transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or not is_lock_error(e):
+                    raise
+            time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+class LockRetryMixin:
+    # Writes of the viewset are retried as a whole on lock errors. The handler is
+    # wrapped after initial(), so authentication and parsing happen only once.
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        method = request.method.lower()
+        if request.method not in SAFE_METHODS and profile().get('LOCK_RETRIES') and hasattr(self, method):
+            setattr(self, method, retry_on_lock(getattr(self, method)))
@@ -1,3 +1,1733 @@
-from django.test import TestCase
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import fastjson, throttling
+from .auth import ClaimsRefreshToken
+from .metrics import render
+from .models import CartItem, Category, Favorite, Order, OrderItem, Product, Style, Tag
+from .serializers import CategorySerializer, ProductListSerializer, StyleSerializer
+
+
+# The whole suite talks from 127.0.0.1 and would drain the shared buckets;
+# RateLimitTests set the limits they check. The database checks of the catalog (see caching.reconcile) would add a query to
+# whichever request happens to be due; ConditionalRequestTests turn them on.
+_no_rate_limits = override_settings(RATE_LIMITS={}, CATALOG_FINGERPRINT_INTERVAL=None)
+# Token revocations and catalog generations in memory instead of the shared file stores.
+_local_revocations = override_settings(CACHES={
+    **settings.CACHES,
+    'revocations': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'revocations'},
+    'generations': settings.GENERATION_STORES['local'],
+})
+
+
+def setUpModule():
+    _no_rate_limits.enable()
+    _local_revocations.enable()
+
+
+def tearDownModule():
+    _local_revocations.disable()
+    _no_rate_limits.disable()
+
+
+def make_product(n, category, style=None, **kwargs):
+    data = {
+        'name': f'Product {n}',
+        'slug': f'product-{n}',
+        'description': f'Описание {n}',
+        'category': category,
+        'style': style,
+        'price': 100 + n,
+        'image': 'https://example.com/p.png',
+        'author': 'Author',
+        'tags': ['Figma'],
+    }
+    data.update(kwargs)
+    tags = data.pop('tags')
+    p = Product.objects.create(**data)
+    p.set_tags(tags)
+    return p
+
+
+class ProductsCountTests(TestCase):
+    def setUp(self):
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.icons = Category.objects.create(name='Иконки', slug='icons')
+        self.flat = Style.objects.create(name='Flat', slug='flat')
+        self.modern = Style.objects.create(name='Modern', slug='modern')
+
+    def counts(self):
+        return (
+            dict(Category.objects.values_list('slug', 'products_count')),
+            dict(Style.objects.values_list('slug', 'products_count')),
+        )
+
+    def test_create_move_delete(self):
+        p = make_product(1, self.ui, self.flat)
+        make_product(2, self.ui)
+        self.assertEqual(self.counts(), ({'ui-kit': 2, 'icons': 0}, {'flat': 1, 'modern': 0}))
+
+        p = Product.objects.get(pk=p.pk)
+        p.category = self.icons
+        p.style = self.modern
+        p.save()
+        self.assertEqual(self.counts(), ({'ui-kit': 1, 'icons': 1}, {'flat': 0, 'modern': 1}))
+
+        p.delete()
+        self.assertEqual(self.counts(), ({'ui-kit': 1, 'icons': 0}, {'flat': 0, 'modern': 0}))
+
+    def test_bulk_operations(self):
+        Product.objects.bulk_create([
+            Product(name=f'P{i}', slug=f'p{i}', description='', category=self.ui, style=self.flat,
+                    price=1, image='https://example.com/p.png', author='A')
+            for i in range(5)
+        ])
+        self.assertEqual(self.counts(), ({'ui-kit': 5, 'icons': 0}, {'flat': 5, 'modern': 0}))
+
+        Product.objects.filter(slug__in=['p0', 'p1']).update(category=self.icons, style=None)
+        self.assertEqual(self.counts(), ({'ui-kit': 3, 'icons': 2}, {'flat': 3, 'modern': 0}))
+
+        Product.objects.filter(category=self.ui).delete()
+        self.assertEqual(self.counts(), ({'ui-kit': 0, 'icons': 2}, {'flat': 0, 'modern': 0}))
+
+    def test_admin_list_editable(self):
+        p = make_product(1, self.ui, self.flat)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        r = self.client.post('/admin/marketplace/product/', {
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '1',
+            'form-0-id': str(p.pk),
+            'form-0-price': '999.00',
+            'form-0-is_featured': 'on',
+            '_save': 'Save',
+        })
+        self.assertEqual(r.status_code, 302)
+        p.refresh_from_db()
+        self.assertTrue(p.is_featured)
+        self.assertEqual(self.counts(), ({'ui-kit': 1, 'icons': 0}, {'flat': 1, 'modern': 0}))
+
+    def test_recount_command_fixes_drift(self):
+        make_product(1, self.ui, self.flat)
+        Category.objects.update(products_count=7)
+        call_command('recount_products', stdout=StringIO())
+        self.assertEqual(self.counts(), ({'ui-kit': 1, 'icons': 0}, {'flat': 1, 'modern': 0}))
+
+    def test_list_query_count_is_constant(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        for i in range(10):
+            c = Category.objects.create(name=f'C{i}', slug=f'c{i}')
+            s = Style.objects.create(name=f'S{i}', slug=f's{i}')
+            make_product(i, c, s)
+
+        for url in ('/api/categories/', '/api/styles/'):
+            with self.assertNumQueries(1):
+                r = api.get(url)
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(all(row['products_count'] >= 0 for row in r.json()))
+
+        p = Product.objects.first()
+        with self.assertNumQueries(2):
+            r = api.get(f'/api/products/{p.pk}/')
+        self.assertEqual(r.json()['category']['products_count'], 1)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        for i in range(23):
+            make_product(i, self.ui, price=100 + i % 4, downloads=i % 3, is_featured=i % 2 == 0)
+
+    def walk(self, url, params):
+        seen = []
+        r = self.api.get(url, params)
+        while True:
+            body = r.json()
+            seen.extend(p['id'] for p in body['results'])
+            if not body['next']:
+                return seen, body
+            r = self.api.get(body['next'])
+
+    def test_every_ordering_walks_without_gaps(self):
+        for ordering in ('price', '-price', 'rating', '-downloads', 'created_at', '-created_at'):
+            seen, _ = self.walk('/api/products/', {'ordering': ordering, 'page_size': 5})
+            expected = list(
+                Product.objects.order_by(ordering, ('-' if ordering[0] == '-' else '') + 'pk').values_list('pk', flat=True)
+            )
+            self.assertEqual(seen, expected, ordering)
+
+    def test_previous_returns_same_page(self):
+        first = self.api.get('/api/products/', {'ordering': 'price', 'page_size': 5}).json()
+        second = self.api.get(first['next']).json()
+        back = self.api.get(second['previous']).json()
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+        self.assertIsNone(first['previous'])
+
+    def test_featured_and_count_estimate(self):
+        seen, _ = self.walk('/api/products/featured/', {'page_size': 4})
+        self.assertEqual(len(seen), 12)
+        body = self.api.get('/api/products/', {'page_size': 5, 'with_count': 1, 'category__slug': 'ui-kit'}).json()
+        self.assertEqual(body['count'], 23)
+
+    def test_count_estimate_is_the_same_on_every_page(self):
+        from .pagination import KeysetPagination
+        exact = mock.patch.object(
+            KeysetPagination, 'get_count_estimate', autospec=True, side_effect=lambda self, qs, request, view: qs.count()
+        )
+        with exact:
+            first = self.api.get('/api/products/', {'page_size': 5, 'with_count': 1, 'min_price': 101}).json()
+            second = self.api.get(first['next']).json()
+        self.assertEqual((first['count'], second['count']), (17, 17))
+
+    def test_plain_list_and_bad_cursor(self):
+        self.assertIsInstance(self.api.get('/api/products/').json(), list)
+        self.assertEqual(self.api.get('/api/products/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_crafted_cursors_are_rejected(self):
+        import base64
+        for cursor in (
+            {'o': 'price', 'v': 101, 'id': 5},
+            {'o': 'price', 'v': None, 'id': 5, 'r': 0},
+            {'o': 'price', 'v': 101, 'id': 5, 'r': 'x'},
+            ['price', 101, 5, 0],
+        ):
+            with self.subTest(cursor):
+                token = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+                r = self.api.get('/api/products/', {'cursor': token, 'ordering': 'price'})
+                self.assertEqual(r.status_code, 404)
+
+
+class ProductFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.products = [make_product(i, self.ui, downloads=i * 10, is_featured=i < 3) for i in range(15)]
+
+    def test_cached_bytes_served_without_queries(self):
+        for name in ('popular', 'featured'):
+            first = self.api.get(f'/api/products/{name}/')
+            with self.assertNumQueries(0):
+                second = self.api.get(f'/api/products/{name}/')
+            self.assertEqual(first.content, second.content)
+        self.assertEqual(len(self.api.get('/api/products/popular/').json()), 12)
+        self.assertEqual(len(self.api.get('/api/products/featured/').json()), 3)
+
+    def test_relevant_changes_invalidate(self):
+        self.api.get('/api/products/popular/')
+        self.api.get('/api/products/featured/')
+
+        p = Product.objects.get(pk=self.products[0].pk)
+        p.downloads = 10_000
+        with self.captureOnCommitCallbacks(execute=True):
+            p.save()
+        self.assertEqual(self.api.get('/api/products/popular/').json()[0]['id'], p.pk)
+
+        p.is_featured = False
+        with self.captureOnCommitCallbacks(execute=True):
+            p.save()
+        self.assertEqual(len(self.api.get('/api/products/featured/').json()), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[5].pk).update(is_featured=True)
+        self.assertEqual(len(self.api.get('/api/products/featured/').json()), 3)
+
+    def test_filtered_requests_bypass_cache(self):
+        r = self.api.get('/api/products/featured/', {'page_size': 2})
+        self.assertEqual(len(r.json()['results']), 2)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.products = [make_product(i, ui, price=f'{i}.35') for i in range(1, 21)]
+
+    def fill_cart(self, n):
+        CartItem.objects.bulk_create([CartItem(user=self.user, product=p, quantity=2) for p in self.products[:n]])
+
+    def test_query_count_does_not_grow_with_cart(self):
+        counts = []
+        for n in (2, 20):
+            self.fill_cart(n)
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.api.post('/api/orders/', {}, format='json')
+            self.assertEqual(r.status_code, 201)
+            self.assertEqual(len(r.json()['items']), n)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_total_is_exact(self):
+        self.fill_cart(3)
+        r = self.api.post('/api/orders/', {}, format='json')
+        self.assertEqual(Decimal(r.json()['total_price']), Decimal('14.10'))
+        self.assertEqual(sum(Decimal(i['price']) * i['quantity'] for i in r.json()['items']), Decimal('14.10'))
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_empty_cart(self):
+        r = self.api.post('/api/orders/', {}, format='json')
+        self.assertEqual(r.status_code, 400)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_parallel_checkouts_order_cart_once(self):
+        user = User.objects.create_user('u', 'u@example.com', 'pass')
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        products = [make_product(i, ui) for i in range(10)]
+        CartItem.objects.bulk_create([CartItem(user=user, product=p, quantity=3) for p in products])
+        start = threading.Barrier(8)
+        statuses = []
+
+        def checkout():
+            api = APIClient()
+            api.force_authenticate(user)
+            start.wait()
+            try:
+                # Shared-cache SQLite raises on lock contention instead of waiting; retry like a client.
+                for _ in range(200):
+                    try:
+                        statuses.append(api.post('/api/orders/', {}, format='json').status_code)
+                        return
+                    except OperationalError:
+                        time.sleep(0.005)
+                statuses.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLessEqual(statuses.count(201), 1, statuses)
+        self.assertNotIn('locked', statuses)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 10)
+        self.assertEqual(sum(OrderItem.objects.values_list('quantity', flat=True)), 30)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartTotalTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        for i, price in enumerate(['0.10', '0.20', '1999.99']):
+            CartItem.objects.create(user=self.user, product=make_product(i, ui, price=price), quantity=3)
+
+    def test_total_is_one_exact_query(self):
+        with self.assertNumQueries(1):
+            r = self.api.get('/api/cart/total/')
+        self.assertEqual(r.json(), {'total': 6000.87, 'items_count': 3})
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 3)
+
+    def test_empty_cart_total(self):
+        CartItem.objects.all().delete()
+        self.assertEqual(self.api.get('/api/cart/total/').json(), {'total': 0.0, 'items_count': 0})
+
+    def test_list_uses_annotated_line_totals(self):
+        with self.assertNumQueries(2):
+            r = self.api.get('/api/cart/')
+        self.assertEqual(sorted(i['total_price'] for i in r.json()), [0.3, 0.6, 5999.97])
+
+
+class CartUpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.product = make_product(1, Category.objects.create(name='UI Kit', slug='ui-kit'))
+
+    def test_repeated_adds_accumulate(self):
+        for qty in (1, 2, 4):
+            r = self.api.post('/api/cart/', {'product_id': self.product.pk, 'quantity': qty}, format='json')
+            self.assertEqual(r.status_code, 201)
+        self.assertEqual(r.json()['quantity'], 7)
+        self.assertEqual(CartItem.objects.get().quantity, 7)
+
+    def test_unknown_product(self):
+        r = self.api.post('/api/cart/', {'product_id': 999, 'quantity': 1}, format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class ConcurrentCartUpsertTests(TransactionTestCase):
+    def test_parallel_increments_are_not_lost(self):
+        user = User.objects.create_user('u', 'u@example.com', 'pass')
+        product = make_product(1, Category.objects.create(name='UI Kit', slug='ui-kit'))
+        threads, per_thread = 8, 25
+        start = threading.Barrier(threads)
+        errors = []
+
+        def add():
+            start.wait()
+            try:
+                for _ in range(per_thread):
+                    # Shared-cache SQLite raises on lock contention instead of waiting.
+                    while True:
+                        try:
+                            CartItem.objects.add_quantity(user, product.pk, 1)
+                            break
+                        except OperationalError:
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add) for _ in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(user=user, product=product).quantity, threads * per_thread)
+
+
+class BulkEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.products = [make_product(i, ui) for i in range(30)]
+
+    def test_cart_bulk_add_and_set(self):
+        p = self.products
+        CartItem.objects.create(user=self.user, product=p[0], quantity=2)
+        payload = [{'product_id': x.pk, 'quantity': 1} for x in p] + [{'product_id': 999, 'quantity': 1}]
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.api.post('/api/cart/bulk/', payload, format='json')
+        self.assertEqual(r.status_code, 200)
+        self.assertLessEqual(len(ctx), 6)
+        res = r.json()['results']
+        self.assertEqual(res[0]['quantity'], 3)
+        self.assertEqual(res[-1], {'product_id': 999, 'status': 'error', 'error': 'Продукт не найден'})
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 30)
+
+        r = self.api.post('/api/cart/bulk/?mode=set', [{'product_id': p[0].pk, 'quantity': 5}], format='json')
+        self.assertEqual(r.json()['results'][0]['quantity'], 5)
+
+    def test_favorites_bulk_is_idempotent(self):
+        payload = [{'product_id': x.pk} for x in self.products[:5]]
+        for _ in range(2):
+            r = self.api.post('/api/favorites/bulk/', payload, format='json')
+            self.assertEqual(r.status_code, 200)
+        self.assertTrue(all(i['status'] == 'ok' for i in r.json()['results']))
+        self.assertEqual(self.user.favorites.count(), 5)
+
+    def test_product_deleted_before_its_row_is_read(self):
+        from .views import bulk_results
+        # The cascade took the row of a product deleted after the write.
+        r = bulk_results({1: 1, 2: 1}, {1: {'id': 10, 'quantity': 1}})
+        self.assertEqual(r.data['results'], [
+            {'product_id': 1, 'status': 'ok', 'id': 10, 'quantity': 1},
+            {'product_id': 2, 'status': 'error', 'error': 'Продукт не найден'},
+        ])
+
+    def test_invalid_payload(self):
+        r = self.api.post('/api/cart/bulk/', [{'product_id': self.products[0].pk, 'quantity': 0}], format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.api.post('/api/cart/bulk/', [], format='json').status_code, 400)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        for i in range(3):
+            make_product(i, ui)
+
+    def sample(self, name, view):
+        for line in render().splitlines():
+            if line.startswith(f'{name}{{view="{view}"}} '):
+                return float(line.split()[-1])
+        return 0.0
+
+    def test_views_are_recorded(self):
+        before = self.sample('marketplace_request_seconds_count', 'ProductViewSet.list')
+        queries_before = self.sample('marketplace_request_queries_sum', 'ProductViewSet.list')
+        self.api.get('/api/products/')
+        self.api.get('/api/categories/')
+        self.assertEqual(self.sample('marketplace_request_seconds_count', 'ProductViewSet.list'), before + 1)
+        self.assertEqual(self.sample('marketplace_request_queries_sum', 'ProductViewSet.list'), queries_before + 2)
+        self.assertGreater(self.sample('marketplace_request_serialization_seconds_count', 'CategoryViewSet.list'), 0)
+
+    def test_metrics_endpoint(self):
+        r = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn(b'# TYPE marketplace_request_seconds histogram', r.content)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.settings(REQUEST_METRICS_SLOW_MS=0), self.assertLogs('marketplace.slow_requests') as logs:
+            self.api.get('/api/products/')
+        self.assertIn('ProductViewSet.list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+# (route name, method, path, body, max queries when authenticated, max response bytes, grows with data)
+# The token carries the user claims, so authentication itself costs no query.
+# Anonymous requests are checked separately: they must be rejected or served within ANON_QUERY_BUDGET.
+ROUTE_BUDGETS = [
+    ('api-root', 'get', '/api/', None, 0, 2_000, False),
+    ('category-list', 'get', '/api/categories/', None, 1, 20_000, True),
+    ('category-detail', 'get', '/api/categories/{category}/', None, 1, 2_000, False),
+    ('style-list', 'get', '/api/styles/', None, 1, 20_000, True),
+    ('style-detail', 'get', '/api/styles/{style}/', None, 1, 2_000, False),
+    ('product-list', 'get', '/api/products/', None, 2, 200_000, True),
+    ('product-list', 'get', '/api/products/?search=product&ordering=-price', None, 3, 200_000, True),
+    ('product-list', 'get', '/api/products/?page_size=5&with_count=1&category__slug={category}', None, 3, 20_000, False),
+    ('product-featured', 'get', '/api/products/featured/', None, 2, 200_000, True),
+    ('product-popular', 'get', '/api/products/popular/', None, 2, 50_000, False),
+    ('product-detail', 'get', '/api/products/{product}/', None, 2, 5_000, False),
+    ('product-export', 'get', '/api/products/export/', None, 2, 200_000, True),
+    ('product-export', 'get', '/api/products/export/?format=csv&category__slug={category}', None, 2, 200_000, True),
+    ('favorite-list', 'get', '/api/favorites/', None, 2, 200_000, True),
+    ('favorite-list', 'post', '/api/favorites/', {'product_id': '{spare}'}, 6, 5_000, False),
+    ('favorite-bulk', 'post', '/api/favorites/bulk/', [{'product_id': '{spare}'}], 5, 5_000, False),
+    ('favorite-detail', 'get', '/api/favorites/{favorite}/', None, 2, 5_000, False),
+    ('favorite-detail', 'delete', '/api/favorites/{favorite}/', None, 2, 0, False),
+    ('cart-list', 'get', '/api/cart/', None, 2, 200_000, True),
+    ('cart-list', 'post', '/api/cart/', {'product_id': '{spare}', 'quantity': 1}, 3, 5_000, False),
+    ('cart-bulk', 'post', '/api/cart/bulk/', [{'product_id': '{spare}', 'quantity': 1}], 5, 5_000, False),
+    ('cart-total', 'get', '/api/cart/total/', None, 1, 200, False),
+    ('cart-detail', 'get', '/api/cart/{cart_item}/', None, 2, 5_000, False),
+    ('cart-detail', 'patch', '/api/cart/{cart_item}/', {'quantity': 3}, 3, 5_000, False),
+    ('order-list', 'get', '/api/orders/', None, 3, 500_000, True),
+    ('order-detail', 'get', '/api/orders/{order}/', None, 3, 50_000, False),
+    ('cart-detail', 'delete', '/api/cart/{spare_cart_item}/', None, 2, 0, False),
+    ('order-list', 'post', '/api/orders/', {}, 8, 50_000, False),
+    ('cart-clear', 'delete', '/api/cart/clear/', None, 1, 200, False),
+]
+ANON_QUERY_BUDGET = 0
+AUTH_ROUTES = [
+    ('register', 'post', '/api/register/',
+     {'username': 'newbie', 'email': 'newbie@example.com', 'password': 'Sup3r-secret!', 'password2': 'Sup3r-secret!'},
+     3, 1_000),
+    ('token_obtain_pair', 'post', '/api/login/', {'username': 'budget', 'password': 'budget-pass-1'}, 1, 1_000),
+    ('token_obtain_pair', 'post', '/token/', {'username': 'budget', 'password': 'budget-pass-1'}, 1, 1_000),
+    ('token_refresh', 'post', '/token/refresh/', {'refresh': '{refresh}'}, 1, 1_000),
+    ('token_verify', 'post', '/token/verify/', {'token': '{access}'}, 0, 100),
+]
+
+
+class QueryBudgetTests(TestCase):
+    report = {}
+    report_path = os.environ.get(
+        'QUERY_BUDGET_REPORT', str(Path(__file__).resolve().parent.parent / 'query_budgets.json')
+    )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.report:
+            with open(cls.report_path, 'w', encoding='utf-8') as f:
+                json.dump(cls.report, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('budget', 'budget@example.com', 'budget-pass-1')
+        self.refresh = ClaimsRefreshToken.for_user(self.user)
+        self.auth = APIClient()
+        self.auth.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        self.anon = APIClient()
+        self.n = 0
+        self.categories = [Category.objects.create(name=f'C{i}', slug=f'c{i}') for i in range(3)]
+        self.styles = [Style.objects.create(name=f'S{i}', slug=f's{i}') for i in range(3)]
+        self.grow(2)
+        self.spare = make_product(10_000, self.categories[0], self.styles[0])
+
+    def grow(self, n):
+        for _ in range(n):
+            i = self.n = self.n + 1
+            p = make_product(i, self.categories[i % 3], self.styles[i % 3], is_featured=i % 2 == 0)
+            Favorite.objects.create(user=self.user, product=p)
+            CartItem.objects.create(user=self.user, product=p, quantity=1)
+            o = Order.objects.create(user=self.user, total_price=p.price, email=self.user.email)
+            OrderItem.objects.create(order=o, product=p, quantity=1, price=p.price)
+        cache.clear()
+
+    def ids(self):
+        return {
+            'category': self.categories[0].slug,
+            'style': self.styles[0].slug,
+            'product': Product.objects.exclude(pk=self.spare.pk).values_list('pk', flat=True).first(),
+            'spare': self.spare.pk,
+            'favorite': Favorite.objects.filter(user=self.user).values_list('pk', flat=True).first(),
+            'cart_item': CartItem.objects.filter(user=self.user).values_list('pk', flat=True).first(),
+            'spare_cart_item': CartItem.objects.filter(user=self.user).values_list('pk', flat=True).last(),
+            'order': Order.objects.filter(user=self.user).values_list('pk', flat=True).first(),
+            'refresh': str(self.refresh),
+            'access': str(self.refresh.access_token),
+        }
+
+    def fill(self, value, ids):
+        if isinstance(value, str):
+            value = value.format(**ids)
+            return int(value) if value.isdigit() else value
+        if isinstance(value, list):
+            return [self.fill(v, ids) for v in value]
+        if isinstance(value, dict):
+            return {k: self.fill(v, ids) for k, v in value.items()}
+        return value
+
+    def call(self, client, method, path, body):
+        ids = self.ids()
+        kwargs = {} if body is None else {'data': self.fill(body, ids), 'format': 'json'}
+        with CaptureQueriesContext(connection) as ctx:
+            t = time.perf_counter()
+            r = getattr(client, method)(path.format(**ids), **kwargs)
+            if r.streaming:
+                # The queries of a streamed body run while it is read.
+                r = HttpResponse(b''.join(r.streaming_content), status=r.status_code)
+            elapsed = (time.perf_counter() - t) * 1000
+        return r, len(ctx), elapsed, ctx
+
+    def check(self, key, r, n, elapsed, ctx, max_queries, max_bytes):
+        self.assertLess(r.status_code, 400, f'{key}: {r.status_code} {r.content[:200]}')
+        self.assertLessEqual(
+            n, max_queries, f'{key}: {n} queries\n' + '\n'.join(q['sql'] for q in ctx.captured_queries)
+        )
+        self.assertLessEqual(len(r.content), max_bytes, f'{key}: {len(r.content)} bytes')
+        self.report[key] = {'queries': n, 'bytes': len(r.content), 'ms': round(elapsed, 2)}
+
+    def test_every_router_route_has_a_budget(self):
+        from .urls import router
+        names = {u.name for u in router.urls}
+        self.assertEqual(names - {b[0] for b in ROUTE_BUDGETS}, set())
+
+    def test_authenticated_budgets(self):
+        for name, method, path, body, max_queries, max_bytes, _ in ROUTE_BUDGETS:
+            key = f'{method.upper()} {path}'
+            with self.subTest(key):
+                r, n, elapsed, ctx = self.call(self.auth, method, path, body)
+                self.check(key, r, n, elapsed, ctx, max_queries, max_bytes)
+
+    def test_anonymous_requests_are_cheap(self):
+        for name, method, path, body, *_ in ROUTE_BUDGETS:
+            key = f'anonymous {method.upper()} {path}'
+            with self.subTest(key):
+                r, n, elapsed, ctx = self.call(self.anon, method, path, body)
+                self.assertIn(r.status_code, (200, 401), key)
+                self.assertLessEqual(n, ANON_QUERY_BUDGET if r.status_code == 401 else 2, key)
+
+    def test_auth_endpoints(self):
+        for name, method, path, body, max_queries, max_bytes in AUTH_ROUTES:
+            key = f'{method.upper()} {path}'
+            with self.subTest(key):
+                r, n, elapsed, ctx = self.call(self.anon, method, path, body)
+                self.check(key, r, n, elapsed, ctx, max_queries, max_bytes)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        scaling = [b for b in ROUTE_BUDGETS if b[6]]
+        small = {}
+        for name, method, path, body, *_ in scaling:
+            small[path] = self.call(self.auth, method, path, body)[1]
+        self.grow(8)
+        for name, method, path, body, *_ in scaling:
+            with self.subTest(path):
+                r, n, elapsed, ctx = self.call(self.auth, method, path, body)
+                self.assertEqual(n, small[path], f'{path}: {small[path]} -> {n} queries after adding rows')
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    def test_replays_journey_against_in_process_server(self):
+        from .management.commands.loadtest import PASSWORD
+        c = Category.objects.create(name='UI Kit', slug='ui-kit')
+        for i in range(5):
+            make_product(i, c, name=f'Modern Kit {i}')
+        for n in ('probe', 0, 1):
+            User.objects.create_user(f'load-user-{n}', password=PASSWORD)
+        path = Path(self.id().replace('.', '_') + '.json')
+        self.addCleanup(path.unlink, missing_ok=True)
+
+        out = StringIO()
+        call_command(
+            'loadtest', '--serve', '--users', '2', '--iterations', '5',
+            '--mix', 'browse=2,search=1,detail=2', '--json', str(path), stdout=out,
+        )
+
+        report = json.loads(path.read_text(encoding='utf-8'))
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['endpoints']['login']['requests'], 2)
+        steps = sum(report['endpoints'][k]['requests'] for k in ('products', 'products?search', 'product'))
+        self.assertEqual(steps, 10)
+        self.assertIn('p99', out.getvalue())
+
+
+class FastJSONTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        ui = Category.objects.create(name='Иконки', slug='icons', description='line\u2028sep "q" \\ </script> 😀')
+        flat = Style.objects.create(name='Flat', slug='flat')
+        make_product(1, ui, flat, name='Набор «UI»\u2029 \x01\t\x7f', price=Decimal('0.5'), rating=Decimal('4.25'),
+                     downloads=5, is_featured=True, tags=['Figma', 'ёжик', 'C#'])
+        make_product(2, ui, None, price=Decimal('1999.99'), downloads=7, tags=[])
+        p = make_product(3, ui, flat, is_featured=True)
+        Product.objects.filter(pk=p.pk).update(created_at=p.created_at.replace(microsecond=0))
+
+    def drf_bytes(self, path, serializer, queryset, paginated=False):
+        r = self.api.get(path, HTTP_ACCEPT='text/html')
+        view = r.renderer_context['view']
+        data = serializer(queryset, many=True).data
+        if paginated:
+            data = view.paginator.get_paginated_data(data)
+        return JSONRenderer().render(data)
+
+    def assert_same_bytes(self, path, serializer, queryset, paginated=False):
+        expected = self.drf_bytes(path, serializer, queryset, paginated)
+        for encoder in {fastjson.orjson, None}:
+            with self.subTest(path=path, orjson=encoder is not None), mock.patch.object(fastjson, 'orjson', encoder):
+                cache.clear()
+                r = self.api.get(path)
+                self.assertEqual(r['Content-Type'], 'application/json')
+                self.assertEqual(r.content, expected)
+
+    def test_product_lists_match_serializer_output(self):
+        qs = Product.objects.select_related('category', 'style').with_tags()
+        self.assert_same_bytes('/api/products/', ProductListSerializer, qs.order_by('-created_at'))
+        self.assert_same_bytes(
+            '/api/products/?ordering=price&page_size=2', ProductListSerializer, qs.order_by('price', 'pk')[:2], True
+        )
+        self.assert_same_bytes(
+            '/api/products/featured/', ProductListSerializer, qs.filter(is_featured=True).order_by('-created_at', '-id')
+        )
+        self.assert_same_bytes('/api/products/popular/', ProductListSerializer, qs.order_by('-downloads', '-id'))
+        self.assert_same_bytes(
+            '/api/products/popular/?style__slug=flat', ProductListSerializer, qs.order_by('-downloads', '-id')
+        )
+
+    def test_taxonomy_lists_match_serializer_output(self):
+        self.assert_same_bytes('/api/categories/', CategorySerializer, Category.objects.all())
+        self.assert_same_bytes('/api/styles/', StyleSerializer, Style.objects.all())
+
+    def test_browsable_api_keeps_serializer_path(self):
+        r = self.api.get('/api/products/', HTTP_ACCEPT='text/html')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.data), 3)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.p = make_product(1, self.ui)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        # A second later, when Last-Modified of the current generations is final.
+        later = mock.patch('marketplace.conditional.time.time', return_value=time.time() + 1)
+        later.start()
+        self.addCleanup(later.stop)
+        for path in ('/api/products/', f'/api/products/{self.p.pk}/', '/api/products/popular/',
+                     '/api/products/featured/', '/api/categories/', '/api/categories/ui-kit/'):
+            with self.subTest(path):
+                r = self.api.get(path)
+                self.assertEqual(r.status_code, 200)
+                self.assertTrue(r['ETag'])
+                self.assertTrue(r['Last-Modified'])
+                with self.assertNumQueries(0):
+                    again = self.api.get(path, HTTP_IF_NONE_MATCH=r['ETag'])
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b'')
+                self.assertEqual(again['ETag'], r['ETag'])
+                since = self.api.get(path, HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+                self.assertEqual(since.status_code, 304)
+
+    @override_settings(CATALOG_FINGERPRINT_INTERVAL=0)
+    def test_write_bypassing_the_signals_changes_the_etag(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        for path in ('/api/products/', f'/api/products/{self.p.pk}/'):
+            with self.subTest(path):
+                r = self.api.get(path)
+                with self.assertNumQueries(1):
+                    self.assertEqual(self.api.get(path, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+                with connection.cursor() as c:
+                    c.execute('UPDATE marketplace_product SET price = price + 1, updated_at = %s',
+                              [timezone.now() + timedelta(seconds=1)])
+                again = self.api.get(path, HTTP_IF_NONE_MATCH=r['ETag'])
+                self.assertEqual(again.status_code, 200)
+                self.assertNotEqual(again['ETag'], r['ETag'])
+                self.assertNotEqual(again.content, r.content)
+                self.assertEqual(self.api.get(path, HTTP_IF_NONE_MATCH=again['ETag']).status_code, 304)
+
+    def test_etag_depends_on_query_and_format(self):
+        a = self.api.get('/api/products/')['ETag']
+        self.assertNotEqual(a, self.api.get('/api/products/?ordering=price')['ETag'])
+        self.assertNotEqual(a, self.api.get('/api/products/', HTTP_ACCEPT='text/html')['ETag'])
+
+    def test_changes_move_the_etag(self):
+        products = self.api.get('/api/products/')['ETag']
+        categories = self.api.get('/api/categories/')['ETag']
+
+        p = Product.objects.get(pk=self.p.pk)
+        p.downloads = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            p.save()
+        r = self.api.get('/api/products/', HTTP_IF_NONE_MATCH=products)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()[0]['downloads'], 5)
+        self.assertEqual(self.api.get('/api/categories/', HTTP_IF_NONE_MATCH=categories).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product(2, self.ui)
+        r = self.api.get('/api/categories/', HTTP_IF_NONE_MATCH=categories)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()[0]['products_count'], 2)
+
+        products = self.api.get('/api/products/')['ETag']
+        self.ui.name = 'UI Kits'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ui.save()
+        self.assertEqual(self.api.get('/api/products/', HTTP_IF_NONE_MATCH=products).status_code, 200)
+
+        products = self.api.get('/api/products/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.p.pk).update(is_featured=True)
+        self.assertEqual(self.api.get('/api/products/', HTTP_IF_NONE_MATCH=products).status_code, 200)
+
+    def test_generations_move_after_commit(self):
+        products = self.api.get('/api/products/')['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.filter(pk=self.p.pk).update(downloads=7)
+            # A read before the commit keeps the old generation, so its entry is dropped later.
+            self.assertEqual(self.api.get('/api/products/', HTTP_IF_NONE_MATCH=products).status_code, 304)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        r = self.api.get('/api/products/', HTTP_IF_NONE_MATCH=products)
+        self.assertEqual((r.status_code, r.json()[0]['downloads']), (200, 7))
+
+    def test_no_last_modified_within_the_second_of_a_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.p.pk).update(downloads=7)
+        from .caching import generation
+        # Still the second of the change, however long the requests take.
+        now = generation('products') / 1e9
+        with mock.patch('marketplace.conditional.time.time', return_value=now):
+            r = self.api.get('/api/products/')
+            self.assertFalse(r.has_header('Last-Modified'))
+            # A date of this second, as an earlier response in it would have had, must not match.
+            since = self.api.get('/api/products/', HTTP_IF_MODIFIED_SINCE=http_date(now))
+        self.assertEqual(since.status_code, 200)
+        with mock.patch('marketplace.conditional.time.time', return_value=now + 1):
+            self.assertTrue(self.api.get('/api/products/').has_header('Last-Modified'))
+
+    def test_cache_control_per_viewset(self):
+        self.assertEqual(self.api.get('/api/products/')['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.api.get('/api/categories/')['Cache-Control'], 'private, max-age=60')
+        with self.settings(CACHE_CONTROL_POLICIES={'ProductViewSet': {'public': True, 'max_age': 30}}):
+            self.assertEqual(self.api.get('/api/products/')['Cache-Control'], 'public, max-age=30')
+        self.assertFalse(self.api.get('/api/products/999/').has_header('ETag'))
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.p = make_product(1, self.ui, name='Modern Kit')
+
+    def test_normalized_params_share_an_entry(self):
+        first = self.api.get('/api/products/?search=Modern&ordering=price&category__slug=ui-kit')
+        self.assertEqual(len(first.json()), 1)
+        with self.assertNumQueries(0):
+            again = self.api.get('/api/products/?category__slug=ui-kit&ordering=price&search=%20modern&style=')
+        self.assertEqual(again.content, first.content)
+        # A blank page_size still turns pagination on.
+        paged = self.api.get('/api/products/?search=Modern&ordering=price&category__slug=ui-kit&page_size=')
+        self.assertEqual(len(paged.json()['results']), 1)
+        self.assertIsInstance(self.api.get('/api/products/?cursor=').json(), dict)
+        self.assertIsInstance(self.api.get('/api/products/').json(), list)
+        self.api.get(f'/api/products/{self.p.pk}/')
+        with self.assertNumQueries(0):
+            self.api.get(f'/api/products/{self.p.pk}/')
+
+    def test_model_signals_start_a_new_generation(self):
+        self.api.get('/api/products/')
+        self.api.get('/api/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product(2, self.ui)
+        self.assertEqual(len(self.api.get('/api/products/').json()), 2)
+        self.assertEqual(self.api.get('/api/categories/').json()[0]['products_count'], 2)
+
+        self.ui.name = 'UI'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ui.save()
+        self.assertEqual(self.api.get('/api/products/').json()[0]['category_name'], 'UI')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.p.pk).delete()
+        self.assertEqual(len(self.api.get('/api/products/').json()), 1)
+
+    def test_errors_and_browsable_api_are_not_cached(self):
+        self.assertEqual(self.api.get('/api/products/999/').status_code, 404)
+        with self.assertNumQueries(1):
+            self.api.get('/api/products/999/')
+        self.api.get('/api/products/', HTTP_ACCEPT='text/html')
+        with self.assertNumQueries(2):
+            self.api.get(f'/api/products/{self.p.pk}/', HTTP_ACCEPT='text/html')
+
+    def test_file_backend(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as d:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': d}
+            with self.settings(CACHES={**settings.CACHES, 'default': backend}):
+                first = self.api.get('/api/products/')
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.api.get('/api/products/').content, first.content)
+                with self.captureOnCommitCallbacks(execute=True):
+                    make_product(2, self.ui)
+                self.assertEqual(len(self.api.get('/api/products/').json()), 2)
+
+    def test_write_in_another_process_moves_the_generation(self):
+        import subprocess
+        import sys
+        import tempfile
+        from .caching import generation
+        with tempfile.TemporaryDirectory() as d:
+            store = {**settings.GENERATION_STORES['file'], 'LOCATION': d}
+            with self.settings(CACHES={**settings.CACHES, 'generations': store}):
+                first = self.api.get('/api/products/')
+                before = generation('products')
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'shell', '-c',
+                     "from marketplace import caching; caching.invalidate('products')"],
+                    cwd=settings.BASE_DIR, check=True, capture_output=True,
+                    env={**os.environ, 'MARKETPLACE_GENERATIONS': 'file', 'MARKETPLACE_GENERATIONS_DIR': d},
+                )
+                self.assertGreater(generation('products'), before)
+                # The in-process read cache entry is keyed by the old generation.
+                again = self.api.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(again.status_code, 200)
+                self.assertNotEqual(again['ETag'], first['ETag'])
+
+    def test_in_process_generation_store_is_reported(self):
+        from .caching import check_generations_store
+        self.assertEqual([e.id for e in check_generations_store(None)], ['marketplace.W002'])
+        with self.settings(CACHES={**settings.CACHES, 'generations': settings.GENERATION_STORES['file']}):
+            self.assertEqual(check_generations_store(None), [])
+
+    def test_lru_backend_is_bounded_by_bytes(self):
+        from .caching import LRUCache
+        lru = LRUCache('test-lru', {'OPTIONS': {'MAX_ENTRIES': 100, 'MAX_BYTES': 3000}})
+        lru.clear()
+        for i in range(5):
+            lru.set(f'k{i}', b'x' * 900)
+            lru.get('k0')
+        self.assertIsNotNone(lru.get('k0'))
+        self.assertEqual([lru.get(f'k{i}') is not None for i in range(1, 5)], [False, False, True, True])
+        self.assertLessEqual(lru._size[0], 3000)
+        lru.set('big', b'x' * 5000)
+        self.assertIsNone(lru.get('big'))
+        lru.set('n', 1)
+        self.assertEqual(lru.incr('n', 2), 3)
+        self.assertEqual(lru.get('n'), 3)
+        lru.clear()
+        self.assertEqual(lru._size[0], 0)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        from .caching import single_flight
+        calls = []
+        start = threading.Barrier(20)
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value', True
+
+        def worker():
+            start.wait()
+            results.append(single_flight('sf:key', compute, 60)[0])
+
+        workers = [threading.Thread(target=worker) for _ in range(20)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 20)
+
+    def test_waits_for_lock_held_elsewhere(self):
+        from .caching import single_flight
+        cache.add('sf:other:lock', 1, 10)
+        threading.Timer(0.05, cache.set, ('sf:other', 'from other process', 60)).start()
+        value, hit = single_flight('sf:other', lambda: self.fail('recomputed'), 60)
+        self.assertEqual((value, hit), ('from other process', True))
+
+    def test_uncacheable_results_are_not_stored(self):
+        from .caching import single_flight
+        self.assertEqual(single_flight('sf:none', lambda: ('err', False), 60), ('err', False))
+        self.assertIsNone(cache.get('sf:none'))
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        self.ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.icons = Category.objects.create(name='Иконки', slug='icons')
+        self.flat = Style.objects.create(name='Flat', slug='flat')
+        make_product(1, self.ui, self.flat, price=100, tags=['Figma', 'Sketch'], is_featured=True)
+        make_product(2, self.ui, None, price=700, tags=['Figma'])
+        make_product(3, self.icons, self.flat, price=9000, tags=['SVG'])
+
+    def test_counts_follow_filters(self):
+        r = self.api.get('/api/products/', {'facets': 'category,style,price,tags,featured', 'style__slug': 'flat'})
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        self.assertEqual(len(body['results']), 2)
+        f = body['facets']
+        self.assertEqual(
+            [(c['slug'], c['count']) for c in f['category']], [('ui-kit', 1), ('icons', 1)]
+        )
+        self.assertEqual([(s['slug'], s['count']) for s in f['style']], [('flat', 2)])
+        self.assertEqual([b['count'] for b in f['price']], [1, 0, 0, 0, 1])
+        self.assertEqual(f['price'][-1], {'min': 5000, 'max': None, 'count': 1})
+        self.assertEqual(f['tags'], [{'value': 'Figma', 'count': 1}, {'value': 'SVG', 'count': 1},
+                                     {'value': 'Sketch', 'count': 1}])
+        self.assertEqual(f['featured'], [{'value': True, 'count': 1}, {'value': False, 'count': 1}])
+
+    def test_whole_catalog_uses_stored_counts(self):
+        with self.assertNumQueries(4):
+            f = self.api.get('/api/products/', {'facets': 'category,style'}).json()['facets']
+        self.assertEqual([(c['slug'], c['count']) for c in f['category']], [('ui-kit', 2), ('icons', 1)])
+        self.assertEqual([(s['slug'], s['count']) for s in f['style']], [('flat', 2)])
+
+    def test_pages_and_orderings_share_facets(self):
+        r = self.api.get('/api/products/', {'facets': 'tags', 'page_size': 1, 'ordering': 'price'}).json()
+        self.assertEqual(set(r), {'next', 'previous', 'results', 'facets', 'facets_approximate'})
+        with CaptureQueriesContext(connection) as ctx:
+            self.api.get(r['next'])
+            self.api.get('/api/products/', {'facets': 'tags', 'ordering': '-price'})
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT' in q['sql'] and 'producttag' in q['sql']])
+
+    def test_scan_is_bounded(self):
+        with self.settings(PRODUCT_FACET_SCAN_LIMIT=2):
+            body = self.api.get('/api/products/', {'facets': 'price,category'}).json()
+        self.assertTrue(body['facets_approximate'])
+        self.assertEqual(sum(b['count'] for b in body['facets']['price']), 2)
+        self.assertEqual(sum(c['count'] for c in body['facets']['category']), 3)
+        self.assertEqual(len(body['results']), 3)
+
+    def test_browsable_api_and_errors(self):
+        r = self.api.get('/api/products/', {'facets': 'featured'}, HTTP_ACCEPT='text/html')
+        self.assertEqual(r.data['facets']['featured'][0], {'value': True, 'count': 1})
+        self.assertEqual(len(r.data['results']), 3)
+        r = self.api.get('/api/products/', {'facets': 'color'})
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('facets', r.json())
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.icons = make_product(1, ui, name='Иконки для приложений', price=300)
+        self.mockup = make_product(2, ui, name='Phone mockups', description='Иконки в комплекте', price=100)
+        self.kit = make_product(3, ui, name='Dashboard kit', description='Mockup of a dashboard', price=200)
+
+    def slugs(self, params):
+        r = self.api.get('/api/products/', params)
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        return [p['slug'] for p in (body['results'] if isinstance(body, dict) else body)]
+
+    def test_stemming(self):
+        from .search import stem, tokenize
+        self.assertEqual(stem('иконки'), stem('иконками'))
+        self.assertEqual(stem('Mockups'), stem('mockup'))
+        self.assertEqual(tokenize('Ёлки, 2024!'), ['елк', '2024'])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.slugs({'search': 'иконка'}), ['product-1', 'product-2'])
+        self.assertEqual(self.slugs({'search': 'mockup'}), ['product-2', 'product-3'])
+        self.assertEqual(self.slugs({'search': 'моки'}), [])
+
+    def test_limit_applies_to_rank_order_only(self):
+        with self.settings(PRODUCT_SEARCH_MAX_RESULTS=1):
+            self.assertEqual(self.slugs({'search': 'иконки'}), ['product-1'])
+            self.assertEqual(self.slugs({'search': 'иконки', 'ordering': 'price'}), ['product-2', 'product-1'])
+            self.assertEqual(len(self.slugs({'search': 'иконки', 'page_size': 5})), 2)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.kit.name = 'Иконки для дашборда'
+        self.kit.save()
+        self.assertEqual(set(self.slugs({'search': 'дашборд'})), {'product-3'})
+        self.mockup.delete()
+        self.assertEqual(self.slugs({'search': 'mockup'}), ['product-3'])
+
+    def test_rebuild_search_index(self):
+        from .search import get_backend
+        get_backend().clear()
+        self.assertEqual(self.slugs({'search': 'mockup'}), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Проиндексировано 3', out.getvalue())
+        cache.clear()
+        self.assertEqual(self.slugs({'search': 'mockup'}), ['product-2', 'product-3'])
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('u', 'u@example.com', 'pass'))
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.a = make_product(1, ui, tags=['PSD', 'Figma'])
+        self.b = make_product(2, ui, tags=['Figma'])
+        self.c = make_product(3, ui, tags=['SVG', 'PSD'])
+
+    def slugs(self, params):
+        r = self.api.get('/api/products/', params)
+        self.assertEqual(r.status_code, 200)
+        return sorted(p['slug'] for p in r.json())
+
+    def test_filter_all_and_any(self):
+        self.assertEqual(self.slugs({'tags': 'Figma,PSD'}), ['product-1'])
+        self.assertEqual(self.slugs({'tags': 'Figma, PSD', 'tags_match': 'any'}), ['product-1', 'product-2', 'product-3'])
+        self.assertEqual(self.slugs({'tags': 'Figma,Figma'}), ['product-1', 'product-2'])
+        self.assertEqual(self.slugs({'tags': 'Figma,Nope'}), [])
+        r = self.api.get('/api/products/', {'tags': 'PSD', 'tags_match': 'some'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_tags_keep_order_without_n_plus_one(self):
+        self.a.set_tags(['Figma', 'PSD', 'Figma', ' ', 'Sketch'])
+        self.assertEqual(Tag.objects.count(), 4)
+        with self.assertNumQueries(2):
+            body = self.api.get('/api/products/', {'ordering': 'price'}, HTTP_ACCEPT='text/html').data
+        self.assertEqual([p['tags'] for p in body], [['Figma', 'PSD', 'Sketch'], ['Figma'], ['SVG', 'PSD']])
+        self.assertEqual(self.api.get(f'/api/products/{self.a.pk}/').json()['tags'], ['Figma', 'PSD', 'Sketch'])
+
+    def test_changes_reach_search_and_cache(self):
+        self.assertEqual(self.slugs({'search': 'sketch'}), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.set_tags(['Sketch'])
+        self.assertEqual(self.slugs({'search': 'sketch'}), ['product-2'])
+        self.assertEqual(self.slugs({'tags': 'Sketch'}), ['product-2'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.filter(name='Sketch').get().delete()
+        self.assertEqual(self.slugs({'search': 'sketch'}), [])
+        self.assertEqual(self.api.get(f'/api/products/{self.b.pk}/').json()['tags'], [])
+
+    def test_admin_edits_tags(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-1')
+        self.client.force_login(admin)
+        url = f'/admin/marketplace/product/{self.a.pk}/change/'
+        self.assertContains(self.client.get(url), 'value="PSD, Figma"')
+        data = {
+            'name': self.a.name, 'slug': self.a.slug, 'description': self.a.description,
+            'category': self.a.category_id, 'style': Style.objects.create(name='Flat', slug='flat').pk, 'price': '100', 'image': self.a.image,
+            'author': self.a.author, 'rating': '0', 'reviews_count': '0', 'downloads': '0',
+            'tag_list': 'Sketch, Figma, Sketch',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(url, data)
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(Product.objects.get(pk=self.a.pk).tag_names, ['Sketch', 'Figma'])
+        self.assertEqual(self.slugs({'search': 'sketch'}), ['product-1'])
+
+
+class ReplicaRoutingTests(TestCase):
+    # A second in-memory SQLite database plays the replica; rows written only there
+    # show which database served a request. It is added after setUpClass, so it is
+    # not wrapped in the test transaction.
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'file:replica?mode=memory&cache=shared'},
+        })['replica']
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        super().tearDownClass()
+
+    def tearDown(self):
+        Product.objects.using('replica').all().delete()
+        Category.objects.using('replica').all().delete()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        ui = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.product = make_product(1, ui, tags=[])
+        replica_ui = Category.objects.using('replica').create(name='Replica', slug='replica')
+        Product.objects.using('replica').create(
+            name='Только на реплике', slug='replica-only', description='', category_id=replica_ui.pk, price=1,
+            image='https://example.com/p.png', author='A',
+        )
+
+    def slugs(self, path):
+        r = self.api.get(path)
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        return [row['slug'] for row in (body['results'] if isinstance(body, dict) else body)]
+
+    def test_catalog_reads_use_replica_and_writes_stick_to_primary(self):
+        with self.settings(REPLICA_DATABASES=['replica']):
+            self.assertEqual(self.slugs('/api/products/'), ['replica-only'])
+            self.assertEqual(self.slugs('/api/categories/'), ['replica'])
+            self.assertEqual(self.api.get('/api/cart/').json(), [])
+
+            r = self.api.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 1}, format='json')
+            self.assertEqual(r.status_code, 201)
+            self.assertEqual(self.slugs('/api/products/?page_size=5'), ['product-1'])
+            self.assertEqual(self.api.get('/api/cart/').json()[0]['product']['slug'], 'product-1')
+
+            cache.clear()
+            self.assertEqual(self.slugs('/api/products/?page_size=5'), ['replica-only'])
+
+    def test_without_replicas_everything_reads_the_primary(self):
+        self.assertEqual(self.slugs('/api/products/'), ['product-1'])
+        self.assertEqual(self.slugs('/api/styles/'), [])
+
+
+class SQLiteProfileTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('u', 'u@example.com', 'pass')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.product = make_product(1, Category.objects.create(name='UI Kit', slug='ui-kit'))
+        self.tuned = self.settings(SQLITE_PROFILE=settings.SQLITE_PROFILES['tuned'])
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with self.tuned:
+            conn = connections.create_connection('default')
+            try:
+                with conn.cursor() as c:
+                    values = {}
+                    for name in ('synchronous', 'busy_timeout', 'cache_size', 'temp_store'):
+                        c.execute(f'PRAGMA {name}')
+                        values[name] = c.fetchone()[0]
+            finally:
+                conn.close()
+        self.assertEqual(values, {'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -65536, 'temp_store': 2})
+
+    def test_cart_writes_retry_on_lock_errors(self):
+        add = CartItem.objects.add_quantity
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return add(*args, **kwargs)
+
+        body = {'product_id': self.product.pk, 'quantity': 2}
+        with mock.patch.object(CartItem.objects, 'add_quantity', side_effect=flaky):
+            with self.assertRaises(OperationalError):
+                self.api.post('/api/cart/', body, format='json')
+            calls.clear()
+            with self.tuned:
+                r = self.api.post('/api/cart/', body, format='json')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 2)
+
+
+class ClaimsAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['revocations'].clear()
+        self.user = User.objects.create_user('claims', 'claims@example.com', 'claims-pass-1')
+        r = APIClient().post('/api/login/', {'username': 'claims', 'password': 'claims-pass-1'}, format='json')
+        self.access, self.refresh = r.data['access'], r.data['refresh']
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def user_queries(self, path='/api/cart/total/'):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.api.get(path)
+        self.assertEqual(r.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries if 'auth_user' in q['sql']]
+
+    def test_user_comes_from_token_claims(self):
+        self.assertEqual(self.user_queries(), [])
+        with self.settings(JWT_AUTH_MODE='db'):
+            self.assertEqual(len(self.user_queries()), 1)
+
+    def test_tokens_without_claims_are_looked_up_once(self):
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+    def test_claims_user_saves_only_loaded_fields(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .auth import ClaimsJWTAuthentication
+        user = ClaimsJWTAuthentication().get_user(AccessToken(self.access))
+        self.assertEqual((user.pk, user.username, user.email), (self.user.pk, 'claims', 'claims@example.com'))
+        user.email = 'new@example.com'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'new@example.com')
+        self.assertTrue(self.user.check_password('claims-pass-1'))
+        self.assertFalse(user.is_staff)
+
+    def test_refresh_signs_current_claims(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        User.objects.filter(pk=self.user.pk).update(email='changed@example.com')
+        r = APIClient().post('/token/refresh/', {'refresh': self.refresh}, format='json')
+        self.assertEqual(AccessToken(r.data['access'])['email'], 'changed@example.com')
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        self.assertEqual(self.api.get('/api/cart/total/').status_code, 200)
+        r = self.api.post('/api/logout/', {'refresh': self.refresh}, format='json')
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(self.api.get('/api/cart/total/').status_code, 401)
+        r = APIClient().post('/token/refresh/', {'refresh': self.refresh}, format='json')
+        self.assertEqual(r.status_code, 401)
+
+    def test_password_change_and_deactivation_revoke_all_tokens(self):
+        for change in ({'password': 'claims-pass-2'}, {'is_active': False}):
+            with self.subTest(**change):
+                caches['revocations'].clear()
+                token = ClaimsRefreshToken.for_user(self.user).access_token
+                self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.assertEqual(self.api.get('/api/cart/total/').status_code, 200)
+                # The revocation lands a second after the token was issued.
+                with mock.patch('marketplace.auth.time.time', return_value=time.time() + 1):
+                    self.user.set_password(change.get('password', 'claims-pass-1'))
+                    self.user.is_active = change.get('is_active', True)
+                    self.user.save()
+                self.assertEqual(self.api.get('/api/cart/total/').status_code, 401)
+
+    def test_login_right_after_password_change(self):
+        self.user.set_password('claims-pass-2')
+        self.user.save()
+        r = APIClient().post('/api/login/', {'username': 'claims', 'password': 'claims-pass-2'}, format='json')
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {r.data["access"]}')
+        self.assertEqual(self.api.get('/api/cart/total/').status_code, 200)
+
+    def test_revocations_survive_read_cache_churn(self):
+        self.api.post('/api/logout/', {'refresh': self.refresh}, format='json')
+        cache.clear()
+        self.assertEqual(self.api.get('/api/cart/total/').status_code, 401)
+
+    def test_claims_mode_needs_a_shared_revocation_store(self):
+        from .auth import check_revocation_store
+        self.assertEqual([e.id for e in check_revocation_store(None)], ['marketplace.E001'])
+        with self.settings(JWT_AUTH_MODE='db'):
+            self.assertEqual(check_revocation_store(None), [])
+        with self.settings(CACHES={**settings.CACHES, 'revocations': settings.JWT_REVOCATION_STORES['file']}):
+            self.assertEqual(check_revocation_store(None), [])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.buckets().clear()
+        self.user = User.objects.create_user('limited', 'limited@example.com', 'limited-pass-1')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_login_is_limited_per_ip_with_retry_after(self):
+        body = {'username': 'limited', 'password': 'wrong'}
+        with self.settings(RATE_LIMITS={'anon': '100/min', 'login': '2/min'}):
+            codes = [APIClient().post('/api/login/', body, format='json').status_code for _ in range(3)]
+            r = APIClient().post('/token/', body, format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(codes, [401, 401, 429])
+        self.assertEqual(r.status_code, 401)
+
+    def test_forwarded_for_does_not_reset_the_bucket(self):
+        body = {'username': 'limited', 'password': 'wrong'}
+        with self.settings(RATE_LIMITS={'login': '2/min'}):
+            codes = [
+                APIClient().post('/api/login/', body, format='json', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}').status_code
+                for i in range(3)
+            ]
+            self.assertEqual(codes, [401, 401, 429])
+            # Behind one proxy the client is the address it appended.
+            with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+                r = APIClient().post('/api/login/', body, format='json', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.9')
+        self.assertEqual(r.status_code, 401)
+
+    def test_throttled_response_has_retry_after(self):
+        with self.settings(RATE_LIMITS={'login': '1/min'}):
+            APIClient().post('/api/login/', {}, format='json')
+            r = APIClient().post('/api/login/', {}, format='json')
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(r['Retry-After'], '60')
+        self.assertEqual((r['RateLimit-Limit'], r['RateLimit-Remaining']), ('1', '0'))
+
+    def test_search_has_its_own_budget(self):
+        make_product(1, Category.objects.create(name='UI Kit', slug='ui-kit'))
+        with self.settings(RATE_LIMITS={'user': '10/min', 'search': '1/min'}):
+            self.assertEqual(self.api.get('/api/products/?search=product').status_code, 200)
+            self.assertEqual(self.api.get('/api/products/?search=product').status_code, 429)
+            r = self.api.get('/api/products/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r['RateLimit-Limit'], r['RateLimit-Remaining']), ('10', '7'))
+
+    def test_checkout_is_limited_per_user(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other'))
+        with self.settings(RATE_LIMITS={'checkout': '1/min'}):
+            codes = [self.api.post('/api/orders/', {}, format='json').status_code for _ in range(2)]
+            self.assertEqual(self.api.get('/api/orders/').status_code, 200)
+            self.assertNotEqual(other.post('/api/orders/', {}, format='json').status_code, 429)
+        self.assertEqual(codes[1], 429)
+
+    def test_buckets_refill_over_time(self):
+        for backend in ('local', 'cache'):
+            with self.subTest(backend), self.settings(RATE_LIMIT_BACKEND=backend):
+                b = throttling.buckets()
+                self.assertEqual([b.take(backend, 2, 1.0, 100.0)[0] for _ in range(3)], [True, True, False])
+                self.assertTrue(b.take(backend, 2, 1.0, 101.0)[0])
+                self.assertFalse(b.take(backend, 2, 1.0, 101.5)[0])
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cat = Category.objects.create(name='UI Kit', slug='ui-kit')
+        style = Style.objects.create(name='Flat', slug='flat')
+        for i in range(5):
+            make_product(i, cat, style, is_featured=i % 2 == 0, downloads=i * 10, tags=['Figma', f'T{i}'])
+        self.user = User.objects.create_user('async', 'async@example.com')
+        self.auth = f'Bearer {ClaimsRefreshToken.for_user(self.user).access_token}'
+        self.product = Product.objects.first()
+
+    async def aget(self, path, **headers):
+        with self.settings(ROOT_URLCONF='marketplace.async_urls', MIDDLEWARE=settings.ASGI_CATALOG_MIDDLEWARE):
+            return await self.async_client.get(path, headers={'Authorization': self.auth, **headers})
+
+    async def fast_get(self, path, **headers):
+        # Fails if the request is handed to the DRF viewset.
+        from .async_views import AsyncCatalogView
+        with mock.patch.object(AsyncCatalogView, 'fallback', side_effect=AssertionError(path)):
+            return await self.aget(path, **headers)
+
+    def sync_get(self, path):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=self.auth)
+        return api.get(path)
+
+    async def test_responses_match_sync_views(self):
+        paths = [
+            '/api/categories/', '/api/styles/', '/api/products/', '/api/products/?tags=T1,T2&tags_match=any',
+            '/api/products/?ordering=price&page_size=2', '/api/products/?category__slug=ui-kit&max_price=103',
+            '/api/products/featured/', '/api/products/featured/?page_size=2', '/api/products/popular/',
+            f'/api/products/{self.product.pk}/',
+        ]
+        from asgiref.sync import sync_to_async
+        with self.settings(RESPONSE_CACHE_TTL=0, PRODUCT_FEEDS_TTL=0):
+            for path in paths:
+                expected = await sync_to_async(self.sync_get)(path)
+                r = await self.fast_get(path)
+                with self.subTest(path):
+                    self.assertEqual(r.status_code, 200)
+                    self.assertEqual(r.content, expected.content)
+                    for header in ('Content-Type', 'ETag', 'Cache-Control', 'Vary', 'Allow'):
+                        self.assertEqual(r[header], expected[header])
+
+    async def test_cursor_pages_follow_through(self):
+        r = await self.fast_get('/api/products/?page_size=2')
+        seen = [p['id'] for p in json.loads(r.content)['results']]
+        while json.loads(r.content)['next']:
+            r = await self.fast_get(json.loads(r.content)['next'].replace('http://testserver', ''))
+            seen += [p['id'] for p in json.loads(r.content)['results']]
+        self.assertEqual(len(set(seen)), 5)
+
+    async def test_cache_hit_and_not_modified(self):
+        first = await self.fast_get('/api/products/')
+        second = await self.fast_get('/api/products/')
+        self.assertEqual(second.content, first.content)
+        r = await self.fast_get('/api/products/', **{'If-None-Match': first['ETag']})
+        self.assertEqual(r.status_code, 304)
+
+    async def test_other_requests_fall_back_to_viewsets(self):
+        r = await self.aget('/api/products/?search=product%201')
+        self.assertEqual([p['name'] for p in json.loads(r.content)], ['Product 1'])
+        self.assertEqual((await self.aget('/api/products/', Authorization='')).status_code, 401)
+        self.assertEqual((await self.aget('/api/products/0/')).status_code, 404)
+        self.assertEqual((await self.aget('/api/products/?cursor=bad')).status_code, 404)
+        r = await self.aget('/api/products/', Accept='text/html')
+        self.assertIn(b'<html', r.content)
+
+    async def test_rate_limits_apply(self):
+        with self.settings(RATE_LIMITS={'user': '1/min'}):
+            self.assertEqual((await self.fast_get('/api/categories/')).status_code, 200)
+            r = await self.fast_get('/api/categories/')
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual((r['Retry-After'], r['RateLimit-Remaining']), ('60', '0'))
+
+    async def test_anonymous_reads_stay_on_the_event_loop(self):
+        from asgiref.sync import sync_to_async
+        from rest_framework.permissions import AllowAny
+        from .views import ProductViewSet
+        expected = await sync_to_async(APIClient().get)('/api/products/')
+        r = await self.fast_get('/api/products/', Authorization='')
+        self.assertEqual((r.status_code, r.content), (401, expected.content))
+        self.assertEqual(r['WWW-Authenticate'], expected['WWW-Authenticate'])
+
+        with mock.patch.object(ProductViewSet, 'permission_classes', [AllowAny]):
+            with self.settings(RATE_LIMITS={'anon': '1/min'}):
+                r = await self.fast_get('/api/products/', Authorization='')
+                self.assertEqual(len(json.loads(r.content)), 5)
+                self.assertEqual((await self.fast_get('/api/products/', Authorization='')).status_code, 429)
+                # Per client IP: a user has their own bucket.
+                self.assertEqual((await self.fast_get('/api/products/')).status_code, 200)
+
+    async def test_shared_stores_are_read_off_the_event_loop(self):
+        import asyncio
+        import tempfile
+        from django.core.cache.backends.filebased import FileBasedCache
+        on_loop = []
+
+        def watch(name):
+            original = getattr(FileBasedCache, name)
+
+            def method(self, *args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(name)
+                except RuntimeError:
+                    pass
+                return original(self, *args, **kwargs)
+            return mock.patch.object(FileBasedCache, name, method)
+
+        with tempfile.TemporaryDirectory() as d:
+            stores = {
+                **settings.CACHES,
+                **{alias: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(d, alias)}
+                   for alias in ('default', 'revocations', 'generations')},
+            }
+            with self.settings(CACHES=stores, RATE_LIMIT_BACKEND='cache', RATE_LIMITS={'user': '100/min'}), \
+                    watch('get'), watch('set'), watch('add'):
+                for path in ('/api/products/', '/api/products/', '/api/products/popular/', '/api/categories/'):
+                    self.assertEqual((await self.fast_get(path)).status_code, 200)
+        self.assertEqual(on_loop, [])
+
+    def test_handler_takes_catalog_reads_only(self):
+        from .asgi import CatalogASGIHandler
+        handler = CatalogASGIHandler()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/products/1/'}
+        self.assertTrue(handler.handles(scope))
+        self.assertFalse(handler.handles({**scope, 'method': 'OPTIONS'}))
+        self.assertFalse(handler.handles({**scope, 'path': '/api/cart/'}))
+        self.assertFalse(handler.handles({**scope, 'type': 'websocket'}))
+
+
+@override_settings(EXPORT_COMMIT_MARGIN=0)
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.other = Category.objects.create(name='Icons', slug='icons')
+        self.style = Style.objects.create(name='Flat', slug='flat')
+        for i in range(5):
+            make_product(i, self.cat if i < 4 else self.other, self.style if i % 2 else None, tags=[f'T{i}', 'Figma'])
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('partner'))
+
+    def export(self, query='', **extra):
+        r = self.api.get('/api/products/export/' + query, **extra)
+        self.assertEqual(r.status_code, 200, getattr(r, 'content', b''))
+        return r, b''.join(r.streaming_content)
+
+    def test_ndjson_rows_in_update_order(self):
+        r, body = self.export()
+        self.assertEqual(r['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['slug'] for row in rows], [f'product-{i}' for i in range(5)])
+        self.assertEqual(rows[1]['tags'], ['T1', 'Figma'])
+        self.assertEqual((rows[1]['category'], rows[1]['style'], rows[0]['style']), ('ui-kit', 'flat', None))
+        self.assertEqual(rows[0]['price'], '100.00')
+
+    def test_search_is_not_capped(self):
+        with self.settings(PRODUCT_SEARCH_MAX_RESULTS=2):
+            r, body = self.export('?search=figma')
+        self.assertEqual([json.loads(line)['slug'] for line in body.splitlines()], [f'product-{i}' for i in range(5)])
+
+    def test_csv_with_filters_in_small_chunks(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            r, body = self.export('?format=csv&category__slug=ui-kit&min_price=101')
+        self.assertTrue(r['Content-Type'].startswith('text/csv'))
+        import csv
+        rows = list(csv.DictReader(body.decode().splitlines()))
+        self.assertEqual([row['slug'] for row in rows], ['product-1', 'product-2', 'product-3'])
+        self.assertEqual((rows[0]['tags'], rows[0]['is_featured'], rows[1]['style']), ('T1,Figma', 'false', ''))
+
+    def test_since_returns_rows_changed_after_previous_export(self):
+        r, _ = self.export()
+        since = r['X-Export-Next-Since']
+        Product.objects.filter(slug='product-3').update(downloads=10)
+        Product.objects.get(slug='product-1').set_tags(['New'])
+        _, body = self.export('?since=' + since.replace('Z', '+00:00'))
+        self.assertEqual([json.loads(line)['slug'] for line in body.splitlines()], ['product-3', 'product-1'])
+        self.assertEqual(self.api.get('/api/products/export/?since=yesterday').status_code, 400)
+
+    def test_recent_rows_wait_for_the_next_export(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        Product.objects.exclude(slug='product-4').update(updated_at=timezone.now() - timedelta(minutes=5))
+        with self.settings(EXPORT_COMMIT_MARGIN=60):
+            r, body = self.export()
+            self.assertEqual(len(body.splitlines()), 4)
+            # product-4 may still be in an open transaction; the next export picks it up.
+            since = r['X-Export-Next-Since']
+            with mock.patch('marketplace.export.timezone.now', return_value=timezone.now() + timedelta(minutes=2)):
+                _, body = self.export('?since=' + since)
+        self.assertEqual([json.loads(line)['slug'] for line in body.splitlines()], ['product-4'])
+
+    def test_gzip_when_accepted(self):
+        import gzip
+        r, body = self.export(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(r['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 5)
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        import tempfile
+        self.cat = Category.objects.create(name='UI Kit', slug='ui-kit')
+        self.style = Style.objects.create(name='Flat', slug='flat')
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def row(self, n, **kwargs):
+        data = {
+            'slug': f'imported-{n}', 'name': f'Imported {n}', 'description': 'Импорт', 'category': 'ui-kit',
+            'style': 'flat', 'price': '10.50', 'image': 'https://example.com/i.png', 'author': 'Partner',
+            'tags': ['Figma', f'T{n}'],
+        }
+        data.update(kwargs)
+        return data
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def ndjson(self, name, rows):
+        return self.write(name, ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in rows))
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command('import_products', *args, stdout=out)
+        return out.getvalue()
+
+    def test_upsert_by_slug_keeps_created_at(self):
+        old = make_product(1, self.cat, slug='imported-1', tags=['Old'])
+        path = self.ndjson('p.ndjson', [self.row(1, price='99'), self.row(2, style=None)])
+        self.run_import(path, '--chunk-size', '1')
+        p = Product.objects.get(slug='imported-1')
+        self.assertEqual((p.pk, p.created_at, p.price, p.style_id), (old.pk, old.created_at, Decimal('99'), self.style.pk))
+        self.assertGreater(p.updated_at, old.updated_at)
+        self.assertEqual(p.tag_names, ['Figma', 'T1'])
+        self.assertIsNone(Product.objects.get(slug='imported-2').style_id)
+        self.cat.refresh_from_db()
+        self.assertEqual(self.cat.products_count, 2)
+        self.assertFalse(os.path.exists(path + '.checkpoint.json'))
+        self.assertFalse(os.path.exists(path + '.rejects.ndjson'))
+
+    def test_invalid_rows_go_to_rejects(self):
+        path = self.write('p.ndjson', '\n'.join([
+            json.dumps(self.row(1)),
+            json.dumps(self.row(2, category='nope', price='-1')),
+            '{broken',
+            json.dumps(self.row(3, slug='with space', rating='7')),
+            json.dumps(self.row(4, downloads=2**70, reviews_count=1.9)),
+            json.dumps(self.row(5, downloads=3.0, reviews_count='12')),
+        ]) + '\n')
+        out = self.run_import(path)
+        self.assertIn('отклонено 4', out)
+        self.assertEqual(
+            list(Product.objects.order_by('slug').values_list('slug', 'downloads', 'reviews_count')),
+            [('imported-1', 0, 0), ('imported-5', 3, 12)],
+        )
+        with open(path + '.rejects.ndjson', encoding='utf-8') as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([r['row'] for r in rejects], [2, 3, 4, 5])
+        self.assertEqual(set(rejects[0]['errors']), {'category', 'price'})
+        self.assertEqual(rejects[1]['data'], '{broken')
+        self.assertEqual(set(rejects[2]['errors']), {'slug', 'rating'})
+        self.assertEqual(set(rejects[3]['errors']), {'downloads', 'reviews_count'})
+
+    def test_csv_with_multiline_values(self):
+        path = self.write('p.csv', (
+            'slug,name,description,category,style,price,image,author,tags,is_featured\n'
+            'a,A,"две\nстроки",ui-kit,,1,https://example.com/a.png,X,"Figma,Sketch",true\n'
+            'b,B,Б,ui-kit,flat,2,https://example.com/b.png,X,,false\n'
+        ))
+        self.run_import(path)
+        a = Product.objects.get(slug='a')
+        self.assertEqual((a.description, a.is_featured, a.tag_names), ('две\nстроки', True, ['Figma', 'Sketch']))
+        self.assertEqual(Product.objects.get(slug='b').tag_names, [])
+
+    def test_resumes_from_checkpoint(self):
+        path = self.ndjson('p.ndjson', [self.row(i) for i in range(5)])
+        with open(path, 'rb') as f:
+            offset = sum(len(next(f)) for _ in range(3))
+        with open(path + '.checkpoint.json', 'w') as f:
+            json.dump({'offset': offset, 'rows': 3, 'imported': 3, 'rejected': 0, 'size': os.path.getsize(path)}, f)
+        out = self.run_import(path, '--chunk-size', '2')
+        self.assertIn('продолжение со строки 4', out)
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['imported-3', 'imported-4'])
+
+        with open(path + '.checkpoint.json', 'w') as f:
+            json.dump({'offset': offset, 'rows': 3, 'imported': 3, 'rejected': 0, 'size': 1}, f)
+        with self.assertRaises(CommandError):
+            self.run_import(path)
+        self.run_import(path, '--restart')
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_dry_run_writes_nothing(self):
+        path = self.ndjson('p.ndjson', [self.row(1), self.row(2, price='x')])
+        out = self.run_import(path, '--dry-run')
+        self.assertIn('проверено 1, отклонено 1', out)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(os.path.exists(path + '.checkpoint.json'))
@@ -0,0 +1,150 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from .caching import blocks
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # "N/period" -> (bucket capacity, tokens refilled per second).
+    num, period = rate.split('/')
+    return int(num), int(num) / PERIODS[period[0]]
+
+
+def refill(state, capacity, per_second, now):
+    tokens, ts = state or (capacity, now)
+    tokens = min(capacity, tokens + (now - ts) * per_second)
+    allowed = tokens >= 1
+    return allowed, tokens - 1 if allowed else tokens
+
+
+class LocalBuckets:
+    # In process memory: limits hold per process. Past max_keys the least recently
+    # used buckets are dropped, which only makes them full again.
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now):
+        with self._lock:
+            allowed, tokens = refill(self._buckets.get(key), capacity, per_second, now)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    # In the marketplace cache, shared by processes with the file or redis backend.
+    # get and set are not atomic, so concurrent requests may overdraw a bucket slightly.
+    def take(self, key, capacity, per_second, now):
+        allowed, tokens = refill(cache.get(key), capacity, per_second, now)
+        cache.set(key, (tokens, now), math.ceil(capacity / per_second) + 1)
+        return allowed, tokens
+
+    def clear(self):
+        pass
+
+
+_local = LocalBuckets(getattr(settings, 'RATE_LIMIT_MAX_KEYS', 100_000))
+_shared = CacheBuckets()
+
+
+def buckets():
+    return _shared if getattr(settings, 'RATE_LIMIT_BACKEND', 'local') == 'cache' else _local
+
+
+def consume(request, scope, ident):
+    # Takes a token from the scope's bucket of ident; returns seconds to wait, or None
+    # when allowed. Rates come from settings.RATE_LIMITS, a scope without one is not limited.
+    rate = scope and getattr(settings, 'RATE_LIMITS', {}).get(scope)
+    if not rate:
+        return None
+    capacity, per_second = parse_rate(rate)
+    allowed, tokens = buckets().take(f'marketplace:ratelimit:{scope}:{ident}', capacity, per_second, time.time())
+    # The headers report the tightest bucket of the request.
+    current = getattr(request, 'ratelimit', None)
+    if current is None or tokens < current[1]:
+        request.ratelimit = (capacity, tokens, (capacity - tokens) / per_second)
+    return None if allowed else (1 - tokens) / per_second
+
+
+async def aconsume(request, scope, ident):
+    # consume() for the event loop: buckets in a file or redis cache take a thread.
+    if buckets() is _local or not blocks(cache):
+        return consume(request, scope, ident)
+    return await sync_to_async(consume, thread_sensitive=False)(request, scope, ident)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    wait_seconds = None
+
+    def get_scope(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        user = request.user
+        ident = f'u{user.pk}' if user and user.is_authenticated else self.get_ident(request)
+        self.wait_seconds = consume(request._request, self.get_scope(request, view), ident)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientRateThrottle(TokenBucketThrottle):
+    # Every API request: per user when authenticated, per IP otherwise.
+    def get_scope(self, request, view):
+        return 'user' if request.user and request.user.is_authenticated else 'anon'
+
+
+class EndpointRateThrottle(TokenBucketThrottle):
+    # Scope from view.get_throttle_scope() or view.throttle_scope, e.g. search or login.
+    def get_scope(self, request, view):
+        get_scope = getattr(view, 'get_throttle_scope', None)
+        return get_scope() if get_scope else getattr(view, 'throttle_scope', None)
+
+
+class RateLimitHeadersMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(request, await self.get_response(request))
+
+    def add_headers(self, request, response):
+        limit = getattr(request, 'ratelimit', None)
+        if limit is not None:
+            capacity, tokens, reset = limit
+            response['RateLimit-Limit'] = str(capacity)
+            response['RateLimit-Remaining'] = str(int(tokens))
+            response['RateLimit-Reset'] = str(math.ceil(reset))
+        return response
@@ -1,40 +1,145 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import  IsAuthenticated
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Category, Style, Product, Favorite, CartItem, Order
+from . import facets, fastjson, feeds
+from .caching import CachedReadMixin, cached
+from .conditional import ConditionalMixin, conditional
+from .export import CSVRenderer, NDJSONRenderer, export_response, parse_since
+from .filters import ProductSearchFilter
+from .pagination import ProductKeysetPagination
+from .routers import ReplicaReadMixin
+from .sqlite import LockRetryMixin
+from .models import Category, Style, Product, Favorite, CartItem, Order, OrderItem, tags_prefetch
 from .serializers import (
     CategorySerializer, StyleSerializer, ProductListSerializer,
-    ProductDetailSerializer, FavoriteSerializer, CartItemSerializer, OrderSerializer
+    ProductDetailSerializer, FavoriteSerializer, CartItemSerializer, OrderSerializer,
+    BulkItemSerializer
 )
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def bulk_items(request):
+    s = BulkItemSerializer(
+        data=request.data, many=True, allow_empty=False,
+        max_length=getattr(settings, 'BULK_MAX_ITEMS', 500),
+    )
+    s.is_valid(raise_exception=True)
+    items = {}
+    for i in s.validated_data:
+        items[i['product_id']] = items.get(i['product_id'], 0) + i['quantity']
+    return items
+
+
+def found_products(items):
+    # Called inside the write transaction, right before the rows are written.
+    return set(Product.objects.filter(pk__in=items).values_list('pk', flat=True))
+
+
+def bulk_results(items, rows):
+    # A product deleted after found_products() has no row either.
+    res = []
+    for pid in items:
+        if pid not in rows:
+            res.append({'product_id': pid, 'status': 'error', 'error': 'Продукт не найден'})
+        else:
+            res.append({'product_id': pid, 'status': 'ok', **rows[pid]})
+    return Response({'results': res})
+
+
+class FastListMixin:
+    # JSON list responses are built from .values() rows by fastjson instead of the
+    # serializer; the browsable API and other formats keep the DRF path.
+    row_serializer = None
+
+    def get_list_extras(self, queryset):
+        return None
+
+    def with_extras(self, body, extras):
+        # Extra keys (e.g. facets) turn a bare array into {'results': [...], ...}.
+        if not extras:
+            return body
+        if isinstance(body, dict):
+            return {**body, **extras}
+        return {'results': body, **extras}
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            response = super().list(request, *args, **kwargs)
+            extras = self.get_list_extras(self.filter_queryset(self.get_queryset()))
+            response.data = self.with_extras(response.data, extras)
+            return response
+        return self.fast_response(self.filter_queryset(self.get_queryset()))
+
+    def fast_response(self, queryset, paginate=True):
+        rs = self.row_serializer
+        extras = self.get_list_extras(queryset) if paginate else None
+        rows = rs.values(queryset)
+        page = self.paginate_queryset(rows) if paginate else None
+        if page is not None:
+            body = self.paginator.get_paginated_data(rs.to_representation(page))
+        elif extras:
+            body = rs.to_representation(rows)
+        else:
+            return HttpResponse(rs.render(rows), content_type='application/json')
+        return HttpResponse(fastjson.dumps(self.with_extras(body, extras)), content_type='application/json')
+
+
+class CategoryViewSet(ReplicaReadMixin, ConditionalMixin, CachedReadMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    row_serializer = fastjson.CATEGORY_LIST
+    generations = ('taxonomies',)
+    cache_control = {'private': True, 'max_age': 60}
     lookup_field = 'slug'
 
 
-class StyleViewSet(viewsets.ReadOnlyModelViewSet):
+class StyleViewSet(ReplicaReadMixin, ConditionalMixin, CachedReadMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Style.objects.all()
     serializer_class = StyleSerializer
+    row_serializer = fastjson.STYLE_LIST
+    generations = ('taxonomies',)
+    cache_control = {'private': True, 'max_age': 60}
     lookup_field = 'slug'
 
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Product.objects.select_related('category', 'style').all()
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+class ProductViewSet(ReplicaReadMixin, ConditionalMixin, CachedReadMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Product.objects.select_related('category', 'style').with_tags()
+    row_serializer = fastjson.PRODUCT_LIST
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
     filterset_fields = ['category__slug', 'style__slug', 'is_featured']
-    search_fields = ['name', 'description', 'author', 'tags']
+    search_fields = ['name', 'description', 'author', 'tags__name']
     ordering_fields = ['price', 'rating', 'downloads', 'created_at']
     ordering = ['-created_at']
+    pagination_class = ProductKeysetPagination
+
+    def get_throttle_scope(self):
+        if self.action == 'export':
+            return 'export'
+        return 'search' if self.request.query_params.get('search') else None
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductListSerializer
 
+    def get_list_extras(self, queryset):
+        names = facets.parse(self.request.query_params.get('facets'))
+        if names:
+            return facets.counts(queryset, names, self.request.query_params)
+        return None
+
     def get_queryset(self):
         q = super().get_queryset()
         minp = self.request.query_params.get('min_price')
@@ -52,12 +157,31 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         st = self.request.query_params.get('style')
         if st:
             q = q.filter(style__name=st)
-        
+
+        tags = [t.strip() for t in self.request.query_params.get('tags', '').split(',') if t.strip()]
+        if tags:
+            match = self.request.query_params.get('tags_match', 'all')
+            if match not in ('all', 'any'):
+                raise ValidationError({'tags_match': 'Допустимые значения: all, any'})
+            q = q.tagged(tags, match_all=match == 'all')
+
         return q
 
+    def cached_feed(self, request, name):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return None
+        return HttpResponse(feeds.get(name), content_type='application/json')
+
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached
     def featured(self, request):
+        r = self.cached_feed(request, 'featured')
+        if r is not None:
+            return r
         items = self.get_queryset().filter(is_featured=True)
+        if request.accepted_renderer.format == 'json':
+            return self.fast_response(items)
         p = self.paginate_queryset(items)
         if p is not None:
             s = self.get_serializer(p, many=True)
@@ -66,33 +190,95 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(s.data)
 
     @action(detail=False, methods=['get'])
+    @conditional
+    @cached
     def popular(self, request):
-        items = self.get_queryset().order_by('-downloads')[:12]
+        r = self.cached_feed(request, 'popular')
+        if r is not None:
+            return r
+        items = self.get_queryset().order_by('-downloads', '-id')[:feeds.POPULAR_SIZE]
+        if request.accepted_renderer.format == 'json':
+            return self.fast_response(items, paginate=False)
         s = self.get_serializer(items, many=True)
         return Response(s.data)
 
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    @method_decorator(gzip_page)
+    def export(self, request):
+        # ?format=ndjson|csv, the list filters and ?since=; streamed, never cached.
+        since = parse_since(request.query_params.get('since'))
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(queryset, request.accepted_renderer.format, since)
+
 
-class FavoriteViewSet(viewsets.ModelViewSet):
+class FavoriteViewSet(LockRetryMixin, viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user).select_related('product')
+        q = Favorite.objects.filter(user=self.request.user).select_related('product__category', 'product__style')
+        return q if self.action == 'destroy' else q.prefetch_related(tags_prefetch('product__'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        items = bulk_items(request)
+        with transaction.atomic():
+            found = found_products(items)
+            Favorite.objects.bulk_create(
+                [Favorite(user=request.user, product_id=pid) for pid in items if pid in found],
+                ignore_conflicts=True,
+            )
+        rows = {
+            pid: {'id': pk}
+            for pid, pk in Favorite.objects.filter(user=request.user, product_id__in=found).values_list('product_id', 'pk')
+        }
+        return bulk_results(items, rows)
+
 
-class CartItemViewSet(viewsets.ModelViewSet):
+class CartItemViewSet(LockRetryMixin, viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user).select_related('product')
+        q = (
+            CartItem.objects.filter(user=self.request.user)
+            .select_related('product__category', 'product__style')
+            .annotate(total_price=ExpressionWrapper(F('quantity') * F('product__price'), output_field=MONEY))
+        )
+        return q if self.action == 'destroy' else q.prefetch_related(tags_prefetch('product__'))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        mode = request.query_params.get('mode', 'add')
+        if mode not in ('add', 'set'):
+            return Response({'mode': 'Допустимые значения: add, set'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = bulk_items(request)
+        with transaction.atomic():
+            found = found_products(items)
+            ok = {pid: q for pid, q in items.items() if pid in found}
+            if mode == 'set':
+                CartItem.objects.bulk_create(
+                    [CartItem(user=request.user, product_id=pid, quantity=q) for pid, q in ok.items()],
+                    update_conflicts=True,
+                    unique_fields=['user', 'product'],
+                    update_fields=['quantity'],
+                )
+            else:
+                CartItem.objects.add_quantities(request.user, ok)
+        rows = {
+            pid: {'id': pk, 'quantity': q}
+            for pid, pk, q in CartItem.objects.filter(user=request.user, product_id__in=ok)
+            .values_list('product_id', 'pk', 'quantity')
+        }
+        return bulk_results(items, rows)
+
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         CartItem.objects.filter(user=request.user).delete()
@@ -100,17 +286,32 @@ class CartItemViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def total(self, request):
-        items = self.get_queryset()
-        t = sum(i.get_total_price() for i in items)
-        return Response({'total': t, 'items_count': items.count()})
+        r = CartItem.objects.filter(user=request.user).aggregate(
+            total=Coalesce(Sum(F('quantity') * F('product__price'), output_field=MONEY), Value(0), output_field=MONEY),
+            items_count=Count('pk'),
+        )
+        return Response(r)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(LockRetryMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_throttle_scope(self):
+        return 'checkout' if self.action == 'create' else None
+
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+        return (
+            Order.objects.filter(user=self.request.user)
+            .select_related('user')
+            .prefetch_related(
+                Prefetch(
+                    'items',
+                    OrderItem.objects.select_related('product__category', 'product__style')
+                    .prefetch_related(tags_prefetch('product__')),
+                )
+            )
+        )
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
\ No newline at end of file